@@ -0,0 +1,297 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import zipfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pygments  # noqa: E402
+from PyQt5.Qsci import QsciScintilla  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from src.API import LumosAPI  # noqa: E402
+from src.lexer import (  # noqa: E402
+    BaseLexer,
+    JsonLexer,
+    MarkdownLexer,
+    PlainTextLexer,
+    PygmentsBaseLexer,
+    PythonCustomLexer,
+    PythonLexer,
+)
+
+BUILTIN_LEXERS = {
+    "python": (PythonLexer, ".py"),
+    "python-fast": (PythonCustomLexer, ".py"),
+    "json": (JsonLexer, ".json"),
+    "markdown": (MarkdownLexer, ".md"),
+    "plain": (PlainTextLexer, ".txt"),
+}
+
+REAL_CORPORA = {
+    ".py": [os.path.join(ROOT, "lumos_editor.pyw"), os.path.join(ROOT, "src", "*.py")],
+    ".json": [os.path.join(ROOT, "themes", "*", "theme.json")],
+    ".md": [os.path.join(ROOT, "README.md")],
+    ".txt": [os.path.join(ROOT, "LICENSE")],
+    ".js": [os.path.join(ROOT, "plugins", "examples", "js-lexer", "*.js")],
+}
+
+# Lines a keystroke restyle covers, roughly one screen.
+SCREEN_LINES = 60
+
+
+def synthetic_lines(ext, rng):
+    if ext == ".py":
+        while True:
+            n = rng.randrange(1000)
+            yield f"class Widget{n}(Base):"
+            yield f'    """Docstring for widget {n}."""'
+            yield ""
+            yield f"    def method_{n}(self, value=0x{n:x}, *args, **kwargs):"
+            yield f"        # compute something for {n}"
+            yield f"        result = [i * {n}.5 for i in range(value) if i % 3]"
+            yield f"        return f\"{{self.name}}: {{len(result)}}\" + 'done'"
+            yield ""
+    elif ext == ".json":
+        yield "["
+        while True:
+            n = rng.randrange(1000)
+            yield "  {"
+            yield f'    "id": {n},'
+            yield f'    "name": "item-{n}",'
+            yield f'    "ratio": {n / 7:.4f},'
+            yield f'    "enabled": {"true" if n % 2 else "false"},'
+            yield '    "parent": null'
+            yield "  },"
+    elif ext == ".md":
+        while True:
+            n = rng.randrange(1000)
+            yield f"## Section {n}"
+            yield ""
+            yield f"Some *emphasis*, some **strong** text and `code {n}`."
+            yield f"- item [link {n}](https://example.com/{n})"
+            yield "```python"
+            yield f"print({n})"
+            yield "```"
+            yield ""
+    elif ext == ".js":
+        while True:
+            n = rng.randrange(1000)
+            yield f"class Widget{n} extends Base {{"
+            yield f"  method{n}(value = {n}) {{"
+            yield f"    // compute something for {n}"
+            yield f"    const result = [1, 2, 3].map((x) => x * {n}.5);"
+            yield f"    return `${{this.name}}: ${{result.length}}` + 'done';"
+            yield "  }"
+            yield "}"
+            yield ""
+    else:
+        while True:
+            n = rng.randrange(1000)
+            yield f"Line {n} of plain text, with nothing to highlight at all."
+
+
+def real_lines(ext):
+    paths = []
+    for pattern in REAL_CORPORA.get(ext, []):
+        paths.extend(sorted(glob.glob(pattern)))
+    lines = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines.extend(f.read().splitlines())
+    if not lines:
+        return None
+    while True:
+        yield from lines
+
+
+def build_corpus(lines, count):
+    return "\n".join(next(lines) for _ in range(count)) + "\n"
+
+
+def load_plugin_lexers(path):
+    # Same loading as PluginManager._load_lexer_from_plugin, for a plugin
+    # directory or a packed .lmp file.
+    if os.path.isdir(path):
+
+        def read(name):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                return f.read()
+
+    else:
+        zf = zipfile.ZipFile(path)
+
+        def read(name):
+            return zf.read(name).decode("utf-8")
+
+    manifest = json.loads(read("manifest.json"))
+    lexer_globals = {
+        "__builtins__": __import__("builtins").__dict__.copy(),
+        "lumos": LumosAPI(
+            {
+                "PygmentsBaseLexer": PygmentsBaseLexer,
+                "BaseLexer": BaseLexer,
+                "show_warning": lambda title, text: print(
+                    f"{title}: {text}", file=sys.stderr
+                ),
+            }
+        ),
+    }
+    exec(read(manifest.get("lexerFile") or "lexer.py"), lexer_globals)
+    lexer_class = lexer_globals[manifest["lexerClass"]]
+    return lexer_class, manifest["fileExtensions"][0]
+
+
+def style_all(editor, lexer):
+    lexer._do_style_text(0, editor.length())
+
+
+def measure(lexer_class, text, keystrokes, rng):
+    editor = QsciScintilla()
+    lexer = lexer_class(editor)
+    editor.setLexer(lexer)
+    editor.setText(text)
+
+    start = time.perf_counter()
+    style_all(editor, lexer)
+    full_style = time.perf_counter() - start
+
+    # A keystroke somewhere in the document, then a restyle from its line
+    # to the end of the screen, as Scintilla would request it.
+    latencies = []
+    lines = editor.lines()
+    for _ in range(keystrokes):
+        line = rng.randrange(lines)
+        pos = editor.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line)
+        editor.SendScintilla(QsciScintilla.SCI_INSERTTEXT, pos, b"x")
+        end = lexer._line_pos(line + SCREEN_LINES)
+        start = time.perf_counter()
+        lexer._do_style_text(pos, end)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    # Styling a fresh document again under tracemalloc, which slows it down
+    # too much to time it at the same time.
+    editor = QsciScintilla()
+    lexer = lexer_class(editor)
+    editor.setLexer(lexer)
+    editor.setText(text)
+    tracemalloc.start()
+    style_all(editor, lexer)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "full_style_ms": round(full_style * 1000.0, 3),
+        "keystroke_median_ms": round(latencies[len(latencies) // 2] * 1000.0, 3),
+        "keystroke_max_ms": round(latencies[-1] * 1000.0, 3),
+        "peak_memory_kib": round(peak / 1024.0, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Full-style time, keystroke restyle latency and peak memory "
+        "of every lexer on synthetic and real corpora."
+    )
+    parser.add_argument(
+        "--lexers",
+        nargs="*",
+        default=list(BUILTIN_LEXERS),
+        help="built-in lexers to run (default: all)",
+    )
+    parser.add_argument(
+        "--plugin",
+        action="append",
+        default=None,
+        help="lexer plugin directory or .lmp file (default: the js-lexer example)",
+    )
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000, 100000])
+    parser.add_argument("--keystrokes", type=int, default=20)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    # Qt would take --plugin as one of its own options.
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    rng = random.Random(0)
+
+    lexers = {name: BUILTIN_LEXERS[name] for name in args.lexers}
+    plugins = args.plugin
+    if plugins is None:
+        plugins = [os.path.join(ROOT, "plugins", "examples", "js-lexer")]
+    errors = {}
+    for path in plugins:
+        name = os.path.basename(os.path.normpath(path))
+        try:
+            lexers[name] = load_plugin_lexers(path)
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+            print(f"{name}: could not load lexer: {errors[name]}", file=sys.stderr)
+
+    results = []
+    for name, (lexer_class, ext) in lexers.items():
+        corpora = {"synthetic": synthetic_lines(ext, rng)}
+        real = real_lines(ext)
+        if real is not None:
+            corpora["real"] = real
+
+        for corpus, lines in corpora.items():
+            # Warm-up, so one-time setup such as lazily compiled rules is not
+            # counted against the first size.
+            try:
+                measure(lexer_class, build_corpus(lines, 1000), 1, rng)
+            except Exception:
+                pass
+
+            for size in args.sizes:
+                text = build_corpus(lines, size)
+                result = {
+                    "lexer": name,
+                    "corpus": corpus,
+                    "lines": size,
+                    "bytes": len(text.encode("utf-8")),
+                }
+                try:
+                    result.update(measure(lexer_class, text, args.keystrokes, rng))
+                except Exception as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+                results.append(result)
+                print(
+                    f"{name:<12} {corpus:<9} {size:>7} lines  "
+                    + (
+                        result.get("error")
+                        or f"full {result['full_style_ms']:>10.1f} ms  "
+                        f"keystroke {result['keystroke_median_ms']:>8.2f} ms  "
+                        f"peak {result['peak_memory_kib']:>10.0f} KiB"
+                    ),
+                    file=sys.stderr,
+                )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pygments": pygments.__version__,
+        "platform": platform.platform(),
+        "keystrokes": args.keystrokes,
+        "results": results,
+        "errors": errors,
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
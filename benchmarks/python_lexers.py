@@ -0,0 +1,86 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PyQt5.Qsci import QsciScintilla  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from src.lexer import PythonCustomLexer, PythonLexer  # noqa: E402
+
+
+def style_document(lexer_class, text, rounds):
+    # One style byte per document byte, as the lexer would apply them. The
+    # best of several rounds is kept, which also leaves out the first use of
+    # PythonCustomLexer's lazily compiled rules.
+    editor = QsciScintilla()
+    lexer = lexer_class(editor)
+    editor.setText(text)
+
+    elapsed = float("inf")
+    for _ in range(rounds):
+        job = lexer._prepare_style_job(0, editor.length())
+        start = time.perf_counter()
+        lexer._run_style_job(job)
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    styles = bytearray()
+    for length, style in job["runs"]:
+        styles += bytes((style,)) * length
+    return styles, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that PythonCustomLexer styles a corpus exactly like "
+        "PythonLexer, and compare how fast they are."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Python files to use as the golden corpus (default: this repository)",
+    )
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(
+        glob.glob(os.path.join(ROOT, "**", "*.py"), recursive=True)
+        + glob.glob(os.path.join(ROOT, "*.pyw"))
+    )
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    mismatches = 0
+    pygments_time = 0.0
+    fast_time = 0.0
+    for path in paths:
+        with open(path, encoding="utf-8", errors="surrogateescape") as f:
+            text = f.read()
+        expected, elapsed = style_document(PythonLexer, text, args.rounds)
+        pygments_time += elapsed
+        actual, elapsed = style_document(PythonCustomLexer, text, args.rounds)
+        fast_time += elapsed
+
+        if actual != expected:
+            mismatches += 1
+            pos = next(
+                (i for i, (a, b) in enumerate(zip(actual, expected)) if a != b),
+                min(len(actual), len(expected)),
+            )
+            print(f"MISMATCH {os.path.relpath(path, ROOT)} at byte {pos}")
+
+    print(f"{len(paths)} files, {mismatches} mismatched")
+    print(f"PythonLexer:       {pygments_time:.3f}s")
+    print(f"PythonCustomLexer: {fast_time:.3f}s")
+    print(f"speedup: {pygments_time / fast_time:.1f}x")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
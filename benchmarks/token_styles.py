@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PyQt5.Qsci import QsciScintilla  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from src.lexer import PythonLexer  # noqa: E402
+
+
+# The per-token lookup PygmentsBaseLexer used before the flat table.
+def resolve_recursive(lexer, ttype):
+    while ttype in lexer.token_map:
+        return lexer.token_map[ttype]
+    if ttype.parent:
+        return resolve_recursive(lexer, ttype.parent)
+    return lexer.DEFAULT
+
+
+def resolve_each(lexer, token_types):
+    for ttype in token_types:
+        resolve_recursive(lexer, ttype)
+
+
+def resolve_table(lexer, token_types):
+    token_styles = lexer._token_style_table()
+    for ttype in token_types:
+        style = token_styles.get(ttype)
+        if style is None:
+            style = token_styles[ttype] = lexer._get_style_from_token(ttype)
+
+
+def best_of(rounds, func, *args):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Token type to style resolution speed, before and after "
+        "the flat lookup table."
+    )
+    parser.add_argument(
+        "path", nargs="?", default=os.path.join(ROOT, "lumos_editor.pyw")
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    editor = QsciScintilla()
+    lexer = PythonLexer(editor)
+
+    with open(args.path, encoding="utf-8") as f:
+        text = f.read()
+    token_types = [
+        ttype for _, ttype, _ in lexer.pygments_lexer.get_tokens_unprocessed(text)
+    ]
+
+    before = best_of(args.rounds, resolve_each, lexer, token_types)
+    after = best_of(args.rounds, resolve_table, lexer, token_types)
+
+    count = len(token_types)
+    print(f"{os.path.basename(args.path)}: {count} tokens")
+    print(f"before: {count / before:>14,.0f} tokens/s")
+    print(f"after:  {count / after:>14,.0f} tokens/s")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
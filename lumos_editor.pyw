@@ -1,5 +1,8 @@
+import multiprocessing
 import os
+import re
 import sys
+import time
 from functools import partial
 
 from PyQt5.Qsci import QsciScintilla
@@ -45,8 +48,6 @@ from PyQt5.QtWidgets import (
     QTabWidget,
     QToolButton,
     QTreeView,
-    QTreeWidget,
-    QTreeWidgetItem,
     QVBoxLayout,
     QWidget,
 )
@@ -57,18 +58,32 @@ from src import (
     CommandPalette,
     ConfigManager,
     EditorTab,
+    FilePalette,
     FileTreeDelegate,
     FileTreeView,
     FindReplaceDialog,
     ImageViewer,
     PluginDialog,
     PluginManager,
-    SearchWorker,
+    ProjectFiles,
+    SearchQuery,
+    SearchResultsModel,
     SourceControlTab,
     SplitTab,
+    SymbolIndex,
+    SymbolPalette,
+    TabPlaceholder,
+    TaskRunner,
     Terminal,
+    TrigramIndex,
     VideoViewer,
     WelcomeScreen,
+    changed_on_disk,
+    compile_pattern,
+    compile_replacement,
+    file_fingerprint,
+    save_bytes,
+    search_files,
 )
 
 RADIUS = 8
@@ -579,6 +594,9 @@ class MainWindow(QWidget):
         self.fs_watcher = QFileSystemWatcher()
         self.fs_watcher.directoryChanged.connect(self.on_directory_changed)
 
+        self.symbol_index = SymbolIndex(self)
+        self.search_index = TrigramIndex(self)
+
         self.left_container.hide()
         self.folder_section.hide()
         self.splitter.setSizes([0, self.width()])
@@ -757,7 +775,12 @@ class MainWindow(QWidget):
         self.check_timer.start(5000)
         self.find_replace_dialog = None
 
-        self.cache = {}
+        # Fingerprints of open files as last loaded or saved, to tell on save
+        # whether another program changed them; see src/fingerprint.py.
+        self.file_fingerprints = {}
+        # Set while the window closes its tabs, so restored tabs that were
+        # never shown are not opened just to be closed.
+        self.is_closing = False
 
         QTimer.singleShot(0, self.update_overlay_geometry)
 
@@ -901,7 +924,7 @@ class MainWindow(QWidget):
 
                 if t_type == "normal" and tab_info.get("path"):
                     if os.path.exists(tab_info["path"]):
-                        self.open_specific_file(tab_info["path"])
+                        self.add_tab_placeholder(tab_info["path"])
 
                 elif (
                     t_type == "split" and tab_info.get("left") and tab_info.get("right")
@@ -922,6 +945,34 @@ class MainWindow(QWidget):
             active_index = session_state.get("active_tab_index", 0)
             if 0 <= active_index < self.tabs.count():
                 self.tabs.setCurrentIndex(active_index)
+            if isinstance(self.tabs.currentWidget(), TabPlaceholder):
+                # Already current, so no currentChanged to open it.
+                self.on_tab_changed(self.tabs.currentIndex())
+
+    def add_tab_placeholder(self, path):
+        # Restored tabs cost nothing until they are first shown; the file is
+        # only read and its EditorTab built then, see materialize_tab.
+        abs_path = os.path.abspath(path)
+        for i in range(self.tabs.count()):
+            if getattr(self.tabs.widget(i), "filepath", None) == abs_path:
+                return
+        placeholder = TabPlaceholder(abs_path)
+        blocked = self.tabs.blockSignals(True)
+        self.tabs.addTab(placeholder, placeholder.tabname)
+        self.tabs.blockSignals(blocked)
+
+    def materialize_tab(self, index):
+        placeholder = self.tabs.widget(index)
+        blocked = self.tabs.blockSignals(True)
+        try:
+            self.tabs.removeTab(index)
+            tab = self.open_specific_file(placeholder.filepath, index=index)
+            if self.tabs.count() == 0:
+                self.tabs.addTab(WelcomeScreen(), "Welcome")
+        finally:
+            self.tabs.blockSignals(blocked)
+        placeholder.deleteLater()
+        return tab
 
     def menuBar(self):
         if not hasattr(self, "_menubar"):
@@ -1202,6 +1253,12 @@ class MainWindow(QWidget):
             self.show_project_replace,
             QKeySequence("Ctrl+Shift+H"),
         )
+        edit_menu.addAction(
+            "Go to File...", self.show_file_search, QKeySequence("Ctrl+E")
+        )
+        edit_menu.addAction(
+            "Go to Symbol...", self.show_symbol_search, QKeySequence("Ctrl+T")
+        )
         edit_menu.addSeparator()
         edit_menu.addAction(
             "Toggle Wrap Mode", self.toggle_wrap_mode, QKeySequence("Ctrl+W")
@@ -1325,6 +1382,7 @@ class MainWindow(QWidget):
                 self.fs_watcher.removePaths(self.fs_watcher.files())
 
             self.current_project_dir = folder
+            self.tree_delegate.forget_ignored()
             self.fs_model.setRootPath(folder)
             root_index = self.fs_model.index(folder)
             self.file_tree.setRootIndex(root_index)
@@ -1332,6 +1390,9 @@ class MainWindow(QWidget):
             self.titlebar.title.setText(f"Lumos Editor - {os.path.basename(folder)}")
 
             self.fs_watcher.addPath(folder)
+            self.symbol_index.open(folder)
+            if self.config_manager.get("search_index", True):
+                self.search_index.open(folder)
 
             self.folder_section.show()
             self.left_container.show()
@@ -1367,6 +1428,12 @@ class MainWindow(QWidget):
         if path not in self.fs_watcher.directories():
             self.fs_watcher.addPath(path)
 
+        if self.current_project_dir:
+            ProjectFiles.for_root(self.current_project_dir).invalidate(path)
+        self.tree_delegate.forget_ignored()
+        self.symbol_index.refresh(path)
+        self.search_index.refresh(path)
+
     def update_folder_title(self):
         folder_name = os.path.basename(self.current_project_dir)
         self.folder_label.setText(folder_name.upper())
@@ -1452,7 +1519,7 @@ class MainWindow(QWidget):
         else:
             self.show_status_message(f"Folder - {path}")
 
-    def open_specific_file(self, path, in_split=False):
+    def open_specific_file(self, path, in_split=False, index=None):
         if not path or not os.path.exists(path):
             QMessageBox.warning(self, "Error", f"File not found:\n{path}")
             if path in self.recent_files:
@@ -1469,6 +1536,10 @@ class MainWindow(QWidget):
                     and tab.filepath
                     and os.path.abspath(tab.filepath) == abs_path
                 ):
+                    if isinstance(tab, TabPlaceholder):
+                        tab = self.materialize_tab(i)
+                        self.on_tab_changed(self.tabs.currentIndex())
+                        return tab
                     self.tabs.setCurrentIndex(i)
                     return tab
 
@@ -1525,27 +1596,50 @@ class MainWindow(QWidget):
                 tab.editor.markerDefine(
                     self.right_icon, QsciScintilla.SC_MARKNUM_FOLDER
                 )
-                try:
-                    with open(path, "r", encoding="utf-8") as f:
-                        content = f.read()
-
-                    if not in_split:
-                        self.cache[abs_path] = content
-
-                    tab.editor.setText(content)
-                    tab.save()
-                except (UnicodeDecodeError, IOError):
-                    QMessageBox.warning(
-                        self,
-                        "Warning",
-                        f"Could not read file as text: {os.path.basename(path)}",
+                if tab.is_large_file:
+                    # Loaded in the background, without a copy in the cache.
+                    tab.loadProgress.connect(
+                        lambda percent: self.show_status_message(
+                            f"Loading {tab.tabname}: {percent}%"
+                        )
+                    )
+                    tab.loadFinished.connect(
+                        lambda: self.on_file_loaded(tab, not in_split)
+                    )
+                    tab.loadFailed.connect(
+                        lambda message: self.on_file_load_failed(tab, message)
                     )
-                    return None
+                    tab.load_large_file()
+                else:
+                    try:
+                        with open(path, "r", encoding="utf-8") as f:
+                            content = f.read()
+                            # Mixed line breaks are saved as the platform's.
+                            if isinstance(f.newlines, str):
+                                tab.eol = f.newlines
+
+                        if not in_split:
+                            self.file_fingerprints[abs_path] = file_fingerprint(
+                                abs_path
+                            )
+
+                        tab.editor.setText(content)
+                        tab.save()
+                    except (UnicodeDecodeError, IOError):
+                        QMessageBox.warning(
+                            self,
+                            "Warning",
+                            f"Could not read file as text: {os.path.basename(path)}",
+                        )
+                        return None
 
             if in_split:
                 return tab
 
-            index = self.tabs.addTab(tab, tab.tabname)
+            if index is None:
+                index = self.tabs.addTab(tab, tab.tabname)
+            else:
+                index = self.tabs.insertTab(index, tab, tab.tabname)
             self.tabs.setCurrentIndex(index)
             if not isinstance(tab, (ImageViewer, AudioViewer, VideoViewer)):
                 self.add_to_recent_files(abs_path)
@@ -1563,7 +1657,33 @@ class MainWindow(QWidget):
             QMessageBox.warning(self, "Error", f"Could not open file: {str(e)}")
             return None
 
-    def save_file(self):
+    def on_file_loaded(self, tab, record_fingerprint):
+        abs_path = os.path.abspath(tab.filepath)
+        self.show_status_message(f"File loaded: {abs_path}")
+        if record_fingerprint:
+            TaskRunner.instance().submit(
+                ("fingerprint", abs_path),
+                lambda task: file_fingerprint(abs_path),
+                on_result=partial(self.file_fingerprints.__setitem__, abs_path),
+            )
+
+    def on_file_load_failed(self, tab, message):
+        QMessageBox.warning(
+            self,
+            "Warning",
+            f"Could not read file as text: {os.path.basename(tab.filepath)}",
+        )
+        index = self.tabs.indexOf(tab)
+        if index != -1:
+            self.tabs.removeTab(index)
+            tab.deleteLater()
+            if self.tabs.count() == 0:
+                self.tabs.addTab(WelcomeScreen(), "Welcome")
+
+    def save_file(self, wait=False):
+        # Writes in the background unless wait is set, as when the tab is
+        # about to close; the tab stays marked modified until the file is on
+        # disk. Returns False when nothing is saved.
         current = self.tabs.currentWidget()
 
         if isinstance(
@@ -1618,17 +1738,10 @@ class MainWindow(QWidget):
         content_to_save = editor.text()
 
         try:
-            if os.path.exists(path):
-                with open(path, "r", encoding="utf-8") as f:
-                    content_on_disk = f.read()
-            else:
-                content_on_disk = None
-
             if (
-                path in self.cache
-                and content_on_disk is not None
-                and content_on_disk != self.cache.get(path, "")
+                path in self.file_fingerprints
                 and not is_checking_content_equal
+                and changed_on_disk(path, self.file_fingerprints[path])
             ):
                 reply = QMessageBox.question(
                     self,
@@ -1644,22 +1757,68 @@ class MainWindow(QWidget):
                     self.open_in_split_view(path, "diff")
                     return False
 
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(content_to_save)
-
-            self.cache[path] = content_to_save
-            if is_checking_content_equal:
-                self.close_file_tab(path)
-                return True
-            target_tab.save()
-
-            self.show_status_message(f"File saved: {path}")
+            # Line breaks as the file had them, the platform's for a new one.
+            eol = getattr(target_tab, "eol", None) or os.linesep
+            data = content_to_save.replace("\n", eol).encode("utf-8")
+            TaskRunner.instance().cancel(("fingerprint", path))
+            finish = partial(
+                self.on_file_saved,
+                target_tab,
+                getattr(target_tab, "revision", None),
+                is_checking_content_equal,
+                time.perf_counter(),
+            )
+            if wait:
+                # A background save of the same file still queued is dropped,
+                # one already writing is waited for.
+                TaskRunner.instance().cancel(("save", path))
+                finish(save_bytes(None, path, data))
+            else:
+                self.show_status_message(f"Saving {path}...")
+                TaskRunner.instance().submit(
+                    ("save", path),
+                    save_bytes,
+                    path,
+                    data,
+                    on_result=finish,
+                    on_error=self.on_file_save_failed,
+                )
             return True
 
         except Exception as e:
-            QMessageBox.warning(self, "Error", f"Could not save file: {str(e)}")
+            self.on_file_save_failed(str(e))
             return False
 
+    def on_file_saved(self, tab, revision, close_after, started, result):
+        path = result["path"]
+        self.file_fingerprints[path] = result["fingerprint"]
+        self.symbol_index.refresh(path)
+        self.search_index.refresh(path)
+        # The saved file may be an ignore file.
+        self.tree_delegate.forget_ignored()
+        if close_after:
+            self.close_file_tab(path)
+        elif getattr(tab, "revision", None) == revision:
+            # Not edited again while the file was written.
+            tab.save()
+
+        duration_ms = (time.perf_counter() - started) * 1000.0
+        self.show_status_message(f"File saved: {path}")
+        try:
+            self.plugin_manager.trigger_hook(
+                "file_saved",
+                filepath=path,
+                tab=tab,
+                size=result["size"],
+                duration_ms=duration_ms,
+                write_ms=result["write_ms"],
+            )
+        except Exception:
+            pass
+
+    def on_file_save_failed(self, message):
+        QMessageBox.warning(self, "Error", f"Could not save file: {message}")
+
     def save_file_as(self):
         current_tab_widget = self.tabs.currentWidget()
 
@@ -1717,9 +1876,7 @@ class MainWindow(QWidget):
         for tab in tabs_to_check:
             if isinstance(tab, AIChat):
                 tab._save_current_session()
-                if getattr(tab, "worker", None) and tab.worker.isRunning():
-                    tab.worker.quit()
-                    tab.worker.wait()
+                tab.cancel_reply()
             if hasattr(tab, "stop_analysis_loop"):
                 tab.stop_analysis_loop()
             if hasattr(tab, "is_modified") and tab.is_modified:
@@ -1733,7 +1890,7 @@ class MainWindow(QWidget):
                     QMessageBox.Save | QMessageBox.Discard | QMessageBox.Cancel,
                 )
                 if reply == QMessageBox.Save:
-                    self.save_file()
+                    self.save_file(wait=True)
                     if tab.is_modified:
                         return False
                 elif reply == QMessageBox.Cancel:
@@ -1759,7 +1916,7 @@ class MainWindow(QWidget):
             if hasattr(tab, "filepath") and tab.filepath:
                 filepaths_to_remove.add(os.path.abspath(tab.filepath))
         for fp in filepaths_to_remove:
-            self.cache.pop(fp, None)
+            self.file_fingerprints.pop(fp, None)
         if self.tabs.count() == 0:
             welcome_tab = WelcomeScreen()
             self.tabs.addTab(welcome_tab, "Welcome")
@@ -1824,7 +1981,7 @@ class MainWindow(QWidget):
             self.tabs.removeTab(i)
 
         for fp in filepaths_to_remove:
-            self.cache.pop(fp, None)
+            self.file_fingerprints.pop(fp, None)
 
     def request_restart(self):
         QApplication.instance().setProperty("restart_requested", True)
@@ -1836,12 +1993,17 @@ class MainWindow(QWidget):
 
         self.save_session()
 
+        self.is_closing = True
         for i in reversed(range(self.tabs.count())):
             if not self.close_tab(i):
+                self.is_closing = False
                 event.ignore()
                 if is_restarting:
                     QApplication.instance().setProperty("restart_requested", False)
                 return
+        self.symbol_index.close()
+        self.search_index.close()
+        TaskRunner.instance().cancel_all()
         event.accept()
 
     def show_context_menu(self, position):
@@ -1951,7 +2113,7 @@ class MainWindow(QWidget):
         for i in reversed(tabs_to_close):
             tab = self.tabs.widget(i)
             if hasattr(tab, "filepath") and tab.filepath:
-                self.cache.pop(os.path.abspath(tab.filepath), None)
+                self.file_fingerprints.pop(os.path.abspath(tab.filepath), None)
             self.tabs.removeTab(i)
             tab.deleteLater()
 
@@ -2124,6 +2286,11 @@ class MainWindow(QWidget):
                 QMessageBox.warning(self, "Error", f"Could not rename: {str(e)}")
 
     def on_tab_changed(self, index):
+        if isinstance(self.tabs.widget(index), TabPlaceholder) and not self.is_closing:
+            self.materialize_tab(index)
+            self.on_tab_changed(self.tabs.currentIndex())
+            return
+
         if self.active_tab_widget:
             if hasattr(self.active_tab_widget, "stop_analysis_loop"):
                 self.active_tab_widget.stop_analysis_loop()
@@ -2243,6 +2410,9 @@ class MainWindow(QWidget):
                 self.fs_watcher.removePaths(self.fs_watcher.files())
 
             self.current_project_dir = None
+            self.symbol_index.close()
+            self.search_index.close()
+            ProjectFiles.release(closed_folder_path)
 
             self.fs_model.setRootPath("")
             self.file_tree.setRootIndex(self.fs_model.index(""))
@@ -2340,6 +2510,50 @@ class MainWindow(QWidget):
 
         palette.exec_()
 
+    def show_file_search(self):
+        if not self.current_project_dir:
+            QMessageBox.information(
+                self,
+                "Go to File",
+                "Please open a folder first to search its files.",
+            )
+            return
+
+        palette = FilePalette(self, self.current_project_dir, self.open_specific_file)
+
+        qr = palette.frameGeometry()
+        qr.moveCenter(self.geometry().center())
+        qr.moveTop(self.geometry().top() + int(self.height() * 0.15))
+        palette.move(qr.topLeft())
+
+        palette.exec_()
+
+    def show_symbol_search(self):
+        if not self.current_project_dir:
+            QMessageBox.information(
+                self,
+                "Go to Symbol",
+                "Please open a folder first to search its symbols.",
+            )
+            return
+
+        palette = SymbolPalette(self, self.symbol_index, self.open_symbol)
+
+        qr = palette.frameGeometry()
+        qr.moveCenter(self.geometry().center())
+        qr.moveTop(self.geometry().top() + int(self.height() * 0.15))
+        palette.move(qr.topLeft())
+
+        palette.exec_()
+
+    def open_symbol(self, symbol):
+        self.open_specific_file(symbol.path)
+        editor = self.get_current_editor()
+        if editor:
+            editor.setCursorPosition(symbol.line, 0)
+            editor.ensureLineVisible(symbol.line)
+            editor.setFocus()
+
     def setup_search_panel(self):
         self.search_panel = QWidget()
         self.search_panel.setStyleSheet("background: #252526;")
@@ -2384,18 +2598,32 @@ class MainWindow(QWidget):
         self.search_proj_input.setStyleSheet(input_style)
         self.search_proj_input.returnPressed.connect(self.do_project_search)
 
-        self.match_case_cb = QCheckBox("Aa")
-        self.match_case_cb.setToolTip("Match Case")
-        self.match_case_cb.setCursor(Qt.PointingHandCursor)
-        self.match_case_cb.setStyleSheet("""
+        toggle_style = """
             QCheckBox { color: #cccccc; font-weight: bold; font-family: monospace; }
             QCheckBox::indicator { width: 0px; height: 0px; }
             QCheckBox:checked { color: #007fd4; }
-        """)
+        """
+
+        self.match_case_cb = QCheckBox("Aa")
+        self.match_case_cb.setToolTip("Match Case")
+        self.match_case_cb.setCursor(Qt.PointingHandCursor)
+        self.match_case_cb.setStyleSheet(toggle_style)
+
+        self.whole_word_cb = QCheckBox("ab")
+        self.whole_word_cb.setToolTip("Match Whole Word")
+        self.whole_word_cb.setCursor(Qt.PointingHandCursor)
+        self.whole_word_cb.setStyleSheet(toggle_style)
+
+        self.regex_cb = QCheckBox(".*")
+        self.regex_cb.setToolTip("Use Regular Expression")
+        self.regex_cb.setCursor(Qt.PointingHandCursor)
+        self.regex_cb.setStyleSheet(toggle_style)
 
         search_row.addWidget(self.btn_toggle_replace)
         search_row.addWidget(self.search_proj_input)
         search_row.addWidget(self.match_case_cb)
+        search_row.addWidget(self.whole_word_cb)
+        search_row.addWidget(self.regex_cb)
 
         self.replace_widget = QWidget()
         replace_row = QHBoxLayout(self.replace_widget)
@@ -2434,8 +2662,25 @@ class MainWindow(QWidget):
         replace_row.addWidget(self.btn_replace_file)
         replace_row.addWidget(self.btn_replace_all)
 
+        self.include_proj_input = QLineEdit()
+        self.include_proj_input.setPlaceholderText("Files to include (e.g. *.py, src/)")
+        self.include_proj_input.setStyleSheet(input_style)
+        self.include_proj_input.returnPressed.connect(self.do_project_search)
+
+        self.exclude_proj_input = QLineEdit()
+        self.exclude_proj_input.setPlaceholderText("Files to exclude")
+        self.exclude_proj_input.setStyleSheet(input_style)
+        self.exclude_proj_input.returnPressed.connect(self.do_project_search)
+
+        filter_layout = QVBoxLayout()
+        filter_layout.setContentsMargins(26, 0, 0, 0)
+        filter_layout.setSpacing(6)
+        filter_layout.addWidget(self.include_proj_input)
+        filter_layout.addWidget(self.exclude_proj_input)
+
         input_layout.addLayout(search_row)
         input_layout.addWidget(self.replace_widget)
+        input_layout.addLayout(filter_layout)
 
         line = QFrame()
         line.setFrameShape(QFrame.HLine)
@@ -2445,37 +2690,44 @@ class MainWindow(QWidget):
         self.search_status_label = QLabel("")
         self.search_status_label.setStyleSheet("color: #969696; font-size: 11px;")
 
-        self.search_results_tree = QTreeWidget()
+        self.search_results_model = SearchResultsModel(
+            self, self.config_manager.get("search_max_results", 20000)
+        )
+        self.search_results_tree = QTreeView()
+        self.search_results_tree.setModel(self.search_results_model)
+        # Every row is one line of text, which spares the view measuring each.
+        self.search_results_tree.setUniformRowHeights(True)
         self.search_results_tree.setHeaderHidden(True)
         self.search_results_tree.setStyleSheet("""
-            QTreeWidget {
+            QTreeView {
                 background: #252526; color: #cccccc; border: none; outline: none; font-size: 12px;
             }
-            QTreeWidget::item { padding: 3px 0px; }
-            QTreeWidget::item:hover { background: #2a2d2e; }
-            QTreeWidget::item:selected { background: #37373d; color: #ffffff; }
-            QTreeWidget::branch:hover { background: #2a2d2e; }
-            QTreeWidget::branch:selected { background: #37373d; }
-            QTreeWidget::branch:has-children:!has-siblings:closed,
-            QTreeWidget::branch:closed:has-children:has-siblings { 
+            QTreeView::item { padding: 3px 0px; }
+            QTreeView::item:hover { background: #2a2d2e; }
+            QTreeView::item:selected { background: #37373d; color: #ffffff; }
+            QTreeView::branch:hover { background: #2a2d2e; }
+            QTreeView::branch:selected { background: #37373d; }
+            QTreeView::branch:has-children:!has-siblings:closed,
+            QTreeView::branch:closed:has-children:has-siblings { 
                 image: url(resources:/chevron-right.ico); 
                 padding: 4px; 
             }
-            QTreeWidget::branch:open:has-children:!has-siblings,
-            QTreeWidget::branch:open:has-children:has-siblings { 
+            QTreeView::branch:open:has-children:!has-siblings,
+            QTreeView::branch:open:has-children:has-siblings { 
                 image: url(resources:/chevron-down.ico); 
                 padding: 4px; 
             }
             """)
-        self.search_results_tree.itemDoubleClicked.connect(self.open_file_from_search)
+        self.search_results_tree.doubleClicked.connect(self.open_file_from_search)
+        self.search_results_model.rowsInserted.connect(self.expand_search_results)
 
         slayout.addWidget(input_container)
         slayout.addWidget(line)
         slayout.addWidget(self.search_status_label)
         slayout.addWidget(self.search_results_tree)
 
-        self.search_worker = None
-        self.search_result_count = 0
+        # The query behind the results shown, which replacing goes by.
+        self.search_query = None
 
     def toggle_replace_inputs(self):
         is_visible = self.replace_widget.isVisible()
@@ -2507,63 +2759,69 @@ class MainWindow(QWidget):
         self.replace_proj_input.setFocus()
 
     def do_replace_one(self):
-        current_item = self.search_results_tree.currentItem()
-        if not current_item or not isinstance(current_item.data(0, Qt.UserRole), dict):
+        index = self.search_results_tree.currentIndex()
+        data = self.search_results_model.match_at(index) if index.isValid() else None
+        if data is None:
             return
 
-        data = current_item.data(0, Qt.UserRole)
         filepath = data["path"]
-        replace_text = self.replace_proj_input.text()
+        replacement = self.search_replacement()
+        if replacement is None:
+            return
 
         self.open_specific_file(filepath)
         editor = self.get_current_editor()
 
         if editor:
-            offset = len(replace_text) - data["len"]
-
-            editor.setSelection(
-                data["line"], data["col"], data["line"], data["col"] + data["len"]
-            )
+            # The match is made again where the search found it, in the whole
+            # text, so that anchors and lookarounds see what they saw then.
+            text = editor.text()
+            if "\r" in text:
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            start = 0
+            for _ in range(data["line"]):
+                start = text.find("\n", start) + 1
+                if start == 0:
+                    break
+            match = None
+            if start or not data["line"]:
+                start += data["col"]
+                match = compile_pattern(self.search_query).match(text, start)
+            if match is None or match.end() == start:
+                self.search_status_label.setText(
+                    "The file changed since the search, search again."
+                )
+                return
+            end = match.end()
+            end_line = data["line"] + text.count("\n", start, end)
+            end_col = end - (text.rfind("\n", 0, end) + 1)
+            replace_text = replacement(match)
+            editor.setSelection(data["line"], data["col"], end_line, end_col)
             editor.replaceSelectedText(replace_text)
 
-            self.mark_file_as_modified(filepath)
-
-            parent = current_item.parent()
-            current_line = data["line"]
-            current_col = data["col"]
-
-            for i in range(parent.childCount()):
-                child = parent.child(i)
-                if child == current_item:
-                    continue
+            # Where the replacement ends, which may be on another line than
+            # the match did.
+            new_lines = replace_text.count("\n")
+            new_end_line = data["line"] + new_lines
+            if new_lines:
+                new_end_col = len(replace_text) - replace_text.rfind("\n") - 1
+            else:
+                new_end_col = data["col"] + len(replace_text)
 
-                child_data = child.data(0, Qt.UserRole)
-                if (
-                    child_data["line"] == current_line
-                    and child_data["col"] > current_col
-                ):
-                    child_data["col"] += offset
-                    child.setData(0, Qt.UserRole, child_data)
-
-                    old_text = child.text(0)
-                    parts = old_text.split(":", 2)
-                    if len(parts) >= 3:
-                        new_display = (
-                            f"{current_line + 1}:{child_data['col'] + 1}:{parts[2]}"
-                        )
-                        child.setText(0, new_display)
+            self.mark_file_as_modified(filepath)
 
-            parent.removeChild(current_item)
-            self.search_result_count -= 1
-            self.search_status_label.setText(
-                f"{self.search_result_count} results remaining."
+            model = self.search_results_model
+            model.shift_matches(
+                index, (end_line, end_col), (new_end_line, new_end_col)
             )
+            file_index = index.parent()
+            remaining = model.rowCount(file_index) - 1
+            model.remove_match(index)
+            self.search_status_label.setText(f"{model.match_count} results remaining.")
 
-            if parent.childCount() == 0:
-                self.search_results_tree.invisibleRootItem().removeChild(parent)
-
-            if parent.childCount() > 0:
-                self.search_results_tree.setCurrentItem(parent.child(0))
+            if remaining > 0:
+                file_index = model.index(file_index.row(), 0)
+                self.search_results_tree.setCurrentIndex(model.index(0, 0, file_index))
 
     def mark_file_as_modified(self, filepath):
         abs_path = os.path.abspath(filepath)
@@ -2583,40 +2841,34 @@ class MainWindow(QWidget):
                 break
 
     def do_replace_in_file(self):
-        current_item = self.search_results_tree.currentItem()
-        if not current_item:
+        index = self.search_results_tree.currentIndex()
+        if not index.isValid():
             return
 
-        file_node = (
-            current_item if current_item.parent() is None else current_item.parent()
-        )
-        filepath = file_node.data(0, Qt.UserRole)
+        file_index = self.search_results_model.file_index(index)
+        filepath = file_index.data(Qt.UserRole)
+        replacement = self.search_replacement()
+        if replacement is None:
+            return
         self.mark_file_as_modified(filepath)
-        term = self.search_proj_input.text()
-        replace_text = self.replace_proj_input.text()
-        match_case = self.match_case_cb.isChecked()
 
         self.open_specific_file(filepath)
         editor = self.get_current_editor()
         if editor:
             current_text = editor.text()
-            import re
-
-            flags = 0 if match_case else re.IGNORECASE
-            new_text = re.sub(re.escape(term), replace_text, current_text, flags=flags)
+            new_text = self.replace_matches(current_text, replacement)
 
             if current_text != new_text:
                 editor.selectAll()
                 editor.replaceSelectedText(new_text)
 
-            self.search_result_count -= file_node.childCount()
-            self.search_results_tree.invisibleRootItem().removeChild(file_node)
+            self.search_results_model.remove_file(file_index.row())
             self.search_status_label.setText(
-                f"{self.search_result_count} results remaining."
+                f"{self.search_results_model.match_count} results remaining."
             )
 
-    def open_file_from_search(self, item, column):
-        data = item.data(0, Qt.UserRole)
+    def open_file_from_search(self, index):
+        data = index.data(Qt.UserRole)
         if isinstance(data, dict):
             self.open_specific_file(data["path"])
             editor = self.get_current_editor()
@@ -2632,106 +2884,164 @@ class MainWindow(QWidget):
 
     def do_project_search(self):
         term = self.search_proj_input.text()
-        self.search_results_tree.clear()
-        self.search_result_count = 0
+        self.search_results_model.clear(self.current_project_dir or "")
+        self.search_query = None
 
         if not term or not self.current_project_dir:
+            TaskRunner.instance().cancel("project-search")
             self.search_status_label.setText("")
             return
 
-        if self.search_worker and self.search_worker.isRunning():
-            self.search_worker.stop()
-            self.search_worker.wait()
-
         self.search_status_label.setText("Searching...")
 
-        match_case = self.match_case_cb.isChecked()
-        self.search_worker = SearchWorker(self.current_project_dir, term, match_case)
-        self.search_worker.file_matches_found.connect(self.on_search_file_matches_found)
-        self.search_worker.finished.connect(self.on_search_finished)
-        self.search_worker.start()
-
-    def on_search_file_matches_found(self, filepath, matches):
-        import os
-        import re
-
-        rel_path = os.path.relpath(filepath, self.current_project_dir)
-        file_node = QTreeWidgetItem(self.search_results_tree, [rel_path])
-        file_node.setData(0, Qt.UserRole, filepath)
-        file_node.setExpanded(True)
-        file_node.setForeground(0, QColor("#d7ba7d"))
-
-        term = self.search_proj_input.text()
-        flags = 0 if self.match_case_cb.isChecked() else re.IGNORECASE
-
-        abs_path = os.path.abspath(filepath)
-        real_lines = []
-        if abs_path in self.cache:
-            real_lines = self.cache[abs_path].splitlines()
-        else:
-            try:
-                with open(abs_path, "r", encoding="utf-8") as f:
-                    real_lines = f.read().splitlines()
-            except Exception:
-                pass
-
-        for line_idx, line_text in matches:
-            target_text = line_text
-            if real_lines and line_idx < len(real_lines):
-                target_text = real_lines[line_idx]
-
-            for match in re.finditer(re.escape(term), target_text, flags):
-                start_col = match.start()
-
-                display_text = f"{line_idx + 1}:{start_col + 1}: {target_text.strip()}"
-                if len(display_text) > 100:
-                    display_text = display_text[:100] + "..."
+        self.search_query = SearchQuery(
+            term,
+            self.match_case_cb.isChecked(),
+            self.regex_cb.isChecked(),
+            self.whole_word_cb.isChecked(),
+            self.include_proj_input.text(),
+            self.exclude_proj_input.text(),
+        )
+        try:
+            compile_pattern(self.search_query)
+        except re.error as e:
+            TaskRunner.instance().cancel("project-search")
+            self.search_query = None
+            self.search_status_label.setText(f"Invalid search: {e}")
+            return
+        # A new search replaces the running one; anything the old one still
+        # finds is dropped.
+        TaskRunner.instance().submit(
+            "project-search",
+            search_files,
+            self.current_project_dir,
+            self.search_query,
+            self.search_index.narrower(),
+            on_progress=self.on_search_file_matches_found,
+            on_result=self.on_search_finished,
+            on_error=self.on_search_failed,
+            long_running=True,
+        )
 
-                item = QTreeWidgetItem(file_node, [display_text])
-                item.setData(
-                    0,
-                    Qt.UserRole,
-                    {
-                        "path": filepath,
-                        "line": line_idx,
-                        "col": start_col,
-                        "len": len(term),
-                    },
-                )
-                self.search_result_count += 1
+    def on_search_file_matches_found(self, batch):
+        model = self.search_results_model
+        if not model.add_files(batch):
+            TaskRunner.instance().cancel("project-search")
+            self.on_search_finished()
+            return
+        self.search_status_label.setText(f"Found {model.match_count} results...")
 
-        self.search_status_label.setText(f"Found {self.search_result_count} results...")
+    def expand_search_results(self, parent, first, last):
+        if parent.isValid():
+            return
+        for row in range(first, last + 1):
+            self.search_results_tree.expand(self.search_results_model.index(row, 0))
 
-    def on_search_finished(self):
-        if self.search_result_count == 0:
+    def on_search_finished(self, _result=None):
+        model = self.search_results_model
+        model.flush()
+        if model.truncated:
+            self.search_status_label.setText(
+                f"Showing the first {model.match_count} results."
+            )
+        elif model.match_count == 0:
             self.search_status_label.setText("No results found.")
         else:
-            self.search_status_label.setText(
-                f"{self.search_result_count} results found."
+            self.search_status_label.setText(f"{model.match_count} results found.")
+
+    def on_search_failed(self, message):
+        # The pattern was checked before searching, so this is something
+        # else going wrong, e.g. the project folder going away.
+        self.search_query = None
+        self.search_status_label.setText(f"Search failed: {message}")
+
+    def search_replacement(self):
+        # The replace box as compile_replacement makes it for the current
+        # search, None after telling why it cannot be used.
+        if self.search_query is None:
+            return None
+        try:
+            return compile_replacement(
+                self.search_query, self.replace_proj_input.text()
             )
+        except re.error as e:
+            self.search_status_label.setText(f"Invalid replacement: {e}")
+            return None
+
+    def replace_matches(self, text, replacement):
+        # Replaces what the current search matches in text, replacement being
+        # from search_replacement.
+        return compile_pattern(self.search_query).sub(replacement, text)
 
     def do_project_replace(self):
-        term = self.search_proj_input.text()
         replace_text = self.replace_proj_input.text()
-        if not term or not self.current_project_dir:
+        if self.search_query is None or not self.current_project_dir:
+            return
+        replacement = self.search_replacement()
+        if replacement is None:
             return
 
-        match_case = self.match_case_cb.isChecked()
-        root = self.search_results_tree.invisibleRootItem()
-        files_to_modify = []
+        model = self.search_results_model
+        if not model.truncated:
+            self.confirm_project_replace(
+                self.search_query,
+                replace_text,
+                replacement,
+                model.file_paths(),
+                model.match_count,
+            )
+            return
 
-        for i in range(root.childCount()):
-            file_node = root.child(i)
-            filepath = file_node.data(0, Qt.UserRole)
-            files_to_modify.append(filepath)
+        # The results stop at search_max_results: the search runs again without
+        # that limit, so that the files past it are replaced as well.
+        query = self.search_query
+        batches = []
+        self.search_status_label.setText("Finding every match to replace...")
+        TaskRunner.instance().submit(
+            "project-search",
+            search_files,
+            self.current_project_dir,
+            query,
+            self.search_index.narrower(),
+            on_progress=batches.extend,
+            on_result=lambda _result: self.confirm_project_replace(
+                query,
+                replace_text,
+                replacement,
+                [filepath for filepath, _matches in batches],
+                sum(len(matches) for _filepath, matches in batches),
+            ),
+            on_error=self.on_search_failed,
+            long_running=True,
+        )
+
+    def confirm_project_replace(
+        self, query, replace_text, replacement, files_to_modify, count
+    ):
+        # Dropped when another search started in the meantime.
+        if query is not self.search_query:
+            return
+        model = self.search_results_model
+        if model.truncated:
+            # Puts back the status of the results shown.
+            self.on_search_finished()
 
         if not files_to_modify:
             return
 
+        message = (
+            f"Open {len(files_to_modify)} files and replace {count} matches of "
+            f"'{query.term}' with '{replace_text}'?"
+        )
+        if count > model.match_count:
+            message += (
+                f"\n\n{count - model.match_count} of them are past the "
+                f"{model.match_count} results shown."
+            )
         reply = QMessageBox.question(
             self,
             "Replace All",
-            f"Open {len(files_to_modify)} files and replace '{term}' with '{replace_text}'?",
+            message,
             QMessageBox.Yes | QMessageBox.No,
         )
 
@@ -2746,14 +3056,7 @@ class MainWindow(QWidget):
 
             if editor:
                 current_text = editor.text()
-
-                if match_case:
-                    new_text = current_text.replace(term, replace_text)
-                else:
-                    import re
-
-                    pattern = re.compile(re.escape(term), re.IGNORECASE)
-                    new_text = pattern.sub(replace_text, current_text)
+                new_text = self.replace_matches(current_text, replacement)
 
                 if current_text != new_text:
                     if hasattr(editor, "beginUndoAction"):
@@ -2786,7 +3089,7 @@ class MainWindow(QWidget):
         self.search_status_label.setText(
             "Replacement applied to editors. Don't forget to save."
         )
-        self.search_results_tree.clear()
+        self.search_results_model.clear()
 
 
 def main():
@@ -2815,4 +3118,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Completion workers are separate processes started from this executable.
+    multiprocessing.freeze_support()
     main()
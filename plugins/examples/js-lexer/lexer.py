@@ -116,6 +116,8 @@ JS_LANGUAGE = Language(tsjavascript.language())
 
 
 class JavaScriptLexer(lumos.PygmentsBaseLexer):  # type: ignore
+    FOLDING = "brackets"
+
     def __init__(self, editor, theme_name="default"):
         super().__init__("JavaScript", editor, theme_name=theme_name)
 
@@ -424,8 +426,6 @@ class JavaScriptLexer(lumos.PygmentsBaseLexer):  # type: ignore
             self.debug_tree(ch, src, level + 1)
 
     def build_apis(self):
-        self.apis.clear()
-
         code = self.editor.text()
         src = code.encode("utf-8", "ignore")
         cursor = self.editor.SendScintilla(self.editor.SCI_GETCURRENTPOS)
@@ -436,7 +436,7 @@ class JavaScriptLexer(lumos.PygmentsBaseLexer):  # type: ignore
             else -1
         )
         if style in (self.STRING, self.COMMENTS):
-            self.apis.prepare()
+            self.set_completions([])
             return
 
         ctx = {
@@ -448,6 +448,7 @@ class JavaScriptLexer(lumos.PygmentsBaseLexer):  # type: ignore
             "var_alias": {},
         }
 
+        names = []
         try:
             tree = self.parser.parse(src)
             self._collect_defs(tree.root_node, src, ctx)
@@ -484,9 +485,9 @@ class JavaScriptLexer(lumos.PygmentsBaseLexer):  # type: ignore
                     continue
                 if prefix and not name.startswith(prefix):
                     continue
-                self.apis.add(name)
+                names.append(name)
 
         except Exception:
             pass
 
-        self.apis.prepare()
+        self.set_completions(names)
@@ -1,15 +1,28 @@
 from .ai_chat import AIChat
-from .cmd_palette import CommandPalette
+from .atomic_save import save_bytes, write_atomic
+from .cmd_palette import CommandPalette, FilePalette, SymbolPalette
 from .config_manager import ConfigManager
 from .editor_tab import EditorTab
 from .file_tree import FileTreeDelegate, FileTreeView
 from .find_replace import FindReplaceDialog
+from .fingerprint import changed_on_disk, data_fingerprint, file_fingerprint
 from .media_viewer import AudioViewer, ImageViewer, VideoViewer
 from .plugin_manager import PluginDialog, PluginManager
-from .search_worker import SearchWorker
+from .project_files import ProjectFiles
+from .search_results import SearchResultsModel
+from .search_worker import (
+    SearchQuery,
+    compile_pattern,
+    compile_replacement,
+    search_files,
+)
 from .source_control import SourceControlTab
 from .split_tab import SplitTab
+from .symbol_index import SymbolIndex
+from .tab_placeholder import TabPlaceholder
+from .tasks import CancelToken, TaskCancelled, TaskRunner
 from .terminal import Terminal
+from .trigram_index import TrigramIndex
 from .welcome_screen import WelcomeScreen
 
 __all__ = [
@@ -28,6 +41,24 @@ __all__ = [
     "SplitTab",
     "SourceControlTab",
     "CommandPalette",
-    "SearchWorker",
+    "SymbolPalette",
+    "FilePalette",
+    "ProjectFiles",
+    "SymbolIndex",
+    "TrigramIndex",
+    "TabPlaceholder",
+    "SearchQuery",
+    "SearchResultsModel",
+    "compile_pattern",
+    "compile_replacement",
+    "search_files",
+    "changed_on_disk",
+    "data_fingerprint",
+    "file_fingerprint",
+    "save_bytes",
+    "write_atomic",
+    "TaskRunner",
+    "CancelToken",
+    "TaskCancelled",
     "Terminal",
 ]
@@ -8,7 +8,7 @@ from urllib.parse import unquote
 
 import google.genai as genai
 from google.genai import types
-from PyQt5.QtCore import QSize, Qt, QThread, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QSize, Qt, QTimer, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QDesktopServices, QIcon
 from PyQt5.QtWidgets import (
     QAction,
@@ -32,6 +32,7 @@ from PyQt5.QtWidgets import (
 )
 
 from . import md_renderer
+from .tasks import TaskRunner
 
 MARKDOWN_CSS = """
 body {
@@ -162,33 +163,26 @@ def get_unique_path(path):
         i += 1
 
 
-class GeminiWorker(QThread):
-    chunk_received = pyqtSignal(str)
-    finished_streaming = pyqtSignal()
-    error_occurred = pyqtSignal(str)
-
-    def __init__(self, client, contents, model, config):
-        super().__init__()
-        self.client = client
-        self.contents = contents
-        self.model = model
-        self.config = config
-
-    def run(self):
-        try:
-            full_response_text = ""
-            stream = self.client.models.generate_content_stream(
-                model=self.model,
-                contents=self.contents,
-                config=self.config,
-            )
-            for chunk in stream:
-                if hasattr(chunk, "text") and chunk.text is not None:
-                    full_response_text += chunk.text
-                    self.chunk_received.emit(full_response_text)
-            self.finished_streaming.emit()
-        except Exception as e:
-            self.error_occurred.emit(str(e))
+def stream_reply(task, client, contents, model, config):
+    # Runs on the TaskRunner and reports the text received so far after every
+    # chunk. A cancelled reply stops at the next chunk and closes the stream.
+    full_response_text = ""
+    stream = client.models.generate_content_stream(
+        model=model,
+        contents=contents,
+        config=config,
+    )
+    try:
+        for chunk in stream:
+            task.token.check()
+            if hasattr(chunk, "text") and chunk.text is not None:
+                full_response_text += chunk.text
+                task.report(full_response_text)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return full_response_text
 
 
 class AIMessageWidget(QWidget):
@@ -342,7 +336,7 @@ class AIChat(QWidget):
         self.model = None
         self.client = None
         self.current_ai_message_widget = None
-        self.worker = None
+        self.reply_task = None
         self.conversation_history = []
         self.current_file_path = None
         self.current_file_content = None
@@ -580,6 +574,8 @@ class AIChat(QWidget):
         if not skip_save:
             self.ask_session_name_and_save()
 
+        self.cancel_reply()
+
         self.conversation_history = []
         self.contents = []
         self.current_ai_message_widget = None
@@ -643,12 +639,17 @@ class AIChat(QWidget):
         self.current_ai_message_widget = None
         self.send_button.setEnabled(True)
         self.input_text.setFocus()
-        if self.worker:
-            self.worker.quit()
-            self.worker.wait()
-            self.worker = None
+        self.reply_task = None
         self.refresh_session_menu()
 
+    def cancel_reply(self):
+        if self.reply_task is None:
+            return
+        TaskRunner.instance().cancel(self.reply_task.key)
+        self.reply_task = None
+        self.current_ai_message_widget = None
+        self.send_button.setEnabled(True)
+
     @pyqtSlot(str)
     def handle_ai_error(self, error_message):
         if self.current_ai_message_widget:
@@ -929,7 +930,7 @@ class AIChat(QWidget):
         if (
             not user_message
             or not self.client
-            or (self.worker and self.worker.isRunning())
+            or self.reply_task is not None
         ):
             return
 
@@ -1308,28 +1309,28 @@ Resolve any conflict between context and inference in favor of the context.
             tools=tools,
         )
 
-        self.worker = GeminiWorker(
-            self.client, self.contents, model, generate_content_config
+        self.reply_task = TaskRunner.instance().submit(
+            ("ai-chat", id(self)),
+            stream_reply,
+            self.client,
+            self.contents,
+            model,
+            generate_content_config,
+            on_progress=self.update_ai_message,
+            on_result=lambda _text: self.finalize_ai_message(),
+            on_error=self.handle_ai_error,
+            long_running=True,
         )
-        self.worker.chunk_received.connect(self.update_ai_message)
-        self.worker.finished_streaming.connect(self.finalize_ai_message)
-        self.worker.error_occurred.connect(self.handle_ai_error)
-        self.worker.start()
 
     def closeEvent(self, event):
         self._save_current_session()
-
-        if self.worker and self.worker.isRunning():
-            self.worker.quit()
-            self.worker.wait()
+        self.cancel_reply()
         event.accept()
 
     def deleteLater(self):
         self._save_current_session()
-
-        if getattr(self, "worker", None) and self.worker.isRunning():
-            self.worker.quit()
-            self.worker.wait()
+        if getattr(self, "reply_task", None) is not None:
+            self.cancel_reply()
 
         super().deleteLater()
 
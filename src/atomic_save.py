@@ -0,0 +1,87 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from .fingerprint import data_fingerprint
+
+# Mode new files get from open(); read once, os.umask can only be read by
+# setting it.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# One lock per file, so two saves of the same file never write at once; see
+# save_bytes.
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(path):
+    key = os.path.normcase(os.path.abspath(path))
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _fsync_directory(directory):
+    # Makes the rename itself durable; not possible, nor needed, on Windows.
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, data):
+    # Writes data to a temporary file next to path, flushes it to disk and
+    # renames it over path, so a crash leaves either the old or the new file,
+    # never a truncated one. The file keeps its permissions; a symlink is
+    # followed rather than replaced.
+    target = os.path.realpath(path)
+    directory = os.path.dirname(target)
+    try:
+        mode = stat.S_IMODE(os.stat(target).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+
+    fd, temp_path = tempfile.mkstemp(
+        prefix="." + os.path.basename(target) + ".", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, target)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+
+def save_bytes(task, path, data):
+    # Task function for TaskRunner, also called directly with task None. A
+    # save that was cancelled while waiting for an earlier save of the same
+    # file to finish writes nothing: the newer save that replaced it has the
+    # newer text. Returns the new fingerprint and how long each step took.
+    start = time.perf_counter()
+    with _lock_for(path):
+        if task is not None:
+            task.token.check()
+        locked = time.perf_counter()
+        write_atomic(path, data)
+        written = time.perf_counter()
+        fingerprint = data_fingerprint(path, data)
+    return {
+        "path": path,
+        "size": len(data),
+        "fingerprint": fingerprint,
+        "wait_ms": (locked - start) * 1000.0,
+        "write_ms": (written - locked) * 1000.0,
+    }
@@ -1,4 +1,8 @@
-from PyQt5.QtCore import Qt
+import heapq
+import os
+from functools import partial
+
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtWidgets import (
     QDialog,
     QFrame,
@@ -11,6 +15,10 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 
+from .project_files import ProjectFiles
+from .symbol_index import fuzzy_score
+from .tasks import TaskRunner
+
 
 class CommandPalette(QDialog):
     def __init__(self, parent=None, commands=None):
@@ -134,3 +142,177 @@ class CommandPalette(QDialog):
                 self.execute_command(self.list_widget.currentItem())
         else:
             super().keyPressEvent(event)
+
+
+class SymbolPalette(CommandPalette):
+    # Go to Symbol: the same popup, listing project symbols from a
+    # SymbolIndex instead of commands, looked up on the TaskRunner after a
+    # pause in typing. Few rows are shown, each being a widget of its own.
+    MAX_RESULTS = 50
+    FILTER_DELAY = 80
+
+    def __init__(self, parent, symbol_index, open_symbol):
+        self.symbol_index = symbol_index
+        self.open_symbol = open_symbol
+        super().__init__(parent, [])
+        self.search_input.setPlaceholderText("Type a symbol name...")
+
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(self.FILTER_DELAY)
+        self._filter_timer.timeout.connect(self._search)
+        self.finished.connect(self._cancel_tasks)
+        self._search()
+
+    def _cancel_tasks(self, _result=None):
+        TaskRunner.instance().cancel("symbol-palette-search")
+
+    def _commands(self, symbols):
+        root = self.symbol_index.root or ""
+        commands = []
+        for symbol in symbols:
+            name = symbol.name
+            if symbol.container:
+                name = f"{symbol.container}.{name}"
+            location = os.path.relpath(symbol.path, root) if root else symbol.path
+            commands.append(
+                {
+                    "name": name,
+                    "shortcut": f"{symbol.kind}  {location}:{symbol.line + 1}",
+                    "action": partial(self.open_symbol, symbol),
+                }
+            )
+        return commands
+
+    def filter_commands(self, text):
+        self._filter_timer.start()
+
+    def _search(self):
+        searcher = self.symbol_index.searcher()
+        if searcher is None:
+            self.populate_list([])
+            return
+        TaskRunner.instance().submit(
+            "symbol-palette-search",
+            searcher,
+            self.search_input.text(),
+            self.MAX_RESULTS,
+            on_result=lambda symbols: self.populate_list(self._commands(symbols)),
+        )
+
+
+def _list_files(task, root):
+    return [
+        os.path.relpath(path, root)
+        for path in ProjectFiles.for_root(root).walk(token=task.token)
+    ]
+
+
+def _file_score(query, rel):
+    # File names first, then the paths matching only as a whole.
+    score = fuzzy_score(query, os.path.basename(rel))
+    if score is None:
+        score = fuzzy_score(query, rel)
+        if score is not None:
+            score = (3,) + score
+    return score
+
+
+def _rank_files(task, paths, query, limit):
+    # (matching, best): every path matching query, and the limit best of
+    # them in order.
+    matching = []
+    scored = []
+    for i, rel in enumerate(paths):
+        if i % 2000 == 0:
+            task.token.check()
+        score = _file_score(query, rel)
+        if score is not None:
+            matching.append(rel)
+            scored.append((score, rel))
+    best = [rel for _score, rel in heapq.nsmallest(limit, scored)]
+    return matching, best
+
+
+class FilePalette(CommandPalette):
+    # Go to File: the same popup, listing the files of the project that are
+    # not ignored. Both listing the project and ranking it for what is typed
+    # run on the TaskRunner, the latter after a pause in typing; a longer
+    # query is only matched against what the shorter one matched. Few rows
+    # are shown, each being a widget of its own.
+    MAX_RESULTS = 50
+    FILTER_DELAY = 80
+
+    def __init__(self, parent, root, open_file):
+        self.root = root
+        self.open_file = open_file
+        self.paths = None
+        # The last query ranked and the paths it matched.
+        self._matched_query = ""
+        self._matched = []
+        super().__init__(parent, [])
+        self.search_input.setPlaceholderText("Listing files...")
+
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(self.FILTER_DELAY)
+        self._filter_timer.timeout.connect(self._rank)
+        self.finished.connect(self._cancel_tasks)
+
+        TaskRunner.instance().submit(
+            "file-palette-list",
+            _list_files,
+            root,
+            on_result=self._on_files_listed,
+            long_running=True,
+        )
+
+    def _cancel_tasks(self, _result=None):
+        TaskRunner.instance().cancel("file-palette-list")
+        TaskRunner.instance().cancel("file-palette-rank")
+
+    def _on_files_listed(self, paths):
+        self.paths = paths
+        self._matched_query = ""
+        self._matched = paths
+        self.search_input.setPlaceholderText("Type a file name...")
+        self._rank()
+
+    def _commands(self, paths):
+        return [
+            {
+                "name": os.path.basename(rel),
+                "shortcut": os.path.dirname(rel),
+                "action": partial(self.open_file, os.path.join(self.root, rel)),
+            }
+            for rel in paths
+        ]
+
+    def filter_commands(self, text):
+        self._filter_timer.start()
+
+    def _rank(self):
+        if self.paths is None:
+            return
+        query = self.search_input.text().strip().lower()
+        if not query:
+            TaskRunner.instance().cancel("file-palette-rank")
+            self.populate_list(self._commands(self.paths[: self.MAX_RESULTS]))
+            return
+        candidates = self.paths
+        if self._matched_query and query.startswith(self._matched_query):
+            candidates = self._matched
+        TaskRunner.instance().submit(
+            "file-palette-rank",
+            _rank_files,
+            candidates,
+            query,
+            self.MAX_RESULTS,
+            on_result=partial(self._on_ranked, query),
+        )
+
+    def _on_ranked(self, query, result):
+        matching, best = result
+        self._matched_query = query
+        self._matched = matching
+        self.populate_list(self._commands(best))
@@ -0,0 +1,282 @@
+import itertools
+import multiprocessing
+import os
+import sys
+import weakref
+
+import jedi
+from PyQt5.QtCore import QObject, QSocketNotifier, QTimer
+
+
+def _memory_usage():
+    # Resident memory of the current process in bytes, 0 if unknown.
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            kernel32 = ctypes.windll.kernel32
+            kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+            ctypes.windll.psapi.GetProcessMemoryInfo(
+                kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+            )
+            return counters.WorkingSetSize
+        if os.path.exists("/proc/self/statm"):
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        import resource
+
+        # Peak rather than current size, in KiB on Linux and bytes on macOS.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except Exception:
+        return 0
+
+
+def _worker_main(conn):
+    # Runs in a worker process. Requests come in as dicts over the pipe, one
+    # at a time, and every request gets exactly one reply; None or a closed
+    # pipe ends the worker.
+    projects = {}
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+
+        names = []
+        try:
+            project = projects.get(request["project"])
+            if project is None:
+                project = projects[request["project"]] = jedi.Project(
+                    request["project"]
+                )
+            script = jedi.Script(
+                code=request["code"], path=request["path"], project=project
+            )
+            completions = script.complete(request["line"] + 1, request["col"])
+            names = [completion.name for completion in completions]
+        except Exception:
+            pass
+
+        try:
+            conn.send(
+                {
+                    "serial": request["serial"],
+                    "names": names,
+                    "memory": _memory_usage(),
+                }
+            )
+        except (EOFError, OSError):
+            break
+
+
+class _CompletionWorker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn,), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.request = None
+        # Set by the service where the pipe can be watched by Qt.
+        self.notifier = None
+
+    def send(self, request):
+        self.request = request
+        self.conn.send(
+            {
+                key: request[key]
+                for key in ("serial", "code", "line", "col", "path", "project")
+            }
+        )
+
+    def stop(self):
+        # Let the worker finish on its own; it is a daemon, so it cannot
+        # outlive the editor either way.
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        try:
+            self.conn.send(None)
+        except (EOFError, OSError):
+            pass
+        self.conn.close()
+
+
+class CompletionService(QObject):
+    # Shared by every Python editor. Jedi runs in a small pool of worker
+    # processes so inference never holds the GUI's GIL; each worker keeps its
+    # projects and parso cache between calls. Each editor has at most one
+    # waiting request: a newer one replaces it, so a burst of keystrokes ends
+    # up as a single call for the latest cursor position.
+    WORKERS = 2
+    # A worker that grows past this is replaced after its current reply.
+    MEMORY_LIMIT = 768 * 1024 * 1024
+    # Replies wake the GUI through a QSocketNotifier on each worker's pipe.
+    # Windows pipes are not sockets, so there the pipes are polled instead,
+    # while a request is in flight.
+    POLL_INTERVAL = 10
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        # Forking a process that runs Qt is not safe.
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._pending = {}
+        self._default_roots = {}
+        self._serial = 0
+        self._latest = {}
+        # Requests are keyed by a number given to each owner, which unlike
+        # id() is never handed out again once the owner is gone.
+        self._owner_keys = weakref.WeakKeyDictionary()
+        self._next_key = itertools.count()
+
+        self._poll_timer = None
+        if sys.platform == "win32":
+            self._poll_timer = QTimer(self)
+            self._poll_timer.setInterval(self.POLL_INTERVAL)
+            self._poll_timer.timeout.connect(self._poll)
+
+    def project_for(self, path, project_dir=None):
+        # The folder open in the editor when the file is inside it, otherwise
+        # whatever project jedi finds around the file. Workers build the
+        # jedi.Project from the returned path.
+        if path and project_dir:
+            root = os.path.abspath(project_dir)
+            if os.path.abspath(path).startswith(root + os.sep):
+                return root
+        folder = os.path.dirname(os.path.abspath(path)) if path else None
+        root = self._default_roots.get(folder)
+        if root is None:
+            root = self._default_roots[folder] = str(
+                jedi.get_default_project(path).path
+            )
+        return root
+
+    def is_current(self, request):
+        return self._latest.get(request["owner"]) == request["serial"]
+
+    def _owner_key(self, owner):
+        key = self._owner_keys.get(owner)
+        if key is None:
+            key = self._owner_keys[owner] = next(self._next_key)
+        return key
+
+    def request(self, owner, code, line, col, callback, path=None, project_dir=None):
+        self._serial += 1
+        request = {
+            "owner": self._owner_key(owner),
+            "serial": self._serial,
+            "code": code,
+            "line": line,
+            "col": col,
+            "path": path,
+            "project": self.project_for(path, project_dir),
+            "callback": callback,
+        }
+        self._latest[request["owner"]] = request["serial"]
+        self._pending[request["owner"]] = request
+        self._dispatch()
+
+    def cancel(self, owner):
+        key = self._owner_keys.get(owner)
+        self._latest.pop(key, None)
+        self._pending.pop(key, None)
+
+    def _dispatch(self):
+        while self._pending:
+            worker = next((w for w in self._workers if w.request is None), None)
+            if worker is None:
+                if len(self._workers) >= self.WORKERS:
+                    break
+                # Reap workers that were replaced earlier.
+                multiprocessing.active_children()
+                worker = _CompletionWorker(self._context)
+                if self._poll_timer is None:
+                    worker.notifier = QSocketNotifier(
+                        worker.conn.fileno(), QSocketNotifier.Read, self
+                    )
+                    worker.notifier.activated.connect(self._poll)
+                self._workers.append(worker)
+
+            owner = next(iter(self._pending))
+            request = self._pending.pop(owner)
+            try:
+                worker.send(request)
+            except (EOFError, OSError):
+                self._pending.setdefault(owner, request)
+                self._replace(worker)
+                continue
+
+        if self._poll_timer is None:
+            return
+        if any(w.request is not None for w in self._workers):
+            if not self._poll_timer.isActive():
+                self._poll_timer.start()
+        else:
+            self._poll_timer.stop()
+
+    def _replace(self, worker):
+        worker.stop()
+        self._workers.remove(worker)
+
+    def _poll(self):
+        for worker in list(self._workers):
+            try:
+                if not worker.conn.poll():
+                    if worker.request is None or worker.process.is_alive():
+                        continue
+                    raise EOFError
+                # An idle worker's pipe only becomes readable when it dies.
+                reply = worker.conn.recv()
+            except (EOFError, OSError):
+                # The worker died; a request it had in flight is lost, the
+                # next keystroke asks again.
+                self._replace(worker)
+                continue
+
+            request = worker.request
+            worker.request = None
+            if reply["memory"] > self.MEMORY_LIMIT:
+                self._replace(worker)
+            self._finish(request, reply["names"])
+        self._dispatch()
+
+    def _finish(self, request, names):
+        if not self.is_current(request):
+            return
+        del self._latest[request["owner"]]
+        try:
+            request["callback"](names)
+        except RuntimeError:
+            # The editor was closed while jedi was running.
+            pass
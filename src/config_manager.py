@@ -20,6 +20,15 @@ class ConfigManager:
             "recent_files": [],
             "wrap_mode": False,
             "theme": "default",
+            "python_lexer": "auto",
+            "fast_lexer_min_size": 512 * 1024,
+            "minimap_overview_lines": 20000,
+            "large_file_size": 16 * 1024 * 1024,
+            "minimap_styling_max_size": 16 * 1024 * 1024,
+            "folding_max_size": 32 * 1024 * 1024,
+            "completion_max_size": 4 * 1024 * 1024,
+            "search_index": True,
+            "search_max_results": 20000,
         }
         if not os.path.exists(self.config_file):
             return defaults
@@ -1,25 +1,32 @@
 import base64
-import hashlib
+import codecs
+import ctypes
 import inspect
 import mimetypes
+import mmap
 import os
 import re
-from dataclasses import dataclass, field
+import threading
+from array import array
+from collections import Counter
 from urllib.parse import unquote
 
+from PyQt5 import sip
 from PyQt5.Qsci import QsciScintilla
 from PyQt5.QtCore import QEvent, QObject, QPointF, QRectF, Qt, QTimer, pyqtSignal
-from PyQt5.QtGui import QColor, QDesktopServices, QFont, QPainter, QPalette
+from PyQt5.QtGui import QColor, QDesktopServices, QFont, QImage, QPainter, QPalette
 from PyQt5.QtWidgets import QApplication, QHBoxLayout, QScrollBar, QTextBrowser, QWidget
 
 from src.lexer import (
     JsonLexer,
     MarkdownLexer,
     PlainTextLexer,
+    PythonCustomLexer,
     PythonLexer,
 )
 
 from . import md_renderer
+from .tasks import TaskRunner
 
 
 class AutoPairEventFilter(QObject):
@@ -113,9 +120,73 @@ class AutoPairEventFilter(QObject):
         return False
 
 
+class _SciTextRange(ctypes.Structure):
+    _fields_ = [
+        ("cpMin", ctypes.c_long),
+        ("cpMax", ctypes.c_long),
+        ("lpstrText", ctypes.c_char_p),
+    ]
+
+
+_MINIMAP_WORD_RE = re.compile(r"\S+")
+
+
+def _render_overview(job):
+    # One pixel row per bucket of lines: a bar as long as the bucket's average
+    # line, starting at the indentation of its first line, in the colour of
+    # the style most of its sampled characters have.
+    dpr = job["dpr"]
+    image = QImage(
+        max(1, int(job["width"] * dpr)),
+        max(1, int(job["height"] * dpr)),
+        QImage.Format_ARGB32_Premultiplied,
+    )
+    image.setDevicePixelRatio(dpr)
+    image.fill(Qt.transparent)
+
+    lines, starts, colors = job["lines"], job["starts"], job["colors"]
+    base_x = job["base_x"]
+    painter = QPainter(image)
+    for y, raw in enumerate(job["samples"]):
+        line_count = lines[y + 1] - lines[y]
+        if line_count <= 0:
+            continue
+        text, styles = raw[0::2], raw[1::2]
+        counts = Counter(style for char, style in zip(text, styles) if char > 32)
+        if not counts:
+            continue
+        first_line = text.split(b"\n", 1)[0]
+        indent = len(first_line) - len(first_line.lstrip(b" \t"))
+        length = (starts[y + 1] - starts[y]) / line_count - 1
+        if length <= indent:
+            continue
+        color = QColor.fromRgba(colors[counts.most_common(1)[0][0]])
+        color.setAlpha(190)
+        painter.fillRect(
+            QRectF(base_x + indent, y, min(length, job["width"]) - indent, 1), color
+        )
+    painter.end()
+    return image
+
+
+def _run_overview_task(task, job):
+    try:
+        job["image"] = _render_overview(job)
+    except Exception:
+        job["image"] = None
+    return job
+
+
 class MiniMap(QWidget):
     SCROLLBAR_WIDTH = 12
     HIGH_RANGE = 100000
+    TILE_LINES = 64
+    # Files with more lines than this are drawn whole, as an overview with
+    # one pixel row per bucket of lines, see _render_overview.
+    OVERVIEW_LINES = 20000
+    # Characters of each bucket looked at for its dominant style.
+    OVERVIEW_SAMPLE = 256
+    OVERVIEW_DELAY = 500
 
     def __init__(self, editor=None):
         super().__init__()
@@ -124,11 +195,25 @@ class MiniMap(QWidget):
         self.setMouseTracking(True)
 
         self.LINE_PX = 2.0
-        self.STYLE_FETCH_THRESHOLD = 3000
 
+        # line -> (text, bounds, run_styles), see _build_line_runs.
         self._line_cache = {}
-        self._dirty_lines = set()
-        self._dirty_all = True
+        self._styles_seen = set()
+        # block -> ((content hash, x, width, dpr, palette), QImage)
+        self._tiles = {}
+        self._dirty_tiles = set()
+
+        self.overview_lines = self.OVERVIEW_LINES
+        # Unstyled, every line is drawn in the editor's text colour and
+        # restyling never invalidates the cache; see EditorTab for when.
+        self.styled = True
+        self._overview = None
+        self._overview_task = None
+        self._overview_revision = 0
+        self._overview_timer = QTimer(self)
+        self._overview_timer.setSingleShot(True)
+        self._overview_timer.setInterval(self.OVERVIEW_DELAY)
+        self._overview_timer.timeout.connect(self._start_overview_job)
 
         self._mini_font = QFont("consolas", 1)
         self._mini_font.setPixelSize(2)
@@ -165,59 +250,65 @@ class MiniMap(QWidget):
 
             QTimer.singleShot(0, self._sync_scroll_from_editor)
 
-    def _hash_text(self, text):
-        h = hashlib.blake2b(digest_size=8)
-        h.update(text.encode("utf-8", "ignore"))
-        return int.from_bytes(h.digest(), "little", signed=False)
-
-    def _hash_runs(self, runs):
-        h = hashlib.blake2b(digest_size=8)
-        for style, txt in runs:
-            if style is None:
-                h.update(b"\xff")
-            else:
-                h.update(b"\x00")
-                h.update(int(style).to_bytes(4, "little", signed=False))
-            h.update(txt.encode("utf-8", "ignore"))
-        return int.from_bytes(h.digest(), "little", signed=False)
-
     def invalidate_all(self):
-        self._dirty_all = True
-        self._dirty_lines.clear()
+        self._line_cache.clear()
+        self._tiles.clear()
 
     def mark_dirty_line(self, ln):
-        if ln >= 0:
-            self._dirty_lines.add(int(ln))
+        if self._line_cache.pop(int(ln), None) is not None:
+            self._dirty_tiles.add(int(ln) // self.TILE_LINES)
 
     def mark_dirty_range(self, first, last):
         if last < first:
             first, last = last, first
         first = max(0, int(first))
-        last = max(first, int(last))
-        for ln in range(first, last + 1):
-            self._dirty_lines.add(ln)
+        last = int(last)
+        if last - first < len(self._line_cache):
+            lines = [ln for ln in range(first, last + 1) if ln in self._line_cache]
+        else:
+            lines = [ln for ln in self._line_cache if first <= ln <= last]
+        for ln in lines:
+            del self._line_cache[ln]
+            self._dirty_tiles.add(ln // self.TILE_LINES)
 
     def _on_text_changed(self, *a, **k):
         self._request_update()
 
-    def _on_scn_modified(self, *args):
-        if len(args) >= 6:
-            lines_added = int(args[4])
-            line = int(args[5])
-
-            first = max(0, line - 1)
-            last = line + max(0, lines_added) + 1
+    def _on_scn_modified(self, position, mod_type, text, length, lines_added, *args):
+        # Cached lines are dropped when their text or styling changes, and
+        # every line after an edit that adds or removes lines, since those
+        # moved. Everything else stays cached.
+        text_changed = QsciScintilla.SC_MOD_INSERTTEXT | QsciScintilla.SC_MOD_DELETETEXT
+        if mod_type & text_changed:
+            first = self.editor.SendScintilla(
+                QsciScintilla.SCI_LINEFROMPOSITION, position
+            )
+            if lines_added:
+                last = max(self._line_cache, default=first)
+                self.mark_dirty_range(first, max(first, last))
+            else:
+                self.mark_dirty_line(first)
+        elif mod_type & QsciScintilla.SC_MOD_CHANGESTYLE and self.styled:
+            first = self.editor.SendScintilla(
+                QsciScintilla.SCI_LINEFROMPOSITION, position
+            )
+            last = self.editor.SendScintilla(
+                QsciScintilla.SCI_LINEFROMPOSITION, position + length
+            )
             self.mark_dirty_range(first, last)
         else:
-            self.invalidate_all()
+            return
 
+        self._overview_revision += 1
+        if self._overview_mode() and not self._overview_timer.isActive():
+            self._overview_timer.start()
         self._request_update()
 
     def _on_editor_destroyed(self, *args, **kwargs):
         if self._update_timer.isActive():
             self._update_timer.stop()
         self._line_cache.clear()
-        self._dirty_lines.clear()
+        self._tiles.clear()
         self.editor = None
 
     def resizeEvent(self, event):
@@ -235,7 +326,12 @@ class MiniMap(QWidget):
     def _on_update_timeout(self):
         if not self.editor:
             return
-        self._rebuild_visible_cache()
+        if self._overview_mode():
+            if self._overview_stale() and not self._overview_timer.isActive():
+                self._start_overview_job()
+        else:
+            self._overview = None
+            self._rebuild_visible_cache()
         self._update_scrollbar_thumb()
         self.update()
 
@@ -335,64 +431,51 @@ class MiniMap(QWidget):
 
         self._request_update()
 
-    def _build_line_runs(self, ln, text, lexer, use_full_styles):
-        runs = []
-
-        if not text:
-            return runs
-
-        line_start = self.editor.positionFromLineIndex(ln, 0)
-        if line_start is None:
-            line_start = 0
-
-        if use_full_styles:
-            last_style = None
-            buf = []
-
-            for idx, ch in enumerate(text):
-                style = self.editor.SendScintilla(
-                    QsciScintilla.SCI_GETSTYLEAT, line_start + idx
-                )
-
-                if ch.isspace():
-                    if buf:
-                        runs.append((last_style, "".join(buf)))
-                        buf.clear()
-
-                    space_style = last_style if last_style is not None else style
-                    runs.append((space_style, ch))
-                    continue
-
-                if last_style is None:
-                    last_style = style
-                elif style != last_style:
-                    if buf:
-                        runs.append((last_style, "".join(buf)))
-                    buf = []
-                    last_style = style
-
-                buf.append(ch)
-
-            if buf:
-                runs.append((last_style, "".join(buf)))
-
-        else:
-            style0 = self.editor.SendScintilla(QsciScintilla.SCI_GETSTYLEAT, line_start)
-
-            buf = []
-            for ch in text:
-                if ch.isspace():
-                    if buf:
-                        runs.append((style0, "".join(buf)))
-                        buf.clear()
-                    runs.append((style0, ch))
-                else:
-                    buf.append(ch)
-
-            if buf:
-                runs.append((style0, "".join(buf)))
-
-        return runs
+    def _fetch_styled_raw(self, start, end):
+        # Characters and styles of [start, end) interleaved, as returned by
+        # one SCI_GETSTYLEDTEXT call.
+        length = max(0, end - start)
+        buf = ctypes.create_string_buffer(2 * length + 2)
+        text_range = _SciTextRange(start, end, ctypes.cast(buf, ctypes.c_char_p))
+        self.editor.SendScintilla(
+            QsciScintilla.SCI_GETSTYLEDTEXT,
+            0,
+            sip.voidptr(ctypes.addressof(text_range)),
+        )
+        return buf.raw[: 2 * length]
+
+    def _fetch_styled(self, start, end):
+        data = self._fetch_styled_raw(start, end)
+        if not self.styled:
+            return data[0::2], bytes(len(data) // 2)
+        return data[0::2], data[1::2]
+
+    def _build_line_runs(self, raw, styles):
+        # (text, bounds, run_styles) for one line: run i covers the characters
+        # text[bounds[2 * i]:bounds[2 * i + 1]] in style run_styles[i].
+        # Whitespace is left out of the runs; it only moves the next one.
+        text = raw.decode("utf-8", "replace")
+        if len(text) != len(raw):
+            # One style per character, from the first byte of each.
+            styles = bytes(
+                styles[i] for i, byte in enumerate(raw) if byte & 0xC0 != 0x80
+            )[: len(text)]
+
+        bounds = array("I")
+        run_styles = bytearray()
+        for match in _MINIMAP_WORD_RE.finditer(text):
+            start, end = match.span()
+            pos = start
+            while pos < end:
+                style = styles[pos]
+                run_end = pos + 1
+                while run_end < end and styles[run_end] == style:
+                    run_end += 1
+                bounds.append(pos)
+                bounds.append(run_end)
+                run_styles.append(style)
+                pos = run_end
+        return text, bounds, bytes(run_styles)
 
     def _rebuild_visible_cache(self):
         if not self.editor:
@@ -401,60 +484,201 @@ class MiniMap(QWidget):
         total_lines = max(1, self.editor.lines())
         height = float(max(1, self.height()))
         lines_to_draw = min(int(height / self.LINE_PX), total_lines)
+        # Whole tiles are cached, see paintEvent.
         start_line = int(self._scroll_start_line())
-
-        lexer = self.editor.lexer()
-        use_full_styles = (
-            lexer is not None
-        )  # and total_lines <= self.STYLE_FETCH_THRESHOLD
-
-        if self._dirty_all:
-            self._line_cache.clear()
-
-        for i in range(lines_to_draw):
-            ln = start_line + i
-            if ln >= total_lines:
-                break
-
-            text = self.editor.text(ln)
-            if not text:
-                self._line_cache.pop(ln, None)
-                self._dirty_lines.discard(ln)
+        end_line = min(total_lines, start_line + lines_to_draw)
+        start_line -= start_line % self.TILE_LINES
+        end_line = min(total_lines, -(-end_line // self.TILE_LINES) * self.TILE_LINES)
+
+        # Lines scrolled far away are not worth keeping.
+        if len(self._line_cache) > 4 * max(self.TILE_LINES, lines_to_draw):
+            for ln in [
+                ln for ln in self._line_cache if not start_line <= ln < end_line
+            ]:
+                del self._line_cache[ln]
+
+        ln = start_line
+        while ln < end_line:
+            if ln in self._line_cache:
+                ln += 1
                 continue
+            # Lines missing from the cache in a row are fetched together.
+            first = ln
+            while ln < end_line and ln not in self._line_cache:
+                ln += 1
+            line_starts = [
+                self.editor.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line)
+                for line in range(first, ln)
+            ]
+            end_pos = self.editor.SendScintilla(
+                QsciScintilla.SCI_GETLINEENDPOSITION, ln - 1
+            )
+            text, styles = self._fetch_styled(line_starts[0], end_pos)
+            base = line_starts[0]
+            for offset, line_start in enumerate(line_starts):
+                line = first + offset
+                line_end = self.editor.SendScintilla(
+                    QsciScintilla.SCI_GETLINEENDPOSITION, line
+                )
+                entry = self._build_line_runs(
+                    text[line_start - base : line_end - base],
+                    styles[line_start - base : line_end - base],
+                )
+                self._line_cache[line] = entry
+                self._styles_seen.update(entry[2])
+                self._dirty_tiles.add(line // self.TILE_LINES)
+
+    def _overview_mode(self):
+        return self.editor is not None and self.editor.lines() > self.overview_lines
+
+    def _overview_size(self):
+        return (
+            max(1, self.width() - self.SCROLLBAR_WIDTH),
+            max(1, self.height()),
+            self.devicePixelRatioF(),
+        )
 
-            text_sig = self._hash_text(text)
-            cached = self._line_cache.get(ln)
+    def _overview_stale(self):
+        job = self._overview
+        return (
+            job is None
+            or job["revision"] != self._overview_revision
+            or (job["width"], job["height"], job["dpr"]) != self._overview_size()
+        )
 
-            runs = None
-            style_sig = None
+    def _start_overview_job(self):
+        # Gathers the bucket bounds and a short styled sample of each bucket
+        # here, which costs the same whatever the file size; reducing them
+        # and drawing the image happen on the thread pool.
+        if not self._overview_mode() or self._overview_task is not None:
+            return
 
-            if (
-                cached is not None
-                and not self._dirty_all
-                and ln not in self._dirty_lines
-                and cached["text_sig"] == text_sig
-            ):
-                if use_full_styles:
-                    runs = self._build_line_runs(ln, text, lexer, use_full_styles)
-                    style_sig = self._hash_runs(runs)
+        width, height, dpr = self._overview_size()
+        total_lines = self.editor.lines()
+        lines = [y * total_lines // height for y in range(height)] + [total_lines]
+        starts = [
+            self.editor.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line)
+            for line in lines[:-1]
+        ] + [self.editor.length()]
+        samples = [
+            self._fetch_styled_raw(
+                starts[y], min(starts[y + 1], starts[y] + self.OVERVIEW_SAMPLE)
+            )
+            for y in range(height)
+        ]
 
-                    if style_sig == cached["style_sig"]:
-                        continue
-                else:
-                    continue
+        lexer = self.editor.lexer()
+        colors = {}
+        for style in set(b"".join(samples)[1::2]):
+            color = self.editor.color()
+            if lexer and self.styled:
+                try:
+                    color = lexer.color(style)
+                except Exception:
+                    pass
+            colors[style] = color.rgba()
+
+        job = {
+            "revision": self._overview_revision,
+            "width": width,
+            "height": height,
+            "dpr": dpr,
+            "base_x": 2.0,
+            "lines": lines,
+            "starts": starts,
+            "samples": samples,
+            "colors": colors,
+        }
+        self._overview_task = TaskRunner.instance().submit(
+            ("minimap-overview", id(self)),
+            _run_overview_task,
+            job,
+            on_result=self._on_overview_finished,
+        )
 
-            if runs is None:
-                runs = self._build_line_runs(ln, text, lexer, use_full_styles)
-                style_sig = self._hash_runs(runs)
+    def _on_overview_finished(self, job):
+        self._overview_task = None
+        if not self.editor:
+            return
+        if job["image"] is not None:
+            self._overview = job
+            self.update()
+        if self._overview_mode() and self._overview_stale():
+            self._overview_timer.start()
 
-            self._line_cache[ln] = {
-                "text_sig": text_sig,
-                "style_sig": style_sig,
-                "runs": runs,
-            }
-            self._dirty_lines.discard(ln)
+    def _paint_overview(self, painter, content_rect):
+        total_lines = max(1, self.editor.lines())
+        height = float(max(1, content_rect.height()))
+        visible_lines = max(
+            1, self.editor.SendScintilla(QsciScintilla.SCI_LINESONSCREEN)
+        )
+        overlay_y = self.editor.firstVisibleLine() * height / total_lines
+        overlay_h = max(2.0, visible_lines * height / total_lines)
+        painter.fillRect(
+            QRectF(0, overlay_y, content_rect.width(), overlay_h),
+            QColor(255, 255, 255, 30),
+        )
+
+        if self._overview is not None:
+            painter.setClipRect(content_rect)
+            painter.drawImage(QPointF(0, 0), self._overview["image"])
+
+    def _line_at(self, y):
+        if self._overview_mode():
+            total_lines = max(1, self.editor.lines())
+            return int(y * total_lines / max(1, self.height()))
+        return self._scroll_start_line() + int(y / self.LINE_PX)
+
+    def _palette_key(self, lexer):
+        colors = {}
+        for style in sorted(self._styles_seen):
+            color = self.editor.color()
+            if lexer and self.styled:
+                try:
+                    color = lexer.color(style)
+                except Exception:
+                    pass
+            colors[style] = color
+        return tuple((style, color.rgba()) for style, color in colors.items()), colors
+
+    def _tile_hash(self, block):
+        first = block * self.TILE_LINES
+        parts = []
+        for ln in range(first, first + self.TILE_LINES):
+            entry = self._line_cache.get(ln)
+            if entry is not None:
+                text, bounds, run_styles = entry
+                parts.append((ln, text, bounds.tobytes(), run_styles))
+        return hash(tuple(parts))
+
+    def _render_tile(self, block, width, base_x, colors):
+        dpr = self.devicePixelRatioF()
+        height = self.TILE_LINES * self.LINE_PX
+        image = QImage(
+            max(1, int(width * dpr)),
+            max(1, int(height * dpr)),
+            QImage.Format_ARGB32_Premultiplied,
+        )
+        image.setDevicePixelRatio(dpr)
+        image.fill(Qt.transparent)
 
-        self._dirty_all = False
+        painter = QPainter(image)
+        painter.setFont(self._mini_font)
+        first = block * self.TILE_LINES
+        for i in range(self.TILE_LINES):
+            entry = self._line_cache.get(first + i)
+            if not entry:
+                continue
+            text, bounds, run_styles = entry
+            text_y = i * self.LINE_PX + self.LINE_PX - 0.5
+            for j, style in enumerate(run_styles):
+                start = bounds[2 * j]
+                painter.setPen(colors.get(style) or self.editor.color())
+                painter.drawText(
+                    QPointF(base_x + start, text_y), text[start : bounds[2 * j + 1]]
+                )
+        painter.end()
+        return image
 
     def paintEvent(self, event):
         if not self.editor:
@@ -468,6 +692,15 @@ class MiniMap(QWidget):
         lighter_bg = editor_bg.lighter(106)
         painter.fillRect(content_rect, lighter_bg)
 
+        if self._overview_mode():
+            self._paint_overview(painter, content_rect)
+            painter.restore()
+            return
+
+        # Lines that changed since the last update are styled into the
+        # cache, so every visible tile can be checked against it.
+        self._rebuild_visible_cache()
+
         editor_first = self.editor.firstVisibleLine()
         visible_lines = max(
             1, self.editor.SendScintilla(QsciScintilla.SCI_LINESONSCREEN)
@@ -484,18 +717,10 @@ class MiniMap(QWidget):
 
         painter.setClipRect(content_rect)
 
-        painter.setFont(self._mini_font)
-
         total_lines = max(1, self.editor.lines())
-        if total_lines == 0:
-            painter.restore()
-            return
-
         height = float(max(1, content_rect.height()))
         lines_to_draw = min(int(height / self.LINE_PX), total_lines)
-
-        lexer = self.editor.lexer()
-        color_cache = {}
+        end_line = min(total_lines, start_line + lines_to_draw)
 
         x_offset = self.editor.SendScintilla(QsciScintilla.SCI_GETXOFFSET)
 
@@ -509,74 +734,35 @@ class MiniMap(QWidget):
         scrolled_chars = x_offset / char_width
         base_x = 2.0 - scrolled_chars
 
-        for i in range(lines_to_draw):
-            line_num = start_line + i
-            if line_num >= total_lines:
-                break
+        # Blocks of TILE_LINES lines are rendered once into images and only
+        # rendered again when one of their lines, the colours, the width or
+        # the horizontal scroll changed; scrolling just draws the images.
+        palette, colors = self._palette_key(self.editor.lexer())
+        width = content_rect.width()
+        dpr = self.devicePixelRatioF()
+        blocks = range(
+            start_line // self.TILE_LINES,
+            max(start_line, end_line - 1) // self.TILE_LINES + 1,
+        )
+        for block in blocks:
+            tile = self._tiles.get(block)
+            if tile is None or block in self._dirty_tiles:
+                content = self._tile_hash(block)
+                self._dirty_tiles.discard(block)
+            else:
+                content = tile[0][0]
 
-            y_pos = i * self.LINE_PX
-            entry = self._line_cache.get(line_num)
-
-            x = base_x
-
-            if entry:
-                runs = entry["runs"]
-                for style, txt in runs:
-                    if not txt:
-                        continue
-
-                    if style is None:
-                        x += float(len(txt))
-                        continue
-
-                    if lexer:
-                        color = color_cache.get(style)
-                        if color is None:
-                            try:
-                                color = lexer.color(style)
-                            except Exception:
-                                color = self.editor.color()
-                            color_cache[style] = color
-                    else:
-                        color = self.editor.color()
+            key = (content, base_x, width, dpr, palette)
+            if tile is None or tile[0] != key:
+                tile = (key, self._render_tile(block, width, base_x, colors))
+            self._tiles[block] = tile
 
-                    painter.setPen(color)
-                    painter.drawText(QPointF(x, y_pos + self.LINE_PX - 0.5), txt)
-                    x += float(len(txt))
-            else:
-                text = self.editor.text(line_num)
-                if text and text.strip():
-                    try:
-                        line_start = self.editor.positionFromLineIndex(line_num, 0)
-                        if line_start is None:
-                            line_start = 0
-                        style0 = self.editor.SendScintilla(
-                            QsciScintilla.SCI_GETSTYLEAT,
-                            line_start,
-                        )
-                    except Exception:
-                        style0 = 0
-
-                    color = lexer.color(style0) if lexer else self.editor.color()
-                    painter.setPen(color)
-
-                    buf = []
-                    for ch in text:
-                        if ch.isspace():
-                            if buf:
-                                s = "".join(buf)
-                                painter.drawText(
-                                    QPointF(x, y_pos + self.LINE_PX - 0.5), s
-                                )
-                                x += float(len(s))
-                                buf.clear()
-                            x += 1.0
-                        else:
-                            buf.append(ch)
+            y = (block * self.TILE_LINES - start_line) * self.LINE_PX
+            painter.drawImage(QPointF(0, y), tile[1])
 
-                    if buf:
-                        s = "".join(buf)
-                        painter.drawText(QPointF(x, y_pos + self.LINE_PX - 0.5), s)
+        if len(self._tiles) > 2 * len(blocks) + 4:
+            for block in [block for block in self._tiles if block not in blocks]:
+                del self._tiles[block]
 
         painter.restore()
 
@@ -593,15 +779,12 @@ class MiniMap(QWidget):
             self.scrollbar.setValue(val)
             return
 
-        clicked_offset = int(event.pos().y() / self.LINE_PX)
-
         total_lines = max(1, self.editor.lines())
         visible_lines = max(
             1, self.editor.SendScintilla(QsciScintilla.SCI_LINESONSCREEN)
         )
 
-        start_line = self._scroll_start_line()
-        clicked_line = start_line + clicked_offset
+        clicked_line = self._line_at(event.pos().y())
         clicked_line = max(0, min(clicked_line, total_lines - 1))
 
         desired_first = clicked_line - (visible_lines // 2)
@@ -635,107 +818,231 @@ class MiniMap(QWidget):
         event.accept()
 
 
-@dataclass
-class Block:
-    start: int
-    end: int
-    indent: int
-    level: int
-    children: list = field(default_factory=list)
-
+class FoldEngine(QObject):
+    # Indentation folding, kept up to date line by line. The indentation of
+    # every line and the fold level last given to Scintilla are kept in
+    # arrays that follow the edits reported by SCN_MODIFIED; after an edit
+    # only the changed lines are read again, levels are recomputed from the
+    # previous non-blank line until the next unindented line past the edit,
+    # and only the levels that changed are sent.
+    DELAY = 150
 
-from PyQt5.QtCore import QThread, pyqtSignal
+    BLANK = -1
+    UNKNOWN = -2
 
-
-class FoldingWorker(QThread):
-    folding_ready = pyqtSignal(list)
-
-    def __init__(self, text):
-        super().__init__()
-        self.text = text
-
-    def run(self):
-        lines = self.text.splitlines()
-        if self.text.endswith("\n") or self.text.endswith("\r"):
-            lines.append("")
-
-        total_lines = len(lines)
-        if total_lines == 0:
-            self.folding_ready.emit([])
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+        self._indents = array("i")
+        self._levels = array("i")
+        self._dirty = None
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.DELAY)
+        self._timer.timeout.connect(self.update)
+
+        self.editor.SCN_MODIFIED.connect(self._on_scn_modified)
+        self._reset()
+
+    def _reset(self):
+        lines = max(1, self.editor.lines())
+        self._indents = array("i", [self.UNKNOWN]) * lines
+        self._levels = array("i", [-1]) * lines
+        self._dirty = (0, lines - 1)
+        self._timer.start()
+
+    def _on_scn_modified(self, position, mod_type, text, length, lines_added, *args):
+        if not mod_type & (
+            QsciScintilla.SC_MOD_INSERTTEXT | QsciScintilla.SC_MOD_DELETETEXT
+        ):
             return
 
-        BASE = QsciScintilla.SC_FOLDLEVELBASE
-        HEADER = QsciScintilla.SC_FOLDLEVELHEADERFLAG
-        WHITE = QsciScintilla.SC_FOLDLEVELWHITEFLAG
-        INDENT_SIZE = 4
-
-        def norm_text(ln_text):
-            return ln_text.replace("\t", " " * INDENT_SIZE).rstrip("\r\n")
-
-        def get_indent(ln_text):
-            text = norm_text(ln_text)
-            if not text.strip():
-                return None
-            return len(text) - len(text.lstrip(" "))
-
-        sig = []
-        for ln, line_text in enumerate(lines):
-            ind = get_indent(line_text)
-            if ind is not None:
-                sig.append((ln, ind))
-
-        fold_data = []
-
-        if not sig:
-            for ln in range(total_lines):
-                fold_data.append((ln, BASE))
-            self.folding_ready.emit(fold_data)
+        line = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, position)
+        if lines_added > 0:
+            self._indents[line + 1 : line + 1] = (
+                array("i", [self.UNKNOWN]) * lines_added
+            )
+            self._levels[line + 1 : line + 1] = array("i", [-1]) * lines_added
+        elif lines_added < 0:
+            del self._indents[line + 1 : line + 1 - lines_added]
+            del self._levels[line + 1 : line + 1 - lines_added]
+        # Scintilla may have changed the level of the edited line itself.
+        self._levels[line] = -1
+
+        first, last = line, line + max(0, lines_added)
+        if self._dirty is not None:
+            lo, hi = self._dirty
+            if hi > line:
+                hi = max(line, hi + lines_added)
+            first, last = min(lo, first), max(hi, last)
+        self._dirty = (first, last)
+        self._timer.start()
+
+    def _read_indent(self, line):
+        send = self.editor.SendScintilla
+        if send(QsciScintilla.SCI_GETLINEINDENTPOSITION, line) == send(
+            QsciScintilla.SCI_GETLINEENDPOSITION, line
+        ):
+            return self.BLANK
+        return send(QsciScintilla.SCI_GETLINEINDENTATION, line)
+
+    def _set_level(self, line, level):
+        if self._levels[line] != level:
+            self._levels[line] = level
+            self.editor.SendScintilla(QsciScintilla.SCI_SETFOLDLEVEL, line, level)
+
+    def update(self):
+        if self._dirty is None:
+            return
+        provides_folding = getattr(self.editor.lexer(), "provides_folding", None)
+        if provides_folding is not None and provides_folding():
+            # The lexer folds by its own tokens.
+            self._dirty = None
             return
+        total = self.editor.lines()
+        if len(self._indents) != total:
+            # Out of step with the document; start over.
+            self._reset()
+        first, last = self._dirty
+        self._dirty = None
+        last = min(last, total - 1)
+
+        indents = self._indents
+        for line in range(first, last + 1):
+            indents[line] = self._read_indent(line)
+
+        # The previous non-blank line may become a header or stop being one.
+        start = first - 1
+        while start >= 0 and indents[start] < 0:
+            start -= 1
+        if start < 0:
+            start = 0
+
+        # Indents of the blocks open before start, outermost first.
+        stack = []
+        if indents[start] >= 0:
+            lowest = indents[start]
+            line = start - 1
+            while line >= 0 and lowest > 0:
+                if 0 <= indents[line] < lowest:
+                    lowest = indents[line]
+                    stack.append(lowest)
+                line -= 1
+            stack.reverse()
+
+        self._relevel(start, last, stack)
+
+    def _relevel(self, start, last, stack):
+        base = QsciScintilla.SC_FOLDLEVELBASE
+        header = QsciScintilla.SC_FOLDLEVELHEADERFLAG
+        white = QsciScintilla.SC_FOLDLEVELWHITEFLAG
+        indents = self._indents
+        total = len(indents)
+
+        prev = None
+        prev_level = base
+        blanks = []
+        for line in range(start, total):
+            indent = indents[line]
+            if indent < 0:
+                blanks.append(line)
+                continue
 
-        root = Block(-1, total_lines - 1, -1, 0)
-        stack = [root]
-        line_level = [0] * total_lines
-        line_is_header = [False] * total_lines
+            if prev is None:
+                for blank in blanks:
+                    self._set_level(blank, base)
+            else:
+                is_header = indent > indents[prev]
+                self._set_level(prev, prev_level | header if is_header else prev_level)
+                for blank in blanks:
+                    self._set_level(blank, prev_level | white)
+            blanks = []
+
+            if line > last and indent == 0:
+                # Nothing from an unindented line on depends on what came
+                # before it, and nothing past the edit has changed.
+                break
 
-        for i, (ln, ind) in enumerate(sig):
-            while len(stack) > 1 and ind <= stack[-1].indent:
+            while stack and indent <= stack[-1]:
                 stack.pop()
-
-            parent = stack[-1]
-            node = Block(start=ln, end=total_lines - 1, indent=ind, level=len(stack))
-            parent.children.append(node)
-            stack.append(node)
-
-            line_level[ln] = len(stack) - 1
-
-            next_ind = None
-            if i + 1 < len(sig):
-                next_ind = sig[i + 1][1]
-
-            if next_ind is not None and next_ind > ind:
-                line_is_header[ln] = True
-
-        for idx, (ln, ind) in enumerate(sig):
-            current_level = line_level[ln]
-            fold_level = BASE + current_level
-            if line_is_header[ln]:
-                fold_level |= HEADER
-
-            fold_data.append((ln, fold_level))
-
-            if ln + 1 < total_lines:
-                if not norm_text(lines[ln + 1]).strip():
-                    nxt = ln + 1
-                    while nxt < total_lines and not norm_text(lines[nxt]).strip():
-                        fold = BASE + current_level | WHITE
-                        fold_data.append((nxt, fold))
-                        nxt += 1
-
-        self.folding_ready.emit(fold_data)
+            stack.append(indent)
+            prev, prev_level = line, base + len(stack)
+        else:
+            if prev is not None:
+                self._set_level(prev, prev_level)
+            for blank in blanks:
+                self._set_level(blank, base if prev is None else prev_level | white)
+
+
+def _file_eol(data):
+    # The line break of the file's first line, None without any.
+    newline = data.find(b"\n")
+    if newline == -1:
+        return "\r" if data.find(b"\r") != -1 else None
+    carriage_return = data.find(b"\r", 0, newline + 1)
+    if carriage_return == -1:
+        return "\n"
+    return "\r\n" if carriage_return == newline - 1 else "\r"
+
+
+def _read_file_chunks(task, path, chunk_size, window):
+    # Maps the file and reports it as (chunk, bytes read, file size), last
+    # chunk first: QScintilla counts the characters in front of every
+    # insertion, so text goes in at the start of the document, where that is
+    # free. Chunks end at a line break where there is one and are checked to
+    # be UTF-8 on the way. Line breaks are turned into "\n", as reading in
+    # text mode does; the one the file used is returned with its size. The
+    # window semaphore is released by the GUI thread once a chunk is
+    # inserted, so at most a few are ever waiting in memory.
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0, None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            eol = _file_eol(data)
+            end = size
+            while end > 0:
+                start = max(0, end - chunk_size)
+                if start > 0:
+                    newline = data.find(b"\n", start, end - 1)
+                    if newline != -1:
+                        start = newline + 1
+                    else:
+                        while start > 0 and data[start] & 0xC0 == 0x80:
+                            start -= 1
+                chunk = data[start:end]
+                codecs.utf_8_decode(chunk, "strict", True)
+                if b"\r" in chunk:
+                    chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+                while not window.acquire(timeout=0.1):
+                    task.token.check()
+                task.token.check()
+                task.report((chunk, size - start, size))
+                end = start
+    return size, eol
 
 
 class EditorTab(QWidget):
     contentChanged = pyqtSignal(bool)
+    # Percent of a large file loaded so far, then whether loading finished
+    # or failed, with the error message.
+    loadProgress = pyqtSignal(int)
+    loadFinished = pyqtSignal()
+    loadFailed = pyqtSignal(str)
+    # Python files at least this big get PythonCustomLexer when the
+    # "python_lexer" setting is "auto".
+    FAST_LEXER_MIN_SIZE = 512 * 1024
+    # Files at least this big are loaded in chunks in the background, see
+    # load_large_file.
+    LARGE_FILE_SIZE = 16 * 1024 * 1024
+    LOAD_CHUNK_SIZE = 1024 * 1024
+    LOAD_WINDOW = 4
+    # Past these sizes the minimap is drawn in one colour, folding is off
+    # and there is no completion (jedi or otherwise).
+    MINIMAP_STYLING_MAX_SIZE = 16 * 1024 * 1024
+    FOLDING_MAX_SIZE = 32 * 1024 * 1024
+    COMPLETION_MAX_SIZE = 4 * 1024 * 1024
 
     def __init__(
         self, plugin_manager, filepath=None, main_window=None, wrap_mode=False
@@ -754,7 +1061,35 @@ class EditorTab(QWidget):
         self.minimap = MiniMap(self.editor)
         self.filepath = filepath
         self.is_modified = False
+        # Counts edits, so a save finishing in the background can tell
+        # whether the text it wrote is still the current one.
+        self.revision = 0
         self.main_window = main_window
+        self.loading = False
+        # The line break the file was read with, which saving writes back;
+        # None for the platform's.
+        self.eol = None
+        if main_window:
+            self.minimap.overview_lines = main_window.config_manager.get(
+                "minimap_overview_lines", MiniMap.OVERVIEW_LINES
+            )
+
+        try:
+            self.file_size = os.path.getsize(filepath) if filepath else 0
+        except OSError:
+            self.file_size = 0
+        self.is_large_file = self.file_size >= self._setting(
+            "large_file_size", self.LARGE_FILE_SIZE
+        )
+        self.minimap.styled = self.file_size < self._setting(
+            "minimap_styling_max_size", self.MINIMAP_STYLING_MAX_SIZE
+        )
+        self.folding_enabled = self.file_size < self._setting(
+            "folding_max_size", self.FOLDING_MAX_SIZE
+        )
+        self.completion_enabled = self.file_size < self._setting(
+            "completion_max_size", self.COMPLETION_MAX_SIZE
+        )
         self.wrap_mode = wrap_mode
         self.theme_name = (
             self.main_window.config_manager.get("theme", "default-theme")
@@ -779,11 +1114,19 @@ class EditorTab(QWidget):
         self.setup_basic_editor()
 
         self.setup_lexer_features(filepath)
+        if not self.folding_enabled and hasattr(self.lexer, "disable_folding"):
+            self.lexer.disable_folding()
+        if not self.completion_enabled:
+            self.editor.setAutoCompletionSource(QsciScintilla.AcsNone)
 
         self.editor.installEventFilter(self)
         self.preview_mode = False
         self.preview_widget = None
 
+    def _setting(self, key, default):
+        config = self.main_window.config_manager if self.main_window else None
+        return config.get(key, default) if config else default
+
     def setup_lexer_features(self, filepath):
         if not filepath or not self.plugin_manager:
             self.setup_text_features()
@@ -823,36 +1166,17 @@ class EditorTab(QWidget):
             self.setup_text_features()
 
     def refresh_autocomplete(self):
-        if not (hasattr(self, "lexer") and self.filepath):
+        if not (hasattr(self, "lexer") and self.filepath and self.completion_enabled):
             return
 
         if hasattr(self.lexer, "build_apis"):
             self.lexer.build_apis()
             return
 
-    def _start_folding_worker(self):
-        if self.folding_worker and self.folding_worker.isRunning():
-            self.folding_worker.terminate()
-            self.folding_worker.wait()
-
-        text = self.editor.text()
-        self.folding_worker = FoldingWorker(text)
-        self.folding_worker.folding_ready.connect(self._apply_folding)
-        self.folding_worker.start()
-
-    def _apply_folding(self, fold_data):
-        for ln, level in fold_data:
-            self.editor.SendScintilla(QsciScintilla.SCI_SETFOLDLEVEL, ln, level)
-
     def setup_basic_editor(self):
         self.editor.textChanged.connect(self.on_text_changed)
         self.editor.textChanged.connect(self.update_line_count)
-        self.fold_timer = QTimer(self)
-        self.fold_timer.setSingleShot(True)
-        self.fold_timer.setInterval(1500)
-        self.fold_timer.timeout.connect(self._start_folding_worker)
-        self.folding_worker = None
-        self.editor.textChanged.connect(self.fold_timer.start)
+        self.fold_engine = FoldEngine(self.editor) if self.folding_enabled else None
         self.editor.setStyleSheet("""
             QScrollBar:horizontal, QScrollBar:vertical {
                 border: none;
@@ -940,7 +1264,11 @@ class EditorTab(QWidget):
 
         self.editor.SendScintilla(QsciScintilla.SCI_SETSCROLLWIDTH, 1)
         self.editor.SendScintilla(QsciScintilla.SCI_SETSCROLLWIDTHTRACKING, True)
-        self.editor.setFolding(QsciScintilla.PlainFoldStyle)
+        self.editor.setFolding(
+            QsciScintilla.PlainFoldStyle
+            if self.folding_enabled
+            else QsciScintilla.NoFoldStyle
+        )
 
         self.editor.setMarginType(2, QsciScintilla.SymbolMargin)
         self.editor.setMarginSensitivity(2, True)
@@ -979,12 +1307,40 @@ class EditorTab(QWidget):
         self.lexer.setDefaultFont(font)
         self.editor.setLexer(self.lexer)
 
+    def python_lexer_class(self):
+        config = self.main_window.config_manager if self.main_window else None
+        engine = config.get("python_lexer", "auto") if config else "auto"
+        if engine == "fast":
+            return PythonCustomLexer
+        if engine != "auto" or not self.filepath:
+            return PythonLexer
+
+        threshold = (
+            config.get("fast_lexer_min_size", self.FAST_LEXER_MIN_SIZE)
+            if config
+            else self.FAST_LEXER_MIN_SIZE
+        )
+        try:
+            if os.path.getsize(self.filepath) >= threshold:
+                return PythonCustomLexer
+        except OSError:
+            pass
+        return PythonLexer
+
     def setup_python_features(self):
         font = self.editor.font()
-        self.lexer = PythonLexer(self.editor, theme_name=self.theme_name)
+        lexer_class = self.python_lexer_class()
+        self.lexer = lexer_class(self.editor, theme_name=self.theme_name)
         self.lexer.setDefaultFont(font)
         self.editor.setLexer(self.lexer)
 
+        self.lexer.filepath = self.filepath
+        if self.main_window:
+            self.lexer.project_dir = getattr(
+                self.main_window, "current_project_dir", None
+            )
+            self.lexer.symbol_index = getattr(self.main_window, "symbol_index", None)
+
         self.lexer.build_apis()
 
         self.editor.setAutoCompletionSource(QsciScintilla.AcsAPIs)
@@ -1216,7 +1572,7 @@ class EditorTab(QWidget):
             return
 
     def handle_text_changed(self):
-        if not self.is_modified:
+        if not self.is_modified and not self.loading:
             self.is_modified = True
             current_index = self.main_window.tabs.currentIndex()
             current_text = self.main_window.tabs.tabText(current_index)
@@ -1224,17 +1580,70 @@ class EditorTab(QWidget):
                 self.main_window.tabs.setTabText(current_index, "*" + current_text)
 
     def on_text_changed(self):
+        if self.loading:
+            return
+        self.revision += 1
         if not self.is_modified:
             self.is_modified = True
-        if hasattr(self, "lexer"):
-            self.editor.recolor()
 
         if hasattr(self, "auto_timer"):
             self.auto_timer.start(500)
 
+    def load_large_file(self):
+        # Memory-maps the file and inserts it into Scintilla in chunks as a
+        # background reader hands them over, so the window stays responsive
+        # and no other copy of the text is kept. The editor is read-only and
+        # records no undo history until the last chunk is in.
+        self.loading = True
+        self._load_window = threading.Semaphore(self.LOAD_WINDOW)
+        self.editor.setReadOnly(True)
+        self.editor.SendScintilla(QsciScintilla.SCI_SETUNDOCOLLECTION, False)
+        self.editor.SendScintilla(QsciScintilla.SCI_ALLOCATE, self.file_size + 1)
+
+        key = ("file-load", id(self))
+        self.destroyed.connect(lambda *args: TaskRunner.instance().cancel(key))
+        TaskRunner.instance().submit(
+            key,
+            _read_file_chunks,
+            self.filepath,
+            self.LOAD_CHUNK_SIZE,
+            self._load_window,
+            on_progress=self._on_chunk_loaded,
+            on_result=self._on_file_loaded,
+            on_error=self._on_file_load_failed,
+            long_running=True,
+        )
+
+    def _on_chunk_loaded(self, value):
+        chunk, done, total = value
+        self.editor.setReadOnly(False)
+        self.editor.SendScintilla(QsciScintilla.SCI_INSERTTEXT, 0, chunk)
+        self.editor.setReadOnly(True)
+        self._load_window.release()
+        self.loadProgress.emit(done * 100 // total)
+
+    def _end_loading(self):
+        self.loading = False
+        self.editor.setReadOnly(False)
+        self.editor.SendScintilla(QsciScintilla.SCI_SETUNDOCOLLECTION, True)
+        self.editor.SendScintilla(QsciScintilla.SCI_EMPTYUNDOBUFFER)
+        self.editor.SendScintilla(QsciScintilla.SCI_SETSAVEPOINT)
+
+    def _on_file_loaded(self, result):
+        _size, self.eol = result
+        self._end_loading()
+        self.loadFinished.emit()
+
+    def _on_file_load_failed(self, message):
+        self._end_loading()
+        self.loadFailed.emit(message)
+
     def save(self):
         self.is_modified = False
-        current_index = self.main_window.tabs.currentIndex()
+        current_index = self.main_window.tabs.indexOf(self)
+        if current_index == -1:
+            # Inside a split view.
+            current_index = self.main_window.tabs.currentIndex()
         current_text = self.main_window.tabs.tabText(current_index)
         if current_text.startswith("*") and self.filepath:
             self.main_window.tabs.setTabText(current_index, current_text[1:])
@@ -1285,9 +1694,15 @@ class EditorTab(QWidget):
                     return True
 
             if event.modifiers() == Qt.ControlModifier and event.key() == Qt.Key_Space:
-                if self.filepath:
-                    self.lexer.build_apis()
-                    self.editor.autoCompleteFromAPIs()
+                if self.filepath and self.completion_enabled:
+                    if hasattr(self.lexer, "show_completions"):
+                        self.lexer.show_completions()
+                    else:
+                        self.lexer.build_apis()
+                        if hasattr(self.lexer, "show_completion_list"):
+                            self.lexer.show_completion_list()
+                        else:
+                            self.editor.autoCompleteFromAPIs()
                     return True
 
         return super().eventFilter(obj, event)
@@ -1,7 +1,7 @@
 import os
 import shutil
 
-from PyQt5.QtGui import QIcon
+from PyQt5.QtGui import QColor, QIcon, QPalette
 from PyQt5.QtWidgets import (
     QAbstractItemView,
     QMessageBox,
@@ -9,6 +9,8 @@ from PyQt5.QtWidgets import (
     QTreeView,
 )
 
+from .project_files import ProjectFiles
+
 
 class FileTreeDelegate(QStyledItemDelegate):
     def __init__(self, tree_view, plugin_manager=None, parent=None):
@@ -27,12 +29,38 @@ class FileTreeDelegate(QStyledItemDelegate):
         self.lumos_icon = QIcon("resources:/lumos-icon.ico")
         self.git_icon = QIcon("resources:/gitignore-icon.ico")
         self.binary_icon = QIcon("resources:/binary-icon.ico")
+        # Directory -> names ignored in it, for the project in _ignored_root;
+        # painting never touches the disk for what is already known.
+        self._ignored = {}
+        self._ignored_root = None
+
+    def forget_ignored(self):
+        # After a change on disk, which may have been to an ignore file.
+        self._ignored = {}
+
+    def _is_ignored(self, path):
+        root = getattr(self.tree_view.main_window, "current_project_dir", None)
+        if not root:
+            return False
+        if root != self._ignored_root:
+            self._ignored = {}
+            self._ignored_root = root
+        directory, name = os.path.split(path)
+        names = self._ignored.get(directory)
+        if names is None:
+            names = ProjectFiles.for_root(root).ignored_names(directory)
+            self._ignored[directory] = names
+        return name in names
 
     def initStyleOption(self, option, index):
         super().initStyleOption(option, index)
         path = index.model().filePath(index)
         option.text = os.path.basename(option.text)
 
+        # Dimmed, as in git-aware editors, when the project ignores it.
+        if self._is_ignored(path):
+            option.palette.setColor(QPalette.Text, QColor("#6e6e6e"))
+
         if os.path.isdir(path):
             if self.tree_view.isExpanded(index):
                 option.icon = self.folder_open_icon
@@ -0,0 +1,51 @@
+import hashlib
+import os
+
+# A fingerprint is (size, mtime_ns, inode, digest) of a file as the editor
+# last loaded or saved it. Checking one costs a stat; the file is only read
+# again, in chunks, when the stat no longer matches.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _digest(data=b""):
+    return hashlib.blake2b(data, digest_size=16)
+
+
+def _stat_key(st):
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def hash_file(path):
+    digest = _digest()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path):
+    # Stat taken before hashing, so a write racing with the hash shows up as
+    # a changed stat on the next check.
+    return _stat_key(os.stat(path)) + (hash_file(path),)
+
+
+def data_fingerprint(path, data):
+    # For a file just written with data; saves reading it back.
+    return _stat_key(os.stat(path)) + (_digest(data).hexdigest(),)
+
+
+def changed_on_disk(path, fingerprint):
+    # False when the file still has the recorded content, including when only
+    # its timestamp changed, and when it no longer exists.
+    try:
+        st = os.stat(path)
+        if _stat_key(st) == fingerprint[:3]:
+            return False
+        if st.st_size != fingerprint[0]:
+            return True
+        return hash_file(path) != fingerprint[3]
+    except OSError:
+        return False
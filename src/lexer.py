@@ -1,21 +1,19 @@
-# import builtins
-# import io
 import json
 import keyword
 import os
 import re
-
-# import tokenize
+import string
+import time
+from collections import OrderedDict
 from typing import TypedDict
 
-import jedi
-from pygments import lex
-from pygments.lexer import bygroups, inherit
+from pygments.lexer import RegexLexer, _TokenType, bygroups, include, inherit, words
 from pygments.lexers.data import JsonLexer as PyG_JsonLexer
 from pygments.lexers.markup import MarkdownLexer as PyG_MarkdownLexer
 from pygments.lexers.python import PythonLexer as PyG_PythonLexer
 from pygments.token import (
     Comment,
+    Error,
     Generic,
     Keyword,
     Literal,
@@ -26,11 +24,15 @@ from pygments.token import (
     String,
     Text,
     Token,
+    Whitespace,
 )
 from PyQt5.Qsci import QsciAPIs, QsciLexerCustom, QsciScintilla
 from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QColor, QFont
 
+from .completion import CompletionService
+from .tasks import TaskRunner
+
 
 class DefaultConfig(TypedDict):
     color: str
@@ -38,8 +40,33 @@ class DefaultConfig(TypedDict):
     font: tuple[str, int]
 
 
+def _run_style_task(task, lexer, job):
+    try:
+        lexer._run_style_job(job)
+    except Exception:
+        job["failed"] = True
+    return job
+
+
 class BaseLexer(QsciLexerCustom):
     DEBOUNCE_DELAY = 300
+    # When enabled, tokenization runs on the TaskRunner pool and only the
+    # resulting (length, style) runs are applied on the GUI thread.
+    WORKER_MODE = False
+    # Lines outside the viewport are styled from an idle timer, a chunk of
+    # lines at a time, until the per-tick budget is used up. Inline lexers
+    # shrink or grow the chunk so that one chunk fits in the budget.
+    IDLE_CHUNK_LINES = 500
+    IDLE_BUDGET_MS = 10
+    # Completion lists given to set_completions() within this many ms of each
+    # other are prepared once, and only if they differ from the current one.
+    # The prepared APIs of the last few (file, scope) keys are kept around.
+    APIS_PREPARE_DELAY = 30
+    APIS_CACHE_SIZE = 16
+    # How the document folds: "indent" leaves it to the editor's indentation
+    # FoldEngine, any other key of FOLD_PROVIDERS has the lexer compute fold
+    # levels from its own tokens while styling.
+    FOLDING = "indent"
 
     def __init__(
         self,
@@ -51,7 +78,17 @@ class BaseLexer(QsciLexerCustom):
         super(BaseLexer, self).__init__(editor)
 
         self.editor = editor
-        self.apis = QsciAPIs(self)
+        self.apis = None
+        self._apis_names = None
+        self._apis_cache = OrderedDict()
+        self._apis_next = None
+        self._apis_show_pending = False
+        self._apis_preparing = set()
+        self._apis_timer = QTimer()
+        self._apis_timer.setSingleShot(True)
+        self._apis_timer.setInterval(self.APIS_PREPARE_DELAY)
+        self._apis_timer.timeout.connect(self._apply_completions)
+        self._new_apis()
         self.language_name = language_name
         self.theme_json = None
 
@@ -75,8 +112,17 @@ class BaseLexer(QsciLexerCustom):
         self._debounce_timer.setInterval(self.DEBOUNCE_DELAY)
         self._debounce_timer.timeout.connect(self._process_pending_style)
 
-        self._pending_style_start = None
-        self._pending_style_end = None
+        self._pending_ranges = []
+        self._idle_chunk = None
+        self._idle_chunk_lines = self.IDLE_CHUNK_LINES
+        self._idle_timer = QTimer()
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.setInterval(0)
+        self._idle_timer.timeout.connect(self._process_idle_style)
+
+        self._revision = 0
+        self._style_task = None
+        self.editor.SCN_MODIFIED.connect(self._on_scn_modified)
 
         self._init_theme_vars()
         self._init_theme()
@@ -233,6 +279,10 @@ class BaseLexer(QsciLexerCustom):
                     except AttributeError:
                         pass
 
+    def provides_folding(self):
+        # Whether fold levels come from this lexer rather than FoldEngine.
+        return False
+
     def language(self) -> str:
         return self.language_name
 
@@ -240,245 +290,801 @@ class BaseLexer(QsciLexerCustom):
         reverse_map = {v: k.upper() for k, v in self.style_map.items()}
         return reverse_map.get(style, "")
 
+    def _on_scn_modified(self, position, mod_type, *args):
+        if mod_type & (
+            QsciScintilla.SC_MOD_INSERTTEXT | QsciScintilla.SC_MOD_DELETETEXT
+        ):
+            self._revision += 1
+
+    def _line_pos(self, line):
+        if line >= self.editor.lines():
+            return self.editor.length()
+        return self.editor.SendScintilla(QsciScintilla.SCI_POSITIONFROMLINE, line)
+
+    def _visible_range(self):
+        first_visible = self.editor.firstVisibleLine()
+        on_screen = self.editor.SendScintilla(QsciScintilla.SCI_LINESONSCREEN)
+        first = self.editor.SendScintilla(
+            QsciScintilla.SCI_DOCLINEFROMVISIBLE, first_visible
+        )
+        last = self.editor.SendScintilla(
+            QsciScintilla.SCI_DOCLINEFROMVISIBLE, first_visible + on_screen
+        )
+        return self._line_pos(first), self._line_pos(last + 1)
+
+    def _styled_frontier(self):
+        # Position before which the styling is known to be valid, for lexers
+        # that can tell. Idle styling then simply pushes the frontier forward.
+        return None
+
+    def _queue_range(self, start, end):
+        start = max(0, start)
+        end = min(end, self.editor.length())
+        if end < start:
+            return
+
+        ranges = []
+        for s, e in self._pending_ranges:
+            if e < start or s > end:
+                ranges.append([s, e])
+            else:
+                start = min(start, s)
+                end = max(end, e)
+        ranges.append([start, end])
+        ranges.sort()
+        self._pending_ranges = ranges
+        self._idle_chunk = None
+
+    def _take_range(self, start, end):
+        # Ranges that only touch [start, end] stay queued; taking the empty
+        # overlap would leave them in place and style nothing, forever.
+        taken = None
+        ranges = []
+        for s, e in self._pending_ranges:
+            if e <= start or s >= end:
+                ranges.append([s, e])
+                continue
+            if s < start:
+                ranges.append([s, start])
+            if e > end:
+                ranges.append([end, e])
+            lo, hi = max(s, start), min(e, end)
+            taken = (
+                (lo, hi) if taken is None else (min(taken[0], lo), max(taken[1], hi))
+            )
+        self._pending_ranges = ranges
+        return taken
+
     def _process_pending_style(self):
+        if self._style_task is not None:
+            return
+
+        visible = self._take_range(*self._visible_range())
+        if visible is not None:
+            self._style_range(*visible)
+        else:
+            self._schedule_idle_style()
+
+    def _style_range(self, start, end):
+        if not self.WORKER_MODE:
+            self._do_style_text(start, end)
+        elif self._start_style_job(start, end):
+            return
+        self._schedule_idle_style()
+
+    def _schedule_idle_style(self):
         if (
-            self._pending_style_start is not None
-            and self._pending_style_end is not None
+            self._pending_ranges
+            and self._style_task is None
+            and not self._debounce_timer.isActive()
         ):
-            start = self._pending_style_start
-            end = self._pending_style_end
-            self._pending_style_start = None
-            self._pending_style_end = None
-            self._do_style_text(start, end)
+            self._idle_timer.start()
 
-    def _do_style_text(self, start: int, end: int):
+    def _process_idle_style(self):
+        if self._style_task is not None or self._debounce_timer.isActive():
+            return
+
+        deadline = time.perf_counter() + self.IDLE_BUDGET_MS / 1000.0
+        while self._pending_ranges:
+            start, end = self._pending_ranges[0]
+            end = min(end, self.editor.length())
+            frontier = self._styled_frontier()
+            if frontier is not None:
+                if frontier >= end:
+                    self._pending_ranges.pop(0)
+                    continue
+                start = frontier
+
+            line = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, start)
+            lines = (
+                self.IDLE_CHUNK_LINES if self.WORKER_MODE else self._idle_chunk_lines
+            )
+            chunk = (start, min(end, self._line_pos(line + lines)))
+            if chunk[1] <= chunk[0] or chunk == self._idle_chunk:
+                # Nothing left, or the last chunk made no progress.
+                self._pending_ranges.pop(0)
+                continue
+            self._idle_chunk = chunk
+
+            if frontier is None:
+                if chunk[1] >= end:
+                    self._pending_ranges.pop(0)
+                else:
+                    self._pending_ranges[0][0] = chunk[1]
+
+            end_styled = self.editor.SendScintilla(QsciScintilla.SCI_GETENDSTYLED)
+            if self.WORKER_MODE:
+                if self._start_style_job(*chunk, end_styled=end_styled):
+                    return
+            else:
+                started = time.perf_counter()
+                self._do_style_text(*chunk)
+                self._restore_end_styled(end_styled)
+
+                elapsed = time.perf_counter() - started
+                if elapsed * 1000.0 > self.IDLE_BUDGET_MS:
+                    self._idle_chunk_lines = max(10, self._idle_chunk_lines // 2)
+                elif elapsed * 2000.0 < self.IDLE_BUDGET_MS:
+                    self._idle_chunk_lines = min(
+                        self.IDLE_CHUNK_LINES, self._idle_chunk_lines * 2
+                    )
+
+            if time.perf_counter() >= deadline:
+                break
+
+        if self._pending_ranges:
+            self._idle_timer.start()
+
+    def _restore_end_styled(self, pos):
+        # Styling an idle chunk rewinds Scintilla's end-styled mark. Anything
+        # between the chunk and the old mark is still queued, so put the mark
+        # back instead of letting the viewport be requested again.
+        if self.editor.SendScintilla(QsciScintilla.SCI_GETENDSTYLED) < pos:
+            self.startStyling(pos)
+
+    def _start_style_job(self, start, end, end_styled=None):
+        job = self._prepare_style_job(start, end)
+        if job is None:
+            return False
+
+        job["range"] = (start, end)
+        job["revision"] = self._revision
+        job["end_styled"] = end_styled
+        self._style_task = TaskRunner.instance().submit(
+            ("style", id(self)),
+            _run_style_task,
+            self,
+            job,
+            on_result=self._on_style_job_finished,
+        )
+        return True
+
+    def _on_style_job_finished(self, job):
+        self._style_task = None
+        start, end = job["range"]
+
+        if job["revision"] != self._revision:
+            self.styleText(start, end)
+            return
+
+        if not job.get("failed") and self._apply_style_job(job):
+            if self._start_style_job(start, end, job["end_styled"]):
+                return
+        if job["end_styled"] is not None:
+            self._restore_end_styled(job["end_styled"])
+
+        if not self._debounce_timer.isActive():
+            self._process_pending_style()
+
+    # A style job is split in three steps so it can run either inline or on a
+    # worker: prepare snapshots the document on the GUI thread, run tokenizes
+    # the snapshot without touching the editor, and apply writes the runs back.
+    def _prepare_style_job(self, start, end):
+        return None
+
+    def _run_style_job(self, job):
         pass
 
+    def _apply_style_job(self, job):
+        return False
+
+    def _do_style_text(self, start: int, end: int):
+        while True:
+            job = self._prepare_style_job(start, end)
+            if job is None:
+                return
+            self._run_style_job(job)
+            if not self._apply_style_job(job):
+                return
+
     def styleText(self, start: int, end: int):
-        if self._pending_style_start is None:
-            self._pending_style_start = start
-            self._pending_style_end = end
-        else:
-            self._pending_style_start = min(self._pending_style_start, start)
-            self._pending_style_end = max(self._pending_style_end, end)
+        self._queue_range(start, end)
 
         self._debounce_timer.stop()
         self._debounce_timer.start()
 
+    def _new_apis(self):
+        # QsciAPIs makes itself the lexer's APIs when created.
+        apis = QsciAPIs(self)
+        apis.apiPreparationFinished.connect(lambda: self._on_apis_prepared(apis))
+        self.apis = apis
+        return apis
+
+    def set_completions(self, names, scope=None):
+        names = list(dict.fromkeys(name for name in names if name))
+        self._apis_next = (names, scope)
+        self._apis_timer.start()
+
+    def _apply_completions(self):
+        if self._apis_next is None:
+            return
+        names, scope = self._apis_next
+        self._apis_next = None
+        name_set = frozenset(names)
+        key = (getattr(self, "filepath", None), scope)
+
+        cached = self._apis_cache.get(key)
+        if cached is not None:
+            self._apis_cache.move_to_end(key)
+        if name_set == self._apis_names and cached in (None, (name_set, self.apis)):
+            self._show_if_ready()
+            return
+        if cached is not None and cached[0] == name_set:
+            self.apis = cached[1]
+            self.setAPIs(self.apis)
+            self._apis_names = name_set
+            self._show_if_ready()
+            return
 
-# The PythonCustomLexer is an example of how to implement a lexer without using Pygments
-# but it is not used in the current implementation because it is less accurate than PythonLexer but much faster
-# If you want to use it, you can replace PythonLexer with PythonCustomLexer in the lexer factory function in src/editor_tab.py
-# class PythonCustomLexer(BaseLexer):
-#     def __init__(self, editor, theme_name="default"):
-#         super().__init__("Python", editor, theme_name=theme_name)
-
-#         kws = set(keyword.kwlist)
-#         if hasattr(keyword, "softkwlist"):
-#             kws.update(keyword.softkwlist)
-#         self.keyword_set = frozenset(kws)
-
-#         self.builtin_func_set = frozenset(
-#             name
-#             for name in dir(builtins)
-#             if not name.startswith("_") and callable(getattr(builtins, name))
-#         )
-#         self.builtin_clss_set = frozenset(
-#             name
-#             for name in dir(builtins)
-#             if not name.startswith("_") and isinstance(getattr(builtins, name), type)
-#         )
-#         self.builtin_set = self.builtin_func_set.union(self.builtin_clss_set)
-#         self.ident_re = re.compile(r"[A-Za-z_]\w*")
-#         self.decorator_re = re.compile(r"@[A-Za-z_]\w*")
-#         self.class_def_re = re.compile(r"\bclass\s+([A-Za-z_]\w*)")
-#         self.func_def_re = re.compile(r"\bdef\s+([A-Za-z_]\w*)")
-#         self.func_call_re = re.compile(r"\b([A-Za-z_]\w*)\b(?=\s*\()")
-#         self.number_re = re.compile(
-#             r"\b(?:0[bB][01](?:_?[01])*|0[oO][0-7](?:_?[0-7])*|0[xX][0-9a-fA-F](?:_?[0-9a-fA-F])*|\d(?:_?\d)*(?:\.\d(?:_?\d)*)?(?:[eE][+-]?\d(?:_?\d)*)?j?)\b"
-#         )
-#         self.after_import_re = re.compile(r"(?m)(?:^|(?<=;))\s*import\s+([A-Za-z_]\w*)")
-#         self.after_from_import_re = re.compile(r"\bfrom\s+([A-Za-z_]\w*)\s+import\b")
-
-#     def _pos_to_index(self, line_starts, pos):
-#         line, col = pos
-#         return line_starts[line - 1] + col
-
-#     def _do_style_text(self, start: int, end: int):
-#         text = self.editor.text()[start:end]
-#         n = len(text)
-#         if n <= 0:
-#             return
-
-#         line_starts = [0]
-#         for m in re.finditer(r"\n", text):
-#             line_starts.append(m.end())
-
-#         spans = []
-
-
-#         try:
-#             toks = tokenize.generate_tokens(io.StringIO(text).readline)
-#             for tok in toks:
-#                 ttype = tok.type
-#                 tstr = tok.string
-
-#                 if ttype == tokenize.COMMENT:
-#                     s = self._pos_to_index(line_starts, tok.start)
-#                     e = self._pos_to_index(line_starts, tok.end)
-#                     spans.append((s, e, self.COMMENTS))
-
-#                 elif ttype == tokenize.STRING:
-#                     s = self._pos_to_index(line_starts, tok.start)
-#                     e = self._pos_to_index(line_starts, tok.end)
-#                     spans.append((s, e, self.STRING))
-
-#                 elif ttype == tokenize.NAME:
-#                     s = self._pos_to_index(line_starts, tok.start)
-#                     e = self._pos_to_index(line_starts, tok.end)
-
-#                     if tstr in self.keyword_set:
-#                         spans.append((s, e, self.KEYWORD))
-#                     elif tstr in self.builtin_func_set:
-#                         spans.append((s, e, self.TYPES))
-#                     elif tstr in self.builtin_clss_set:
-#                         spans.append((s, e, self.CLASSES))
-#                     elif tstr[0].isupper() and not tstr.isupper():
-#                         spans.append((s, e, self.CLASSES))
-#                     elif tstr.isupper():
-#                         spans.append((s, e, self.TYPES))
-#                     elif tstr == "self":
-#                         spans.append((s, e, self.KEYWORD))
-
-#         except:
-#             pass
-
-#         for m in self.decorator_re.finditer(text):
-#             spans.append((m.start(), m.end(), self.FUNCTIONS))
-
-#         for m in self.class_def_re.finditer(text):
-#             spans.append((m.start(1), m.end(1), self.CLASS_DEF))
-
-#         for m in self.func_def_re.finditer(text):
-#             spans.append((m.start(1), m.end(1), self.FUNCTION_DEF))
-
-#         for m in self.func_call_re.finditer(text):
-#             name = m.group(1)
-#             if (
-#                 name not in self.keyword_set
-#                 and name not in self.builtin_set
-#                 and not name[0].isupper()
-#             ):
-#                 spans.append((m.start(1), m.end(1), self.FUNCTIONS))
-#             elif name[0].isupper():
-#                 spans.append((m.start(1), m.end(1), self.CLASSES))
-
-#         for m in self.number_re.finditer(text):
-#             spans.append((m.start(), m.end(), self.CONSTANTS))
-
-
-#         for m in self.after_from_import_re.finditer(text):
-#             spans.append((m.start(1), m.end(1), self.CLASSES))
-
-#         for m in self.after_import_re.finditer(text):
-#             spans.append((m.start(1), m.end(1), self.CLASSES))
-
-
-#         styles = [self.DEFAULT] * len(text)
-#         prio = [-1] * len(text)
-
-#         priority = {
-#             self.COMMENTS: 100,
-#             self.STRING: 90,
-#             self.FUNCTION_DEF: 70,
-#             self.CLASS_DEF: 70,
-#             self.KEYWORD: 60,
-#             self.TYPES: 50,
-#             self.CONSTANTS: 40,
-#             self.FUNCTIONS: 10,
-#         }
-
-#         for s, e, sty in spans:
-#             p = priority.get(sty, 0)
-#             s = max(0, s)
-#             e = min(len(text), e)
-#             for i in range(s, e):
-#                 if p >= prio[i]:
-#                     prio[i] = p
-#                     styles[i] = sty
-
-#         self.startStyling(start)
-#         i = 0
-#         while i < len(text):
-#             cur = styles[i]
-#             j = i + 1
-#             while j < len(text) and styles[j] == cur:
-#                 j += 1
-#             self.setStyling(j - i, cur)
-#             i = j
-#        self.editor.SendScintilla(QsciScintilla.SCI_COLOURISE, start, end)
-
-#     def build_apis(self):
-#         self.apis.clear()
-#         code = self.editor.text()
-#         line, col = self.editor.getCursorPosition()
-#         pos = self.editor.SendScintilla(self.editor.SCI_GETCURRENTPOS)
-#         style = (
-#             self.editor.SendScintilla(self.editor.SCI_GETSTYLEAT, pos - 1)
-#             if pos > 0
-#             else -1
-#         )
-
-#         if style in (self.STRING, self.COMMENTS):
-#             self.apis.prepare()
-#             return
-
-#         try:
-#             script = jedi.Script(code=code)
-#             completions = script.complete(line + 1, col)
-#             for completion in completions:
-#                 self.apis.add(completion.name)
-#         except Exception:
-#             pass
-
-#         self.apis.prepare()
+        if cached is not None:
+            apis = self.apis = cached[1]
+            self.setAPIs(apis)
+        else:
+            apis = self._new_apis()
+        self._apis_cache[key] = (name_set, apis)
+        while len(self._apis_cache) > self.APIS_CACHE_SIZE:
+            _key, (_names, old) = self._apis_cache.popitem(last=False)
+            if old is not apis:
+                self._apis_preparing.discard(old)
+                old.deleteLater()
+
+        self._apis_names = name_set
+        apis.clear()
+        for name in names:
+            apis.add(name)
+        apis.prepare()
+        self._apis_preparing.add(apis)
+
+    def show_completion_list(self):
+        # Shows the list once pending completions are prepared, since
+        # QsciAPIs prepares in a thread and would show the old list.
+        self._apis_show_pending = True
+        self._show_if_ready()
+
+    def _show_if_ready(self):
+        if not self._apis_show_pending:
+            return
+        if self._apis_timer.isActive() or self.apis in self._apis_preparing:
+            return
+        self._apis_show_pending = False
+        self.editor.autoCompleteFromAPIs()
+
+    def _on_apis_prepared(self, apis):
+        self._apis_preparing.discard(apis)
+        if apis is self.apis:
+            self._show_if_ready()
+
+
+_STYLE_BYTES = [bytes((i,)) for i in range(256)]
+_STYLE_RUN_RE = re.compile(rb"(.)\1*", re.S)
+
+_FOLD_BASE = QsciScintilla.SC_FOLDLEVELBASE
+_FOLD_HEADER = QsciScintilla.SC_FOLDLEVELHEADERFLAG
+_FOLD_MAX_DEPTH = QsciScintilla.SC_FOLDLEVELNUMBERMASK - _FOLD_BASE
+
+
+def _fold_level(depth):
+    if 0 <= depth <= _FOLD_MAX_DEPTH:
+        return _FOLD_BASE + depth
+    return _FOLD_BASE if depth < 0 else _FOLD_BASE + _FOLD_MAX_DEPTH
+
+
+class FoldProvider:
+    # Turns the tokens of a styling pass into fold depths. wants() is asked
+    # once per token type whether tokens of that type matter; token() gets
+    # the depth before such a token and returns the lowest depth it reaches
+    # and the depth after it. A line's fold level is the lowest depth reached
+    # on it, and the line is a fold header when it ends deeper than that.
+    def wants(self, ttype):
+        return False
+
+    def token(self, ttype, value, depth):
+        return depth, depth
+
+
+class BracketFolds(FoldProvider):
+    # Closing brackets stay visible below a folded block, and a line such as
+    # "} else {" closes one block and heads the next.
+    OPENING = "{["
+    CLOSING = "}]"
+
+    def wants(self, ttype):
+        return ttype in Punctuation
+
+    def token(self, ttype, value, depth):
+        low = depth
+        for char in value:
+            if char in self.OPENING:
+                depth += 1
+            elif char in self.CLOSING:
+                depth -= 1
+                low = min(low, depth)
+        return low, depth
+
+
+class HeadingFolds(FoldProvider):
+    # A level n heading sits at depth n - 1 and its section at depth n, until
+    # the next heading of the same or a higher level.
+    def wants(self, ttype):
+        return ttype in Generic.Heading or ttype in Generic.Subheading
+
+    def token(self, ttype, value, depth):
+        level = len(value) - len(value.lstrip("#"))
+        if not level:
+            if not value.strip("=- \t"):
+                # The underline of a Setext heading.
+                return depth, depth
+            level = 1 if ttype in Generic.Heading else 2
+        return level - 1, level
+
+
+FOLD_PROVIDERS = {
+    "brackets": BracketFolds,
+    "headings": HeadingFolds,
+}
+
+
+def _iter_token_types(ttype):
+    yield ttype
+    for subtype in ttype.subtypes:
+        yield from _iter_token_types(subtype)
+
+
+def _enter_state(statestack, new_state):
+    if isinstance(new_state, tuple):
+        for state in new_state:
+            if state == "#pop":
+                if len(statestack) > 1:
+                    statestack.pop()
+            elif state == "#push":
+                statestack.append(statestack[-1])
+            else:
+                statestack.append(state)
+    elif isinstance(new_state, int):
+        if abs(new_state) >= len(statestack):
+            del statestack[1:]
+        else:
+            del statestack[new_state:]
+    elif new_state == "#push":
+        statestack.append(statestack[-1])
 
 
 class PygmentsBaseLexer(BaseLexer):
+    MAX_RESUME_DISTANCE = 1000
+    # Resumable jobs see this many lines past the requested range, so that a
+    # token spanning several lines is not cut short at the end of the range.
+    LOOKAHEAD_LINES = 1000
+
     def __init__(self, language_name, editor, theme_name="default"):
         super().__init__(language_name, editor, theme_name=theme_name)
         self.pygments_lexer = None
         self.token_map = {}
 
-    def _do_style_text(self, start: int, end: int):
-        if not self.pygments_lexer or not self.token_map:
+        # _line_states[i] is the Pygments state stack at the start of line i,
+        # or None when line i starts inside a multi-line token. Lines past the
+        # end of the list have not been lexed yet.
+        self._line_states = [("root",)]
+        self._dirty_line = None
+        self._dirty_end = None
+        # (first, last) lines styled from the root state for now, queued again
+        # once the exact pass reaches them.
+        self._provisional_lines = None
+
+        # _fold_depths[i] is the fold depth at the start of line i, or None
+        # when unknown, kept in step with the document like _line_states.
+        provider = FOLD_PROVIDERS.get(self.FOLDING)
+        self._fold_provider = provider() if provider else None
+        self._fold_wants = {}
+        self._fold_depths = [0]
+
+        self._token_styles = {}
+        self._token_styles_source = None
+
+    def provides_folding(self):
+        return self._fold_provider is not None
+
+    def disable_folding(self):
+        # For files too large to fold; no fold levels are sent from then on.
+        self._fold_provider = None
+
+    def _on_scn_modified(self, position, mod_type, *args):
+        super()._on_scn_modified(position, mod_type, *args)
+        if not mod_type & (
+            QsciScintilla.SC_MOD_INSERTTEXT | QsciScintilla.SC_MOD_DELETETEXT
+        ):
             return
 
-        self.startStyling(start)
-        text = self.editor.text()[start:end]
+        lines_added = int(args[2])
+        line = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, position)
+
+        for states in (self._line_states, self._fold_depths):
+            if line + 1 < len(states):
+                if lines_added > 0:
+                    states[line + 1 : line + 1] = [None] * lines_added
+                elif lines_added < 0:
+                    del states[line + 1 : line + 1 - lines_added]
+
+        last = line + max(0, lines_added)
+        if self._dirty_line is None:
+            self._dirty_line = line
+            self._dirty_end = last
+        else:
+            if self._dirty_end > line:
+                self._dirty_end = max(line, self._dirty_end + lines_added)
+            self._dirty_line = min(self._dirty_line, line)
+            self._dirty_end = max(self._dirty_end, last)
+
+    def _is_resumable(self):
+        return (
+            type(self.pygments_lexer).get_tokens_unprocessed
+            is RegexLexer.get_tokens_unprocessed
+        )
+
+    def _resume_line(self):
+        states = self._line_states
+        line = len(states) - 1
+        if self._dirty_line is not None:
+            line = min(line, self._dirty_line)
+        while line > 0 and states[line] is None:
+            line -= 1
+        return line
+
+    def _styled_frontier(self):
+        if not self._is_resumable():
+            return None
+        return self._line_pos(self._resume_line())
+
+    def _prepare_style_job(self, start, end):
+        if not self.pygments_lexer or not self.token_map:
+            return None
+
+        end_line = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, end)
+
+        # Everything before the first edited line is still valid, so lexing
+        # resumes from the closest cached state there rather than from the
+        # requested start. After a converged job the lines up to the old
+        # frontier are known good and the next job only moves the frontier.
+        provisional = False
+        if self._is_resumable():
+            first_line = self._resume_line()
+            if first_line > end_line:
+                self.startStyling(self._line_pos(len(self._line_states) - 1))
+                return None
+            stack = self._line_states[first_line]
+
+            # When the viewport is far past the lexed frontier, style it from
+            # the root state for now and leave the exact pass to idle time.
+            start_line = self.editor.SendScintilla(
+                QsciScintilla.SCI_LINEFROMPOSITION, start
+            )
+            if start_line - first_line > self.MAX_RESUME_DISTANCE:
+                # Only the lines before the viewport are queued, for idle
+                # time: queued along with them, the viewport would be taken
+                # as visible and styled provisionally again, forever.
+                self._queue_range(self._line_pos(first_line), start)
+                lines = self._provisional_lines or (start_line, end_line)
+                self._provisional_lines = (
+                    min(lines[0], start_line),
+                    max(lines[1], end_line),
+                )
+                first_line = start_line
+                stack = ("root",)
+                provisional = True
+        else:
+            first_line = self.editor.SendScintilla(
+                QsciScintilla.SCI_LINEFROMPOSITION, start
+            )
+            stack = None
+            if self._fold_provider is not None:
+                # Fold depths carry over from the lines above, so lexing
+                # starts at the last line whose depth is known.
+                depths = self._fold_depths
+                first_line = min(first_line, len(depths) - 1)
+                while first_line > 0 and depths[first_line] is None:
+                    first_line -= 1
+
+        start_pos = self._line_pos(first_line)
+        end_pos = self._line_pos(end_line + 1)
+        if end_pos <= start_pos:
+            return None
+        if stack is not None:
+            end_pos = self._line_pos(end_line + 1 + self.LOOKAHEAD_LINES)
+
+        text = bytes(self.editor.bytes(start_pos, end_pos))[:-1].decode(
+            "utf-8", "surrogateescape"
+        )
+
+        # Provisional jobs start at an unknown depth; their levels are
+        # replaced by the exact pass.
+        fold_depth = fold_depths = None
+        if self._fold_provider is not None and not provisional:
+            depths = self._fold_depths
+            if first_line < len(depths) and depths[first_line] is not None:
+                fold_depth = depths[first_line]
+                fold_depths = list(depths)
+
+        return {
+            "start_pos": start_pos,
+            "first_line": first_line,
+            "end_line": end_line,
+            "text": text,
+            "stack": stack,
+            "states": list(self._line_states),
+            "dirty_end": self._dirty_end if self._dirty_line is not None else -1,
+            "at_eof": end_pos == self.editor.length(),
+            "provisional": provisional,
+            "token_styles": self._token_style_table(),
+            "fold_wants": self._fold_wants if self._fold_provider else None,
+            "fold_depth": fold_depth or 0,
+            "fold_depths": fold_depths,
+        }
+
+    def _apply_style_job(self, job):
+        self.startStyling(job["start_pos"])
+        for length, style in job["runs"]:
+            self.setStyling(length, style)
+        if job["fold_wants"] is not None:
+            self._apply_folds(job)
+
+        if job["stack"] is None or job["provisional"]:
+            return False
+
+        self._line_states = job["states"]
+        self._dirty_line = None
+        self._dirty_end = None
+        lines = self._provisional_lines
+        if lines is not None and self._resume_line() >= lines[0]:
+            self._provisional_lines = None
+            self._queue_range(self._line_pos(lines[0]), self._line_pos(lines[1] + 1))
+        return job["converged"]
+
+    def _apply_folds(self, job):
+        first_line = job["first_line"]
+        for line, level in enumerate(job["fold_levels"], first_line):
+            self.editor.SendScintilla(QsciScintilla.SCI_SETFOLDLEVEL, line, level)
+
+        depths = job["fold_depths"]
+        if depths is None:
+            return
+        if job["stack"] is None:
+            # Nothing tells when a non-resumable lexer is back in step, so
+            # if the depth after the range moved, the rest of the document
+            # is folded again from idle time.
+            line = job["fold_end_line"]
+            old = self._fold_depths
+            if line < len(old) and old[line] != depths[line]:
+                self._queue_range(self._line_pos(line), self.editor.length())
+        self._fold_depths = depths
+
+    def _iter_matches(self, text, stack):
+        # Same loop as RegexLexer.get_tokens_unprocessed, except that the
+        # state stack is handed out after every match so it can be recorded.
+        lexer = self.pygments_lexer
+        tokendefs = lexer._tokens
+        statestack = list(stack)
+        statetokens = tokendefs[statestack[-1]]
+        pos = 0
+        length = len(text)
+
+        while pos < length:
+            for rexmatch, action, new_state in statetokens:
+                m = rexmatch(text, pos)
+                if not m:
+                    continue
+
+                if action is None:
+                    tokens = ()
+                elif type(action) is _TokenType:
+                    tokens = ((pos, action, m.group()),)
+                else:
+                    tokens = action(lexer, m)
+                pos = m.end()
+
+                if new_state is not None:
+                    _enter_state(statestack, new_state)
+                    statetokens = tokendefs[statestack[-1]]
+
+                yield pos, tokens, statestack
+                break
+            else:
+                if text[pos] == "\n":
+                    statestack = ["root"]
+                    statetokens = tokendefs["root"]
+                    tokens = ((pos, Whitespace, "\n"),)
+                else:
+                    tokens = ((pos, Error, text[pos]),)
+                pos += 1
+                yield pos, tokens, statestack
+
+    def _run_style_job(self, job):
+        text = job["text"]
+        stack = job["stack"]
+        if stack is None:
+            matches = (
+                (pos + len(value), ((pos, ttype, value),), None)
+                for pos, ttype, value in self.pygments_lexer.get_tokens_unprocessed(
+                    text
+                )
+            )
+        else:
+            matches = self._iter_matches(text, stack)
+
+        # One style byte per character. Only tokens that are not DEFAULT are
+        # written; runs are cut from the buffer once the text is lexed.
+        default = self.DEFAULT
+        styles = bytearray(_STYLE_BYTES[default]) * len(text)
+
+        token_styles = job["token_styles"]
+        states = job["states"]
+        dirty_end = job["dirty_end"]
+        line = job["first_line"]
+        char_pos = 0
+        scan_pos = 0
+        converged = False
+        stopped = False
+
+        # Fold levels of the lines lexed, from the provider's depths; a line
+        # is only done once its newline is reached. fold_starts collects the
+        # depth at the start of every following line, written back at the end
+        # so that fold_depths still holds the old ones to converge against.
+        provider = self._fold_provider
+        fold_wants = job["fold_wants"]
+        fold_depths = job["fold_depths"]
+        fold_levels = []
+        fold_starts = []
+        depth = low = job["fold_depth"]
+
+        for match_end, tokens, statestack in matches:
+            # Token offsets are not trusted (Markdown code blocks report them
+            # relative to the block), only their order and length are.
+            for _, ttype, value in tokens:
+                n = len(value)
+                style = token_styles.get(ttype)
+                if style is None:
+                    style = token_styles[ttype] = self._get_style_from_token(ttype)
+                if style != default:
+                    styles[char_pos : char_pos + n] = _STYLE_BYTES[style] * n
+                char_pos += n
+
+                if fold_wants is not None:
+                    wanted = fold_wants.get(ttype)
+                    if wanted is None:
+                        wanted = fold_wants[ttype] = provider.wants(ttype)
+                    if wanted:
+                        token_low, depth = provider.token(ttype, value, depth)
+                        if token_low < low:
+                            low = token_low
+
+            if match_end > char_pos:
+                char_pos = match_end
+
+            if statestack is None and fold_wants is None:
+                continue
 
-        tokens = lex(text, self.pygments_lexer)
+            newlines = text.count("\n", scan_pos, match_end)
+            scan_pos = match_end
+            if not newlines:
+                continue
 
-        current_pos = 0
-        for ttype, value in tokens:
-            token_len = len(value.encode("utf-8"))
+            if fold_wants is not None:
+                level = _fold_level(low)
+                fold_levels.append(level | _FOLD_HEADER if depth > low else level)
+                if newlines > 1:
+                    fold_levels.extend([_fold_level(depth)] * (newlines - 1))
+                fold_starts.extend([depth] * newlines)
+                low = depth
 
-            if current_pos >= start:
-                style_id = self._get_style_from_token(ttype)
-                self.setStyling(token_len, style_id)
+            if statestack is None:
+                line += newlines
+                continue
 
-            current_pos += token_len
-            if current_pos >= end:
+            if job["provisional"]:
+                line += newlines
+            else:
+                for skipped in range(line + 1, line + newlines):
+                    self._set_line_state(states, skipped, None)
+                line += newlines
+
+                # The fold depth has to be back in step as well, or the
+                # levels after this line would be stale.
+                state = tuple(statestack) if text[match_end - 1] == "\n" else None
+                if (
+                    state is not None
+                    and dirty_end < line < len(states)
+                    and states[line] == state
+                    and (
+                        fold_depths is None
+                        or (line < len(fold_depths) and fold_depths[line] == depth)
+                    )
+                ):
+                    converged = True
+                    break
+                self._set_line_state(states, line, state)
+
+            if line > job["end_line"]:
+                stopped = True
                 break
-        self.editor.SendScintilla(QsciScintilla.SCI_COLOURISE, start, end)
+
+        if (
+            fold_wants is not None
+            and job["at_eof"]
+            and not (converged or stopped)
+            and not text.endswith("\n")
+        ):
+            level = _fold_level(low)
+            fold_levels.append(level | _FOLD_HEADER if depth > low else level)
+        job["fold_levels"] = fold_levels
+        job["fold_end_line"] = line
+        if fold_depths is not None:
+            first = job["first_line"] + 1
+            fold_depths[first : first + len(fold_starts)] = fold_starts
+
+        is_ascii = text.isascii()
+        runs = []
+        for m in _STYLE_RUN_RE.finditer(styles, 0, char_pos):
+            a, b = m.span()
+            n = b - a if is_ascii else len(text[a:b].encode("utf-8", "surrogateescape"))
+            runs.append((n, styles[a]))
+        job["runs"] = runs
+        job["converged"] = converged
+
+        if stack is not None and not job["provisional"] and not converged:
+            if job["at_eof"] and not stopped and not text.endswith("\n"):
+                line += 1
+                self._set_line_state(states, line, tuple(statestack))
+                if fold_depths is not None:
+                    self._set_line_state(fold_depths, line, depth)
+            del states[line + 1 :]
+            if fold_depths is not None:
+                del fold_depths[line + 1 :]
+
+    @staticmethod
+    def _set_line_state(states, line, state):
+        if line < len(states):
+            states[line] = state
+            return
+        states.extend([None] * (line - len(states)))
+        states.append(state)
 
     def _get_style_from_token(self, ttype):
-        while ttype in self.token_map:
-            return self.token_map[ttype]
-        if ttype.parent:
-            return self._get_style_from_token(ttype.parent)
+        token_map = self.token_map
+        while ttype is not None:
+            if ttype in token_map:
+                return token_map[ttype]
+            ttype = ttype.parent
         return self.DEFAULT
 
+    def _token_style_table(self):
+        # Flat token type -> style table, rebuilt whenever token_map is
+        # replaced. Types created after the build are resolved on first use.
+        if self._token_styles_source is not self.token_map:
+            self._token_styles = {
+                ttype: self._get_style_from_token(ttype)
+                for ttype in _iter_token_types(Token)
+            }
+            self._token_styles_source = self.token_map
+        return self._token_styles
+
 
 all_keywords = keyword.kwlist.copy()
 if hasattr(keyword, "softkwlist"):
@@ -505,6 +1111,15 @@ class PythonLexer(PygmentsBaseLexer):
 
         self.pygments_lexer = CustomPyG_PythonLexer()
 
+        self.filepath = None
+        self.project_dir = None
+        self.symbol_index = None
+        self._completion_key = None
+        self._show_completions = False
+        self._jedi_names = []
+        self._index_names = []
+        self._completion_scope = None
+
         self.token_map = {
             Token.Text: self.DEFAULT,
             Token.Whitespace: self.DEFAULT,
@@ -562,10 +1177,6 @@ class PythonLexer(PygmentsBaseLexer):
         }
 
     def build_apis(self):
-        self.apis.clear()
-
-        code = self.editor.text()
-        line, col = self.editor.getCursorPosition()
         pos = self.editor.SendScintilla(self.editor.SCI_GETCURRENTPOS)
         style = (
             self.editor.SendScintilla(self.editor.SCI_GETSTYLEAT, pos - 1)
@@ -574,21 +1185,365 @@ class PythonLexer(PygmentsBaseLexer):
         )
 
         if style in (self.STRING, self.COMMENTS):
-            self.apis.prepare()
+            CompletionService.instance().cancel(self)
+            self._completion_key = None
+            self._jedi_names = []
+            self._index_names = []
+            self.set_completions([])
             return
 
-        try:
-            script = jedi.Script(code=code)
-            completions = script.complete(line + 1, col)
-            for completion in completions:
-                self.apis.add(completion.name)
-        except Exception:
-            pass
+        # Completions are asked for at the start of the word under the cursor,
+        # with the word left out. QScintilla filters the list by what has been
+        # typed, so typing on in the same word needs no new request.
+        start = self.editor.SendScintilla(
+            QsciScintilla.SCI_WORDSTARTPOSITION, pos, True
+        )
+        data = bytes(self.editor.bytes(0, self.editor.length()))[:-1]
+        line = self.editor.SendScintilla(QsciScintilla.SCI_LINEFROMPOSITION, start)
+        col = len(data[self._line_pos(line) : start].decode("utf-8", "replace"))
+        code = (data[:start] + data[pos:]).decode("utf-8", "replace")
+        # What the word is an attribute of, if anything; the prepared list for
+        # each receiver is cached, so going back to one needs no prepare.
+        receiver = _RECEIVER_RE.search(data, self._line_pos(line), start)
+        scope = receiver.group().decode("utf-8", "replace") if receiver else ""
+
+        # Names from the rest of the project, unless this is an attribute.
+        index_names = []
+        if self.symbol_index is not None and data[start - 1 : start] != b".":
+            prefix = data[start:pos].decode("utf-8", "replace")
+            index_names = [symbol.name for symbol in self.symbol_index.lookup(prefix)]
+
+        key = (self.filepath, code, line, col)
+        if key == self._completion_key:
+            if index_names != self._index_names:
+                self._index_names = index_names
+                self._prepare_apis()
+            if self._show_completions:
+                self._show_completions = False
+                self.show_completion_list()
+            return
+        self._completion_key = key
+        self._completion_scope = scope
+        self._index_names = index_names
+
+        CompletionService.instance().request(
+            self,
+            code,
+            line,
+            col,
+            self._on_completions,
+            path=self.filepath,
+            project_dir=self.project_dir,
+        )
 
-        self.apis.prepare()
+    def show_completions(self):
+        self._show_completions = True
+        self.build_apis()
+
+    def _on_completions(self, names):
+        self._jedi_names = names
+        self._prepare_apis()
+
+        if self._show_completions or self.editor.isListActive():
+            self._show_completions = False
+            self.show_completion_list()
+
+    def _prepare_apis(self):
+        self.set_completions(
+            self._jedi_names + self._index_names, self._completion_scope
+        )
+
+
+# The dotted expression right before a word, as in "os.path." for "os.path.jo".
+_RECEIVER_RE = re.compile(rb"[\w.]*\.$")
+
+_IDENT_START = string.ascii_letters + "_"
+# Characters the fast lexer dispatches on. Any other character (non-ASCII,
+# rare control characters) is matched against all rules of the state.
+_DISPATCH_CHARS = string.ascii_letters + string.digits + string.punctuation + " \t\n"
+
+
+def _pygments_python_rules(state, first=None):
+    # Plain (regex, token[, new state]) rules taken as-is from Pygments, so
+    # word lists and escapes stay in step with PythonLexer.
+    rules = []
+    for rule in PyG_PythonLexer.tokens[state]:
+        if isinstance(rule, include):
+            rules.extend(_pygments_python_rules(rule, first))
+            continue
+        regex, action = rule[:2]
+        rule_first = first
+        if isinstance(regex, words):
+            rule_first = "".join(sorted({word[0] for word in regex.words}))
+            regex = regex.get()
+        new_state = rule[2] if len(rule) > 2 else None
+        if isinstance(new_state, str):
+            new_state = (new_state,)
+        rules.append((regex, action, new_state, rule_first))
+    return rules
+
+
+def _python_fast_rules():
+    # The states of CustomPyG_PythonLexer, rule for rule. The last item of a
+    # rule lists the characters a match can start with (None for any), which
+    # lets the lexer skip the rules that cannot match at a given character.
+    name = PyG_PythonLexer.uni_name
+    quotes = (
+        ('"""', String.Double, "tdq"),
+        ("'''", String.Single, "tsq"),
+        ('"', String.Double, "dq"),
+        ("'", String.Single, "sq"),
+    )
+    # String openers, in the same order as PythonLexer's "expr" state. The
+    # string state name is prefixed with the escapes that string accepts.
+    openers = (
+        ("(?i:rf|fr)", "rf", "f", "rRfF"),
+        ("[fF]", "f", "f", "fF"),
+        ("(?i:rb|br|r)", "raw", "s", "rRbB"),
+        ("[uU]?", "str", "s", "uU\"'"),
+        ("[bB]", "bytes", "s", "bB"),
+    )
+    expr = [
+        (
+            rf"({affix})({quote})",
+            (String.Affix, ttype),
+            (f"{escape}:{state}{kind}",),
+            first,
+        )
+        for affix, escape, kind, first in openers
+        for quote, ttype, state in quotes
+    ]
+    expr += [
+        (r"[^\S\n]+", Text, None, " \t"),
+        *_pygments_python_rules("numbers", string.digits + "."),
+        (r"!=|==|<<|>>|:=|[-~+/*%=<>&^|.]", Operator, None, "-~+/*%=<>&^|.!:"),
+        (r"[]{}:(),;[]", Punctuation, None, "[]{}:(),;"),
+        (r"(in|is|and|or|not)\b", Operator.Word, None, "iaon"),
+        *_pygments_python_rules("expr-keywords", _IDENT_START),
+        *_pygments_python_rules("builtins", _IDENT_START),
+        *_pygments_python_rules("magicfuncs", "_"),
+        *_pygments_python_rules("magicvars", "_"),
+        (r"@" + name, Name.Decorator, None, "@"),
+        (r"@", Operator, None, "@"),
+        (name, Name, None, _IDENT_START),
+    ]
+
+    soft_keyword_exceptions = "|".join(k for k in keyword.kwlist if k[0].islower())
+    rules = {
+        "root": [
+            (
+                rf"\b(?!(?:{KEYWORD_PATTERN})\b)([A-Za-z_]\w*)(\s*)(\()",
+                (Name.Function.Call, Text, Punctuation),
+                None,
+                _IDENT_START,
+            ),
+            (r"\n", Whitespace, None, "\n"),
+            (
+                r'^(\s*)([rRuUbB]{,2})("""(?:.|\n)*?""")',
+                (Whitespace, String.Affix, String.Doc),
+                None,
+                ' \t\nrRuUbB"',
+            ),
+            (
+                r"^(\s*)([rRuUbB]{,2})('''(?:.|\n)*?''')",
+                (Whitespace, String.Affix, String.Doc),
+                None,
+                " \t\nrRuUbB'",
+            ),
+            (r"\A#!.+$", Comment.Hashbang, None, "#"),
+            (r"#.*$", Comment.Single, None, "#"),
+            (r"\\\n", Text, None, "\\"),
+            (r"\\", Text, None, "\\"),
+            *_pygments_python_rules("keywords", _IDENT_START),
+            (
+                r"(^[ \t]*)(match|case)\b(?![ \t]*(?:[:,;=^&|@~)\]}]|(?:"
+                + soft_keyword_exceptions
+                + r")\b))",
+                (Text, Keyword),
+                ("soft-keywords-inner",),
+                " \tmc",
+            ),
+            (r"(def)((?:\s|\\\s)+)", (Keyword, Whitespace), ("funcname",), "d"),
+            (r"(class)((?:\s|\\\s)+)", (Keyword, Whitespace), ("classname",), "c"),
+            (
+                r"(from)((?:\s|\\\s)+)",
+                (Keyword.Namespace, Whitespace),
+                ("fromimport",),
+                "f",
+            ),
+            (
+                r"(import)((?:\s|\\\s)+)",
+                (Keyword.Namespace, Whitespace),
+                ("import",),
+                "i",
+            ),
+            *expr,
+        ],
+        "expr-inside-fstring": [
+            (r"[{([]", Punctuation, ("expr-inside-fstring-inner",), "{(["),
+            (r"(=\s*)?(\![sraf])?\}", String.Interpol, ("#pop",), "=!}"),
+            (r"(=\s*)?(\![sraf])?:", String.Interpol, ("#pop",), "=!:"),
+            (r"\s+", Whitespace, None, " \t\n"),
+            *expr,
+        ],
+        "expr-inside-fstring-inner": [
+            (r"[{([]", Punctuation, ("expr-inside-fstring-inner",), "{(["),
+            (r"[])}]", Punctuation, ("#pop",), "])}"),
+            (r"\s+", Whitespace, None, " \t\n"),
+            *expr,
+        ],
+        # None in a group list re-lexes that group from the root state, like
+        # using(this) does in Pygments.
+        "soft-keywords-inner": [
+            (r"(\s+)([^\n_]*)(_\b)", (Whitespace, None, Keyword), None, None),
+            (r"", None, ("#pop",), None),
+        ],
+        "funcname": [
+            *_pygments_python_rules("magicfuncs"),
+            (name, Name.Function, ("#pop",), None),
+            (r"", None, ("#pop",), None),
+        ],
+        "classname": [
+            (name, Name.Class, ("#pop",), None),
+        ],
+        "import": [
+            (r"(\s+)(as)(\s+)", (Whitespace, Keyword, Whitespace), None, None),
+            (r"\.", Name.Namespace, None, None),
+            (name, Name.Namespace, None, None),
+            (r"(\s*)(,)(\s*)", (Whitespace, Operator, Whitespace), None, None),
+            (r"", None, ("#pop",), None),
+        ],
+        "fromimport": [
+            (
+                r"(\s+)(import)\b",
+                (Whitespace, Keyword.Namespace),
+                ("#pop",),
+                None,
+            ),
+            (r"\.", Name.Namespace, None, None),
+            (r"None\b", Keyword.Constant, ("#pop",), None),
+            (name, Name.Namespace, None, None),
+            (r"", None, ("#pop",), None),
+        ],
+    }
+
+    escapes = {
+        "raw": [],
+        "str": _pygments_python_rules("stringescape"),
+        "bytes": _pygments_python_rules("bytesescape"),
+        "rf": _pygments_python_rules("rfstringescape"),
+        "f": _pygments_python_rules("fstringescape"),
+    }
+    for state in ("dqs", "sqs", "tdqs", "tsqs", "dqf", "sqf", "tdqf", "tsqf"):
+        for escape in ("rf", "f") if state.endswith("f") else ("raw", "str", "bytes"):
+            rules[f"{escape}:{state}"] = escapes[escape] + _pygments_python_rules(
+                state
+            )
+    return rules
+
+
+def _compile_rules(rules):
+    # One alternation of the rules, kept in order and each wrapped in a
+    # group, so m.lastindex tells which rule matched.
+    parts = []
+    actions = [None]
+    for regex, action, new_state, _ in rules:
+        actions.append((len(actions), action, new_state))
+        actions.extend([None] * re.compile(regex, re.M).groups)
+        parts.append(f"({regex})")
+    return re.compile("|".join(parts), re.M).match, actions
+
+
+class _FastState(dict):
+    # Maps a character to the alternation of the rules that can match there.
+    # Alternations are compiled the first time a character is looked up.
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = rules
+        self.compiled = {}
+
+    def __missing__(self, char):
+        rules = self.rules
+        subset = tuple(
+            i
+            for i, rule in enumerate(rules)
+            if rule[3] is None or char in rule[3] or char not in _DISPATCH_CHARS
+        )
+        compiled = self.compiled.get(subset)
+        if compiled is None:
+            compiled = self.compiled[subset] = _compile_rules(
+                [rules[i] for i in subset]
+            )
+        self[char] = compiled
+        return compiled
+
+
+class PythonCustomLexer(PythonLexer):
+    # Emits the same token types as PythonLexer, so it shares its token_map
+    # and styling, but looks each token up with one regex match per state
+    # instead of trying the Pygments rules one by one.
+    _states = None
+
+    def __init__(self, editor, theme_name="default"):
+        super().__init__(editor, theme_name=theme_name)
+        if PythonCustomLexer._states is None:
+            PythonCustomLexer._states = {
+                state: _FastState(rules) for state, rules in _python_fast_rules().items()
+            }
+
+    def _is_resumable(self):
+        return True
+
+    def _iter_matches(self, text, stack):
+        states = self._states
+        statestack = list(stack)
+        dispatch = states[statestack[-1]]
+        pos = 0
+        length = len(text)
+
+        while pos < length:
+            match, actions = dispatch[text[pos]]
+            m = match(text, pos)
+            if m is None:
+                if text[pos] == "\n":
+                    statestack = ["root"]
+                    dispatch = states["root"]
+                    tokens = ((pos, Whitespace, "\n"),)
+                else:
+                    tokens = ((pos, Error, text[pos]),)
+                pos += 1
+                yield pos, tokens, statestack
+                continue
+
+            first, action, new_state = actions[m.lastindex]
+            if action is None:
+                tokens = ()
+            elif type(action) is _TokenType:
+                tokens = ((pos, action, m.group()),)
+            else:
+                tokens = []
+                for group, ttype in enumerate(action, first + 1):
+                    value = m.group(group)
+                    if not value:
+                        continue
+                    if ttype is None:
+                        for _, inner, _ in self._iter_matches(value, ("root",)):
+                            tokens.extend(inner)
+                    else:
+                        tokens.append((m.start(group), ttype, value))
+            pos = m.end()
+
+            if new_state is not None:
+                _enter_state(statestack, new_state)
+                dispatch = states[statestack[-1]]
+
+            yield pos, tokens, statestack
 
 
 class JsonLexer(PygmentsBaseLexer):
+    WORKER_MODE = True
+    FOLDING = "brackets"
+
     def __init__(self, editor, theme_name="default"):
         super().__init__("JSON", editor, theme_name=theme_name)
 
@@ -605,7 +1560,6 @@ class JsonLexer(PygmentsBaseLexer):
         }
 
     def build_apis(self):
-        self.apis.clear()
         pos = self.editor.SendScintilla(self.editor.SCI_GETCURRENTPOS)
         style = (
             self.editor.SendScintilla(self.editor.SCI_GETSTYLEAT, pos - 1)
@@ -614,14 +1568,15 @@ class JsonLexer(PygmentsBaseLexer):
         )
 
         if style not in (self.STRING,):
-            self.apis.add("true")
-            self.apis.add("false")
-            self.apis.add("null")
-
-        self.apis.prepare()
+            self.set_completions(["true", "false", "null"])
+        else:
+            self.set_completions([])
 
 
 class MarkdownLexer(PygmentsBaseLexer):
+    WORKER_MODE = True
+    FOLDING = "headings"
+
     def __init__(self, editor, theme_name="default"):
         super().__init__("Markdown", editor, theme_name=theme_name)
 
@@ -644,8 +1599,7 @@ class MarkdownLexer(PygmentsBaseLexer):
         }
 
     def build_apis(self):
-        self.apis.clear()
-        self.apis.prepare()
+        self.set_completions([])
 
 
 class PlainTextLexer(BaseLexer):
@@ -656,5 +1610,4 @@ class PlainTextLexer(BaseLexer):
         pass
 
     def build_apis(self):
-        self.apis.clear()
-        self.apis.prepare()
+        self.set_completions([])
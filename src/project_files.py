@@ -0,0 +1,348 @@
+import os
+import re
+import threading
+
+# Never listed, whatever the ignore files say.
+IGNORE_DIRS = {
+    ".git",
+    "__pycache__",
+    "node_modules",
+    "venv",
+    ".venv",
+    "dist",
+    "build",
+}
+# Read in each directory, later files taking precedence, as ripgrep does.
+IGNORE_FILES = (".gitignore", ".ignore")
+# Formats known to be binary, skipped by search and indexing without being
+# read; anything else is sniffed, see looks_binary.
+BINARY_EXTS = {
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".ico",
+    ".exe",
+    ".dll",
+    ".so",
+    ".pyc",
+    ".mp4",
+    ".mp3",
+    ".wav",
+    ".zip",
+    ".tar",
+    ".gz",
+}
+SNIFF_SIZE = 8000
+
+
+def has_binary_ext(path):
+    return os.path.splitext(path)[1].lower() in BINARY_EXTS
+
+
+def looks_binary(data):
+    # Git's test: a NUL byte near the start.
+    return b"\0" in data[:SNIFF_SIZE]
+
+
+def _translate_segment(segment):
+    parts = []
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "\\" and i + 1 < len(segment):
+            i += 1
+            parts.append(re.escape(segment[i]))
+        elif char == "[" and "]" in segment[i + 2 :]:
+            end = segment.index("]", i + 2)
+            body = segment[i + 1 : end]
+            if body[0] in "!^":
+                body = "^" + body[1:]
+            parts.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return "".join(parts)
+
+
+def _translate(pattern):
+    # Regular expression for a gitignore pattern, to be matched against the
+    # whole "/"-separated path relative to the ignore file's directory.
+    anchored = "/" in pattern
+    segments = pattern.lstrip("/").split("/")
+    parts = []
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == "**":
+            parts.append(".*" if last else "(?:[^/]+/)*")
+            continue
+        parts.append(_translate_segment(segment))
+        if not last:
+            parts.append("/")
+    regex = "".join(parts)
+    if not anchored:
+        # A bare name matches at any depth.
+        regex = "(?:[^/]+/)*" + regex
+    return regex
+
+
+class IgnoreRules:
+    # The patterns of one directory's ignore files, compiled. Paths given to
+    # match are relative to that directory and "/"-separated.
+    def __init__(self, text):
+        self.rules = []
+        regexes = []
+        for line in text.splitlines():
+            if line.endswith("\\ "):
+                line = line[:-2].rstrip(" ") + "\\ "
+            else:
+                line = line.rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            try:
+                regex = _translate(line)
+                match = re.compile(regex, re.DOTALL).fullmatch
+            except re.error:
+                continue
+            regexes.append(regex)
+            self.rules.append((match, negated, dir_only))
+        # One pass over all patterns answers most paths, the ones no pattern
+        # matches.
+        self._any = re.compile(
+            "|".join(f"(?:{regex})" for regex in regexes) or "(?!)", re.DOTALL
+        ).fullmatch
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, path, is_dir):
+        # True if ignored, False if re-included by a "!" pattern, None when
+        # no pattern applies. The last matching pattern wins.
+        if not self._any(path):
+            return None
+        for match, negated, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if match(path):
+                return not negated
+        return None
+
+
+class ProjectFiles:
+    # The files of a project folder, minus IGNORE_DIRS and what .gitignore,
+    # .ignore and .git/info/exclude rule out. Shared by everything that
+    # lists the project (search, the indexes, the explorer, Go to File) and
+    # safe to use from any thread. Directory listings and ignore rules are
+    # cached and checked against the directory's and the ignore files' mtime
+    # on use, so a walk of an unchanged tree costs a stat per directory.
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_root(cls, root):
+        key = os.path.normcase(os.path.abspath(root))
+        with cls._instances_lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = cls._instances[key] = cls(root)
+            return instance
+
+    @classmethod
+    def release(cls, root):
+        # Drops the caches of a project that was closed.
+        key = os.path.normcase(os.path.abspath(root))
+        with cls._instances_lock:
+            cls._instances.pop(key, None)
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        # directory -> (mtime_ns, [(name, is_dir), ...])
+        self._entries_cache = {}
+        # directory -> (stats of its ignore files, IgnoreRules or None)
+        self._rules_cache = {}
+
+    def invalidate(self, path):
+        # For change notifications that may come within the mtime
+        # resolution of the previous change.
+        path = os.path.abspath(path)
+        with self._lock:
+            self._entries_cache.pop(path, None)
+            self._entries_cache.pop(os.path.dirname(path), None)
+            self._rules_cache.pop(path, None)
+
+    def _entries(self, directory):
+        # Sorted (name, is_dir) of the subdirectories and files of
+        # directory; symlinked directories are left out, like os.walk does.
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            cached = self._entries_cache.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        entries = []
+        try:
+            scanned = list(os.scandir(directory))
+        except OSError:
+            scanned = []
+        for entry in scanned:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append((entry.name, True))
+                elif entry.is_file():
+                    entries.append((entry.name, False))
+            except OSError:
+                pass
+        entries.sort()
+        with self._lock:
+            self._entries_cache[directory] = (mtime, entries)
+        return entries
+
+    def _rules(self, directory, entries):
+        sources = [
+            os.path.join(directory, name)
+            for name, is_dir in entries
+            if not is_dir and name in IGNORE_FILES
+        ]
+        sources.sort(key=lambda path: IGNORE_FILES.index(os.path.basename(path)))
+        if directory == self.root:
+            sources.insert(0, os.path.join(directory, ".git", "info", "exclude"))
+        stats = []
+        for path in sources:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stats.append((path, st.st_mtime_ns, st.st_size))
+        stats = tuple(stats)
+        with self._lock:
+            cached = self._rules_cache.get(directory)
+        if cached is not None and cached[0] == stats:
+            return cached[1]
+        texts = []
+        for path, _mtime, _size in stats:
+            try:
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    texts.append(f.read())
+            except OSError:
+                pass
+        rules = IgnoreRules("\n".join(texts)) or None
+        with self._lock:
+            self._rules_cache[directory] = (stats, rules)
+        return rules
+
+    def _ignored(self, path, is_dir, chain):
+        if is_dir and os.path.basename(path) in IGNORE_DIRS:
+            return True
+        # The deepest ignore file with an opinion decides.
+        for base, rules in reversed(chain):
+            rel = path[len(base) + 1 :].replace(os.sep, "/")
+            ignored = rules.match(rel, is_dir)
+            if ignored is not None:
+                return ignored
+        return False
+
+    def _list(self, directory, chain):
+        # (dirs, files, chain) of directory: the absolute paths of its
+        # subdirectories and files that are not ignored, given the rules of
+        # its parents in chain, and the rules in effect inside it.
+        entries = self._entries(directory)
+        rules = self._rules(directory, entries)
+        if rules is not None:
+            chain = chain + ((directory, rules),)
+        dirs = []
+        files = []
+        for name, is_dir in entries:
+            path = os.path.join(directory, name)
+            if not self._ignored(path, is_dir, chain):
+                (dirs if is_dir else files).append(path)
+        return dirs, files, chain
+
+    def _chain(self, directory):
+        # Rules of the parents of directory, in effect for its entries; None
+        # when directory is ignored or not in the project.
+        rel = os.path.relpath(directory, self.root)
+        if rel == os.curdir:
+            return ()
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return None
+        chain = ()
+        current = self.root
+        for name in rel.split(os.sep):
+            rules = self._rules(current, self._entries(current))
+            if rules is not None:
+                chain = chain + ((current, rules),)
+            current = os.path.join(current, name)
+            if self._ignored(current, True, chain):
+                return None
+        return chain
+
+    def listing(self, directory):
+        # (dirs, files) of one directory, as absolute paths.
+        chain = self._chain(os.path.abspath(directory))
+        if chain is None:
+            return [], []
+        return self._list(os.path.abspath(directory), chain)[:2]
+
+    def walk(self, directory=None, token=None):
+        # Absolute paths of the files under directory, the whole project by
+        # default, in a stable order. token, a CancelToken, is checked
+        # between directories.
+        directory = os.path.abspath(directory or self.root)
+        chain = self._chain(directory)
+        if chain is None:
+            return
+        stack = [(directory, chain)]
+        while stack:
+            if token is not None:
+                token.check()
+            current, chain = stack.pop()
+            dirs, files, chain = self._list(current, chain)
+            yield from files
+            stack.extend((path, chain) for path in reversed(dirs))
+
+    def ignored_names(self, directory):
+        # Names of the entries of directory that are ignored, all of them
+        # when directory itself is; for the explorer, which asks once per
+        # directory it shows.
+        directory = os.path.abspath(directory)
+        rel = os.path.relpath(directory, self.root)
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return set()
+        entries = self._entries(directory)
+        chain = self._chain(directory)
+        if chain is None:
+            return {name for name, _is_dir in entries}
+        dirs, files, _chain = self._list(directory, chain)
+        kept = {os.path.basename(path) for path in dirs + files}
+        return {name for name, _is_dir in entries if name not in kept}
+
+    def is_ignored(self, path):
+        # For a single path, e.g. to dim it in the explorer. Paths outside
+        # the project are not ignored.
+        path = os.path.abspath(path)
+        rel = os.path.relpath(path, self.root)
+        if rel == os.curdir or rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return False
+        parent = os.path.dirname(path)
+        chain = self._chain(parent)
+        if chain is None:
+            return True
+        rules = self._rules(parent, self._entries(parent))
+        if rules is not None:
+            chain = chain + ((parent, rules),)
+        return self._ignored(path, os.path.isdir(path), chain)
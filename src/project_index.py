@@ -0,0 +1,272 @@
+import abc
+import hashlib
+import itertools
+import os
+import sqlite3
+import time
+from collections import deque
+from functools import partial
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .project_files import ProjectFiles
+from .tasks import TaskRunner
+
+# Indexing runs as a chain of TaskRunner tasks of about this many seconds
+# each, so that it never holds one of the runner's few threads for long.
+STEP_TIME = 0.5
+
+
+def connect(db_path):
+    connection = sqlite3.connect(str(db_path), timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def under(rel_dir):
+    # SQL condition and arguments selecting paths inside rel_dir.
+    if not rel_dir:
+        return "1", ()
+    prefix = rel_dir + "/"
+    return "path >= ? AND path < ?", (prefix, prefix + "\uffff")
+
+
+class Indexer(abc.ABC):
+    # Brings the files table of an index, (path, mtime, size) with paths
+    # relative to the project and "/"-separated, in line with the disk, a
+    # step at a time. Subclasses choose the files with wants() and store what
+    # they extract from one with index_file().
+    def __init__(self, root, db_path, directories):
+        self.root = root
+        self.db_path = db_path
+        # Relative directories still to compare with the disk, "" being the
+        # project folder itself and None the whole project.
+        self.directories = deque(directories)
+        # The comparison under way, see _start_scan().
+        self.scan = None
+        # (path, mtime, size) of the files found to be new or changed.
+        self.pending = deque()
+
+    def wants(self, path, stat):
+        return True
+
+    @abc.abstractmethod
+    def index_file(self, connection, path, mtime, size):
+        # Stores path, which was forgotten just before; False when it could
+        # not be read.
+        ...
+
+    def forget(self, connection, path):
+        connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def step(self, task):
+        # Runs on the TaskRunner for up to STEP_TIME seconds; True while
+        # there is work left. A walk of the disk carries on where the last
+        # step left it. What a cancelled step did is rolled back and found
+        # again by the next sync.
+        try:
+            connection = connect(self.db_path)
+        except sqlite3.Error:
+            return False
+        deadline = time.monotonic() + STEP_TIME
+        try:
+            while time.monotonic() < deadline:
+                task.token.check()
+                if self.pending:
+                    path, mtime, size = self.pending.popleft()
+                    self.forget(connection, path)
+                    self.index_file(connection, path, mtime, size)
+                elif self.scan is not None:
+                    path = next(self.scan["walk"], None)
+                    if path is None:
+                        self._finish_scan(connection)
+                    else:
+                        self._add_file(self.scan["on_disk"], path)
+                elif self.directories:
+                    self._start_scan(connection, self.directories.popleft())
+                else:
+                    break
+            connection.commit()
+        except sqlite3.Error:
+            return False
+        finally:
+            connection.close()
+        return bool(self.pending or self.scan or self.directories)
+
+    def _start_scan(self, connection, rel_dir):
+        # Compares the files under rel_dir with the index: the files on disk
+        # are gathered into on_disk, a file per step of walk, and
+        # _finish_scan() then forgets those gone and queues those new or
+        # changed.
+        where, args = under(rel_dir or "")
+        indexed = {
+            path: (mtime, size)
+            for path, mtime, size in connection.execute(
+                f"SELECT path, mtime, size FROM files WHERE {where}", args
+            )
+        }
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        prefix = rel_dir + "/" if rel_dir else ""
+        files = ProjectFiles.for_root(self.root)
+
+        on_disk = {}
+        kept_dirs = []
+        if rel_dir is None or not os.path.isdir(abs_dir):
+            top = [abs_dir] if os.path.isdir(abs_dir) else []
+        else:
+            # Only this directory changed: its files are checked, and only its
+            # subdirectories the index knows nothing about are walked.
+            top = []
+            known = {path[len(prefix) :].split("/", 1)[0] for path in indexed}
+            dirs, paths = files.listing(abs_dir)
+            for path in paths:
+                self._add_file(on_disk, path)
+            for path in dirs:
+                name = os.path.basename(path)
+                if name in known:
+                    kept_dirs.append(f"{prefix}{name}/")
+                else:
+                    top.append(path)
+
+        self.scan = {
+            "indexed": indexed,
+            "on_disk": on_disk,
+            "kept_dirs": kept_dirs,
+            "walk": itertools.chain.from_iterable(
+                files.walk(directory) for directory in top
+            ),
+        }
+
+    def _finish_scan(self, connection):
+        indexed = self.scan["indexed"]
+        on_disk = self.scan["on_disk"]
+        kept_dirs = self.scan["kept_dirs"]
+        self.scan = None
+
+        removed = [
+            path
+            for path in indexed
+            if path not in on_disk
+            and not any(path.startswith(kept) for kept in kept_dirs)
+        ]
+        for path in removed:
+            self.forget(connection, path)
+
+        for path, stat in on_disk.items():
+            if indexed.get(path) != stat:
+                self.pending.append((path,) + stat)
+
+    def _add_file(self, on_disk, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if not self.wants(path, stat):
+            return
+        rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+        on_disk[rel] = (stat.st_mtime, stat.st_size)
+
+
+class ProjectIndex(QObject):
+    # An SQLite file per project under index_dir, so a project opened again
+    # only re-reads the files that changed since. create_schema(connection)
+    # sets up the tables and indexer_class, an Indexer, fills them, on the
+    # TaskRunner; lookups read whatever has been committed so far.
+    updated = pyqtSignal()
+
+    # Task keys, one per index.
+    _keys = itertools.count()
+
+    def __init__(self, index_dir, create_schema, indexer_class, parent=None):
+        super().__init__(parent)
+        self.index_dir = index_dir
+        self.create_schema = create_schema
+        self.indexer_class = indexer_class
+        self.root = None
+        self.db_path = None
+        self._connection = None
+        self._task_key = ("project-index", next(self._keys))
+        self._indexer = None
+        self._queued = []
+
+    def open(self, root):
+        self.close()
+        self.root = os.path.abspath(root)
+        key = hashlib.sha1(os.path.normcase(self.root).encode("utf-8")).hexdigest()
+        try:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            self.db_path = self.index_dir / f"{key[:16]}.sqlite3"
+            self._connection = connect(self.db_path)
+            self.create_schema(self._connection)
+        except (OSError, sqlite3.Error):
+            self._connection = None
+            self.root = None
+            return
+        self._queued.append(None)
+        self._start_indexer()
+
+    def close(self):
+        # Returns at once: a step still running stops before its next file.
+        TaskRunner.instance().cancel(self._task_key)
+        self._indexer = None
+        self._queued = []
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self.root = None
+
+    def refresh(self, path):
+        # Brings the index up to date for a changed directory, or for the
+        # directory of a changed file.
+        if self._connection is None or not path:
+            return
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        try:
+            rel = os.path.relpath(path, self.root)
+        except ValueError:
+            # Another drive on Windows.
+            return
+        if rel == os.curdir:
+            rel = ""
+        elif rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return
+        rel = rel.replace(os.sep, "/")
+
+        if rel not in self._queued:
+            self._queued.append(rel)
+        if self._indexer is None:
+            self._start_indexer()
+
+    def _start_indexer(self):
+        directories, self._queued = self._queued, []
+        if None in directories:
+            directories = [None]
+        self._indexer = self.indexer_class(self.root, self.db_path, directories)
+        self._submit_step()
+
+    def _submit_step(self):
+        indexer = self._indexer
+        TaskRunner.instance().submit(
+            self._task_key,
+            indexer.step,
+            on_result=partial(self._on_step_done, indexer),
+            on_error=lambda _message: self._on_step_done(indexer, False),
+            long_running=True,
+        )
+
+    def _on_step_done(self, indexer, more):
+        if indexer is not self._indexer:
+            return
+        self.updated.emit()
+        if more:
+            self._submit_step()
+            return
+        self._indexer = None
+        if self._queued:
+            self._start_indexer()
+
+    def is_indexing(self):
+        return self._indexer is not None
@@ -0,0 +1,252 @@
+import os
+from array import array
+
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt, QTimer
+from PyQt5.QtGui import QColor
+
+# Longest row text shown for a match.
+MAX_DISPLAY = 100
+# Added results reach the view at most every FLUSH_INTERVAL milliseconds,
+# plus one for every ROWS_PER_MS rows it already shows: each insertion has
+# the view lay out all of its expanded rows again.
+FLUSH_INTERVAL = 50
+ROWS_PER_MS = 50
+
+
+class _FileResults:
+    # The matches of one file, as parallel arrays with one entry per match.
+    # Matches on the same line share that line's text.
+    __slots__ = (
+        "row",
+        "path",
+        "label",
+        "lines",
+        "cols",
+        "lengths",
+        "text_ids",
+        "texts",
+    )
+
+    def __init__(self, path, label):
+        self.row = -1
+        self.path = path
+        self.label = label
+        self.lines = array("I")
+        self.cols = array("I")
+        self.lengths = array("I")
+        self.text_ids = array("I")
+        self.texts = []
+
+    def __len__(self):
+        return len(self.lines)
+
+
+class SearchResultsModel(QAbstractItemModel):
+    # Project search results for a QTreeView: a row per file, with a child
+    # row per match. A match costs four integers; its row text is only put
+    # together when the view paints it. At most max_results matches are
+    # kept, the rest of a search being dropped.
+    FILE_COLOR = QColor("#d7ba7d")
+
+    def __init__(self, parent=None, max_results=20000):
+        super().__init__(parent)
+        self.max_results = max_results
+        # Matches held, including those still waiting to be shown.
+        self.match_count = 0
+        # Whether matches were dropped for going over max_results.
+        self.truncated = False
+        self._root = ""
+        self._files = []
+        self._pending = []
+        self._shown_rows = 0
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush)
+
+    def clear(self, root=""):
+        # File rows are labelled with their path relative to root.
+        self._flush_timer.stop()
+        self.beginResetModel()
+        self._files = []
+        self._pending = []
+        self._shown_rows = 0
+        self.match_count = 0
+        self.truncated = False
+        self._root = root
+        self.endResetModel()
+
+    def add_files(self, batch):
+        # Queues a batch from search_files, [(filepath, [(line_idx, col,
+        # length, line_text), ...]), ...], for the next flush. Returns False
+        # once the results went over max_results.
+        room = self.max_results - self.match_count
+        for filepath, matches in batch:
+            if len(matches) > room:
+                matches = matches[:room]
+                self.truncated = True
+            if not matches:
+                break
+            label = os.path.relpath(filepath, self._root) if self._root else filepath
+            results = _FileResults(filepath, label)
+            text_ids = {}
+            for line_idx, col, length, line_text in matches:
+                text_id = text_ids.get(line_idx)
+                if text_id is None:
+                    text_id = text_ids[line_idx] = len(results.texts)
+                    results.texts.append(line_text)
+                results.lines.append(line_idx)
+                results.cols.append(col)
+                results.lengths.append(length)
+                results.text_ids.append(text_id)
+            self._pending.append(results)
+            self.match_count += len(results)
+            room -= len(results)
+        if self._pending and not self._flush_timer.isActive():
+            self._flush_timer.start(FLUSH_INTERVAL + self._shown_rows // ROWS_PER_MS)
+        return not self.truncated
+
+    def flush(self):
+        # Shows the queued results, in a single insertion.
+        self._flush_timer.stop()
+        if not self._pending:
+            return
+        first = len(self._files)
+        self.beginInsertRows(QModelIndex(), first, first + len(self._pending) - 1)
+        for row, results in enumerate(self._pending, first):
+            results.row = row
+            self._shown_rows += 1 + len(results)
+        self._files.extend(self._pending)
+        self._pending = []
+        self.endInsertRows()
+
+    def file_paths(self):
+        return [results.path for results in self._files + self._pending]
+
+    def file_index(self, index):
+        # The file row of index, itself when it is one.
+        results = index.internalPointer()
+        if results is None:
+            return index
+        return self.createIndex(results.row, 0)
+
+    def match_at(self, index):
+        # The match of a match row as a dict of path, line, col and len, None
+        # for a file row.
+        results = index.internalPointer()
+        if results is None:
+            return None
+        row = index.row()
+        return {
+            "path": results.path,
+            "line": results.lines[row],
+            "col": results.cols[row],
+            "len": results.lengths[row],
+        }
+
+    def shift_matches(self, index, end, new_end):
+        # After the match at index, which ended at end, a (line, col) pair,
+        # was replaced by text that ends at new_end, moves the matches after
+        # it in the file along with the text.
+        results = index.internalPointer()
+        end_line, end_col = end
+        new_line, new_col = new_end
+        changed = []
+        for i in range(index.row() + 1, len(results)):
+            line = results.lines[i]
+            if line == end_line:
+                results.cols[i] += new_col - end_col
+            results.lines[i] = line + new_line - end_line
+            changed.append(i)
+        if changed and (new_line, new_col) != (end_line, end_col):
+            self.dataChanged.emit(
+                self.createIndex(changed[0], 0, results),
+                self.createIndex(changed[-1], 0, results),
+            )
+
+    def remove_match(self, index):
+        # Removes a match row, and its file row along with its last match.
+        results = index.internalPointer()
+        if len(results) == 1:
+            self.remove_file(results.row)
+            return
+        row = index.row()
+        self.beginRemoveRows(self.createIndex(results.row, 0), row, row)
+        for column in (results.lines, results.cols, results.lengths, results.text_ids):
+            del column[row]
+        self.match_count -= 1
+        self._shown_rows -= 1
+        self.endRemoveRows()
+
+    def remove_file(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        results = self._files.pop(row)
+        for later in self._files[row:]:
+            later.row -= 1
+        self.match_count -= len(results)
+        self._shown_rows -= 1 + len(results)
+        self.endRemoveRows()
+
+    # index and hasChildren are called for every expanded row whenever the
+    # view lays itself out, so they stay short.
+    def index(self, row, column, parent=QModelIndex()):
+        if column != 0 or row < 0:
+            return QModelIndex()
+        if not parent.isValid():
+            if row >= len(self._files):
+                return QModelIndex()
+            return self.createIndex(row, 0)
+        # Match rows point at their file's results, file rows at nothing.
+        if parent.internalPointer() is not None:
+            return QModelIndex()
+        results = self._files[parent.row()]
+        if row >= len(results.lines):
+            return QModelIndex()
+        return self.createIndex(row, 0, results)
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        results = index.internalPointer()
+        if results is None:
+            return QModelIndex()
+        return self.createIndex(results.row, 0)
+
+    def hasChildren(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return bool(self._files)
+        # A file row always has a match.
+        return parent.internalPointer() is None
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self._files)
+        if parent.internalPointer() is None:
+            return len(self._files[parent.row()])
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        results = index.internalPointer()
+        if results is None:
+            results = self._files[index.row()]
+            if role == Qt.DisplayRole:
+                return results.label
+            if role == Qt.UserRole:
+                return results.path
+            if role == Qt.ForegroundRole:
+                return self.FILE_COLOR
+            return None
+        if role == Qt.DisplayRole:
+            row = index.row()
+            text = results.texts[results.text_ids[row]]
+            text = f"{results.lines[row] + 1}:{results.cols[row] + 1}: {text}"
+            if len(text) > MAX_DISPLAY:
+                text = text[:MAX_DISPLAY] + "..."
+            return text
+        if role == Qt.UserRole:
+            return self.match_at(index)
+        return None
@@ -1,77 +1,271 @@
+import mmap
 import os
+import re
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-from PyQt5.QtCore import QThread, pyqtSignal
-
-
-class SearchWorker(QThread):
-    file_matches_found = pyqtSignal(str, list)
-    finished = pyqtSignal()
-
-    def __init__(self, directory, term, match_case):
-        super().__init__()
-        self.directory = directory
-        self.term = term
-        self.match_case = match_case
-        self.is_running = True
-
-    def run(self):
-        term_cmp = self.term if self.match_case else self.term.lower()
-        ignore_dirs = {
-            ".git",
-            "__pycache__",
-            "node_modules",
-            "venv",
-            ".venv",
-            "dist",
-            "build",
-        }
-        ignore_exts = {
-            ".png",
-            ".jpg",
-            ".jpeg",
-            ".gif",
-            ".ico",
-            ".exe",
-            ".dll",
-            ".so",
-            ".pyc",
-            ".mp4",
-            ".mp3",
-            ".wav",
-            ".zip",
-            ".tar",
-            ".gz",
-        }
-
-        for root, dirs, files in os.walk(self.directory):
-            if not self.is_running:
-                break
-            dirs[:] = [d for d in dirs if d not in ignore_dirs]
-
-            for file in files:
-                if not self.is_running:
-                    break
-                ext = os.path.splitext(file)[1].lower()
-                if ext in ignore_exts:
-                    continue
-
-                filepath = os.path.join(root, file)
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        lines = f.readlines()
-
-                    file_matches = []
-                    for line_idx, line in enumerate(lines):
-                        line_cmp = line if self.match_case else line.lower()
-                        if term_cmp in line_cmp:
-                            file_matches.append((line_idx, line.strip()))
-
-                    if file_matches:
-                        self.file_matches_found.emit(filepath, file_matches)
-                except Exception:
-                    pass
-
-        self.finished.emit()
-
-    def stop(self):
-        self.is_running = False
+from .project_files import SNIFF_SIZE, ProjectFiles, has_binary_ext, looks_binary
+
+# Files are read by a pool of threads, which spend most of their time in
+# I/O and in bytes.find, both without the GIL. Each job is a run of
+# FILES_PER_JOB files, so handing work over costs little next to the work;
+# at most IN_FLIGHT jobs per thread are queued ahead of the one whose
+# results are reported next, so results come in walk order.
+MAX_THREADS = 8
+FILES_PER_JOB = 32
+IN_FLIGHT = 4
+# Files from this size on are searched through a memory map.
+MMAP_MIN_SIZE = 1024 * 1024
+# Matches are reported in batches, at most this far apart in seconds.
+BATCH_INTERVAL = 0.05
+# Longest line text sent along with a match.
+MAX_PREVIEW = 200
+
+# What to search for. include and exclude are comma separated globs; see
+# compile_globs.
+SearchQuery = namedtuple(
+    "SearchQuery", "term match_case regex whole_word include exclude"
+)
+
+
+def compile_pattern(query):
+    # The query as a regular expression; raises re.error for an invalid one.
+    pattern = query.term if query.regex else re.escape(query.term)
+    if query.whole_word:
+        pattern = rf"\b(?:{pattern})\b"
+    flags = re.MULTILINE
+    if not query.match_case:
+        flags |= re.IGNORECASE
+    return re.compile(pattern, flags)
+
+
+def compile_replacement(query, template):
+    # Function giving the replacement for a match of query, for pattern.sub.
+    # With a regular expression, \1 and \g<name> in template insert groups of
+    # the match; otherwise template is taken literally. Raises re.error for a
+    # template the pattern cannot fill in.
+    if not query.regex:
+        return lambda _match: template
+    try:
+        # Parsing the template does not need a match.
+        compile_pattern(query).sub(template, "")
+    except IndexError as e:
+        # An unknown group name.
+        raise re.error(str(e)) from None
+    return lambda match: match.expand(template)
+
+
+def _glob_regex(glob):
+    # Like fnmatch, except that * and ? stay within a directory and **
+    # spans any number of them.
+    parts = []
+    i = 0
+    while i < len(glob):
+        if glob.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif glob.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        else:
+            char = glob[i]
+            if char == "*":
+                parts.append("[^/]*")
+            elif char == "?":
+                parts.append("[^/]")
+            else:
+                parts.append(re.escape(char))
+            i += 1
+    return "".join(parts)
+
+
+def compile_globs(text):
+    # Matcher of "/"-separated paths relative to the project for a comma
+    # separated list of globs, None for an empty list. A glob without a "/"
+    # matches a file or directory name anywhere ("*.py", "tests"); one with
+    # a "/" matches from the project folder ("src/**/*.py", "docs/"). Files
+    # inside a matched directory match too.
+    alternatives = []
+    for glob in text.split(","):
+        glob = glob.strip().replace("\\", "/").strip("/")
+        if not glob:
+            continue
+        regex = _glob_regex(glob) + "(?:/.*)?"
+        if "/" not in glob:
+            regex = "(?:.*/)?" + regex
+        alternatives.append(f"(?:{regex})")
+    if not alternatives:
+        return None
+    return re.compile("|".join(alternatives), re.DOTALL).fullmatch
+
+
+def _matching_spans(text, pattern):
+    # [(line_idx, col, length, line_text), ...] for the matches of pattern in
+    # text, lines numbered and columns counted the way the editor does, with
+    # the stripped text of the line for display. A match running into the
+    # next lines is cut at the end of the one it starts on.
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    spans = []
+    line_idx = 0
+    counted = 0
+    line_start = 0
+    line_end = -1
+    line_text = ""
+    for match in pattern.finditer(text):
+        start, end = match.span()
+        if start == end:
+            continue
+        if start > line_end:
+            line_start = text.rfind("\n", 0, start) + 1
+            line_end = text.find("\n", start)
+            if line_end == -1:
+                line_end = len(text)
+            line_idx += text.count("\n", counted, line_start)
+            counted = line_start
+            line_text = text[line_start:line_end].strip()[:MAX_PREVIEW]
+        length = min(end, line_end) - start
+        if length > 0:
+            spans.append((line_idx, start - line_start, length, line_text))
+    return spans
+
+
+def _search_file(filepath, pattern, prefilter, match_case):
+    # (filepath, matches), with matches None unless the file is UTF-8 text
+    # and matches pattern. The raw bytes are checked for the encoded term
+    # before anything is decoded; prefilter is None when that check cannot be
+    # made on bytes.
+    try:
+        with open(filepath, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return filepath, None
+            if prefilter is not None and match_case and size >= MMAP_MIN_SIZE:
+                # Large files without the term are never copied into memory.
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if looks_binary(mapped[:SNIFF_SIZE]):
+                        return filepath, None
+                    if mapped.find(prefilter) == -1:
+                        return filepath, None
+                    data = mapped[:]
+            else:
+                data = f.read()
+                if looks_binary(data):
+                    return filepath, None
+                if prefilter is not None:
+                    folded = data if match_case else data.lower()
+                    if folded.find(prefilter) == -1:
+                        return filepath, None
+        matches = _matching_spans(data.decode("utf-8"), pattern)
+    except (OSError, ValueError):
+        return filepath, None
+    return filepath, matches or None
+
+
+def _ruled_out(filepath, rel, index):
+    # True when the index shows the file lacks the term and the file has not
+    # changed since it was indexed.
+    indexed, candidates = index
+    if rel in candidates:
+        return False
+    indexed_stat = indexed.get(rel)
+    if indexed_stat is None:
+        return False
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return True
+    return (st.st_mtime, st.st_size) == indexed_stat
+
+
+def _search_job(filepaths, pattern, prefilter, match_case):
+    return [
+        _search_file(filepath, pattern, prefilter, match_case) for filepath in filepaths
+    ]
+
+
+def search_files(task, directory, query, narrow=None):
+    # Runs on the TaskRunner. Files with matches are reported in batches as
+    # [(filepath, [(line_idx, col, length, line_text), ...]), ...]. narrow,
+    # when given, maps the lowercased term to what a trigram index knows of
+    # the project; see trigram_index.candidate_files.
+    pattern = compile_pattern(query)
+    include = compile_globs(query.include)
+    exclude = compile_globs(query.exclude)
+    term = query.term
+    match_case = query.match_case
+    if query.regex:
+        # What a regular expression matches has no fixed bytes to look for.
+        prefilter = None
+    elif match_case:
+        prefilter = term.encode("utf-8")
+    elif term.isascii():
+        # bytes.lower() only folds ASCII, which is all an ASCII term needs.
+        prefilter = term.lower().encode("utf-8")
+    else:
+        prefilter = None
+    index = None
+    if narrow is not None and prefilter is not None:
+        index = narrow(prefilter.lower())
+
+    threads = min(MAX_THREADS, (os.cpu_count() or 1) + 2)
+    pending = deque()
+    batch = []
+    last_report = time.monotonic()
+
+    def flush():
+        nonlocal batch, last_report
+        if batch:
+            task.report(batch)
+            batch = []
+        last_report = time.monotonic()
+
+    def collect(future):
+        for filepath, matches in future.result():
+            if matches:
+                batch.append((filepath, matches))
+        if time.monotonic() - last_report >= BATCH_INTERVAL:
+            flush()
+
+    def submit(job):
+        pending.append(
+            executor.submit(_search_job, job, pattern, prefilter, match_case)
+        )
+
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="search")
+    try:
+        job = []
+        files = ProjectFiles.for_root(directory)
+        # Paths from walk() all start with this.
+        prefix_len = len(os.path.join(files.root, ""))
+        for filepath in files.walk(token=task.token):
+            if has_binary_ext(filepath):
+                continue
+            rel = filepath[prefix_len:].replace(os.sep, "/")
+            if include is not None and not include(rel):
+                continue
+            if exclude is not None and exclude(rel):
+                continue
+            # Checked here rather than on the pool: a stat is cheaper than
+            # handing the file over.
+            if index is not None and _ruled_out(filepath, rel, index):
+                continue
+            job.append(filepath)
+            if len(job) < FILES_PER_JOB:
+                continue
+            task.token.check()
+            submit(job)
+            job = []
+            while len(pending) > threads * IN_FLIGHT or (
+                pending and pending[0].done()
+            ):
+                collect(pending.popleft())
+        if job:
+            submit(job)
+        while pending:
+            task.token.check()
+            collect(pending.popleft())
+        flush()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
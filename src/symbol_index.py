@@ -0,0 +1,247 @@
+import ast
+import os
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+
+from .project_index import Indexer, ProjectIndex, connect
+
+INDEX_DIR = Path.home() / ".lumos_editor" / "symbols"
+# Bumped whenever the tables or what goes into them change; older indexes
+# are then rebuilt from scratch.
+SCHEMA_VERSION = 1
+
+INDEXED_EXTS = {".py", ".pyw", ".pyi"}
+# Larger files are nearly always generated and not worth the parse.
+MAX_FILE_SIZE = 2 * 1024 * 1024
+
+Symbol = namedtuple("Symbol", "name kind path line container")
+
+# Statements whose bodies are still part of the enclosing scope.
+_BLOCKS = tuple(
+    getattr(ast, name)
+    for name in (
+        "If",
+        "Try",
+        "TryStar",
+        "With",
+        "AsyncWith",
+        "For",
+        "AsyncFor",
+        "While",
+    )
+    if hasattr(ast, name)
+)
+
+
+def extract_symbols(source):
+    # (name, kind, line, container) for the classes, functions, imports and
+    # module level variables of a Python source. Lines are 0-based, like the
+    # editor's.
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+
+    symbols = []
+
+    def visit(node, container, scope):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.ClassDef):
+                symbols.append((child.name, "class", child.lineno - 1, container))
+                visit(child, qualify(container, child.name), "class")
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                kind = "method" if scope == "class" else "function"
+                symbols.append((child.name, kind, child.lineno - 1, container))
+                visit(child, qualify(container, child.name), "function")
+            elif scope != "module":
+                if isinstance(child, _BLOCKS):
+                    visit(child, container, scope)
+            elif isinstance(child, (ast.Import, ast.ImportFrom)):
+                for alias in child.names:
+                    if alias.name == "*":
+                        continue
+                    name = alias.asname or alias.name.split(".")[0]
+                    symbols.append((name, "import", child.lineno - 1, container))
+            elif isinstance(child, (ast.Assign, ast.AnnAssign)):
+                targets = (
+                    child.targets if isinstance(child, ast.Assign) else [child.target]
+                )
+                for target in targets:
+                    for name in ast.walk(target):
+                        if isinstance(name, ast.Name):
+                            symbols.append(
+                                (name.id, "variable", child.lineno - 1, container)
+                            )
+            elif isinstance(child, _BLOCKS):
+                # Definitions guarded by a version check or an ImportError
+                # fallback still belong to the enclosing scope.
+                visit(child, container, scope)
+
+    def qualify(container, name):
+        return f"{container}.{name}" if container else name
+
+    visit(tree, "", "module")
+    return symbols
+
+
+def _create_schema(connection):
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version == SCHEMA_VERSION:
+        return
+    connection.executescript(f"""
+        DROP TABLE IF EXISTS files;
+        DROP TABLE IF EXISTS symbols;
+        CREATE TABLE files (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL
+        );
+        CREATE TABLE symbols (
+            name TEXT NOT NULL,
+            lower TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            line INTEGER NOT NULL,
+            container TEXT NOT NULL
+        );
+        CREATE INDEX symbols_lower ON symbols (lower);
+        CREATE INDEX symbols_path ON symbols (path);
+        PRAGMA user_version = {SCHEMA_VERSION};
+    """)
+    connection.commit()
+
+
+class _Indexer(Indexer):
+    def wants(self, path, stat):
+        if os.path.splitext(path)[1].lower() not in INDEXED_EXTS:
+            return False
+        return stat.st_size <= MAX_FILE_SIZE
+
+    def index_file(self, connection, path, mtime, size):
+        try:
+            with open(os.path.join(self.root, path), "rb") as f:
+                source = f.read()
+        except OSError:
+            return False
+        connection.executemany(
+            "INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (name, name.lower(), kind, path, line, container)
+                for name, kind, line, container in extract_symbols(source)
+            ],
+        )
+        connection.execute("INSERT INTO files VALUES (?, ?, ?)", (path, mtime, size))
+        return True
+
+    def forget(self, connection, path):
+        connection.execute("DELETE FROM symbols WHERE path = ?", (path,))
+        super().forget(connection, path)
+
+
+def fuzzy_score(query, name):
+    # Lower is better; None when the letters of query do not appear in name
+    # in order. Prefix matches come first, then substrings, then the tightest
+    # subsequences.
+    lower = name.lower()
+    if lower.startswith(query):
+        return (0, len(name))
+    found = lower.find(query)
+    if found >= 0:
+        return (1, found, len(name))
+    gaps = 0
+    pos = -1
+    for char in query:
+        next_pos = lower.find(char, pos + 1)
+        if next_pos < 0:
+            return None
+        if pos >= 0 and next_pos != pos + 1:
+            gaps += 1
+        pos = next_pos
+    return (2, gaps, len(name))
+
+
+def search_symbols(task, root, db_path, query, limit):
+    # Fuzzy lookup for Go to Symbol: the letters of query in order, anywhere
+    # in the name, best first. Called on the TaskRunner with its own
+    # connection.
+    query = query.strip().lower()
+    try:
+        connection = connect(db_path)
+    except sqlite3.Error:
+        return []
+    try:
+        if not query:
+            rows = connection.execute(
+                "SELECT name, kind, path, line, container FROM symbols "
+                "WHERE kind != 'import' ORDER BY lower LIMIT ?",
+                (limit,),
+            ).fetchall()
+        else:
+            escaped = ["\\" + char if char in "%_\\" else char for char in query]
+            pattern = "%" + "%".join(escaped) + "%"
+            rows = connection.execute(
+                "SELECT name, kind, path, line, container FROM symbols "
+                "WHERE lower LIKE ? ESCAPE '\\' AND kind != 'import' LIMIT 20000",
+                (pattern,),
+            ).fetchall()
+    except sqlite3.Error:
+        return []
+    finally:
+        connection.close()
+
+    if query:
+        scored = []
+        for i, row in enumerate(rows):
+            if i % 2000 == 0:
+                task.token.check()
+            score = fuzzy_score(query, row[0])
+            if score is not None:
+                scored.append((score, row))
+        scored.sort(key=lambda item: (item[0], item[1][0], item[1][2]))
+        rows = [row for _score, row in scored[:limit]]
+    return [
+        Symbol(name, kind, os.path.join(root, path), line, container)
+        for name, kind, path, line, container in rows
+    ]
+
+
+class SymbolIndex(ProjectIndex):
+    # Definitions of the open project, kept in an SQLite file under
+    # ~/.lumos_editor/symbols so a project opened again only re-parses the
+    # files that changed since.
+    def __init__(self, parent=None):
+        super().__init__(INDEX_DIR, _create_schema, _Indexer, parent)
+
+    def _symbols(self, rows):
+        return [
+            Symbol(name, kind, os.path.join(self.root, path), line, container)
+            for name, kind, path, line, container in rows
+        ]
+
+    def lookup(self, prefix, limit=100):
+        # Symbols starting with prefix, ignoring case, shortest first.
+        if self._connection is None or not prefix:
+            return []
+        lower = prefix.lower()
+        try:
+            rows = self._connection.execute(
+                "SELECT name, kind, path, line, container FROM symbols "
+                "WHERE lower >= ? AND lower < ? "
+                "ORDER BY length(name), name LIMIT ?",
+                (lower, lower + "\uffff", limit),
+            ).fetchall()
+        except sqlite3.Error:
+            return []
+        return self._symbols(rows)
+
+    def searcher(self):
+        # search_symbols bound to this index, for the TaskRunner; None while
+        # no project is indexed.
+        if self._connection is None:
+            return None
+        root = self.root
+        db_path = self.db_path
+        return lambda task, query, limit: search_symbols(
+            task, root, db_path, query, limit
+        )
@@ -0,0 +1,17 @@
+import os
+
+from PyQt5.QtWidgets import QWidget
+
+
+class TabPlaceholder(QWidget):
+    # Stands in for a tab restored from the last session until it is first
+    # shown; MainWindow.materialize_tab then opens the file in its place.
+    def __init__(self, filepath, parent=None):
+        super().__init__(parent)
+        self.is_modified = None
+        self.editor = None
+        self.filepath = filepath
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        self.tabname = (
+            name[:27] + "..." if len(name) > 26 else os.path.basename(filepath)
+        )
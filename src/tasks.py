@@ -0,0 +1,179 @@
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, pyqtSignal
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    # Cancelled from the GUI thread, checked by the task wherever it can stop
+    # cleanly: between files, between chunks of a response.
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise TaskCancelled()
+
+
+class _TaskSignals(QObject):
+    progress = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    done = pyqtSignal()
+
+
+class Task(QRunnable):
+    # Runs fn(task, *args) on the pool. The function reports partial results
+    # with task.report() and returns the final one; both only reach the GUI
+    # thread while the task is neither cancelled nor stale.
+    def __init__(self, key, fn, args, stamp=None):
+        super().__init__()
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.token = CancelToken()
+        self.stamp = stamp
+        self.version = stamp() if stamp is not None else None
+        self.signals = _TaskSignals()
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled
+
+    def cancel(self):
+        self.token.cancel()
+
+    def report(self, value):
+        if not self.token.cancelled:
+            self.signals.progress.emit(value)
+
+    def run(self):
+        try:
+            if self.token.cancelled:
+                return
+            try:
+                result = self.fn(self, *self.args)
+            except TaskCancelled:
+                return
+            except Exception as e:
+                if not self.token.cancelled:
+                    self.signals.failed.emit(str(e) or type(e).__name__)
+                return
+            if not self.token.cancelled:
+                self.signals.finished.emit(result)
+        finally:
+            self.signals.done.emit()
+
+
+class TaskRunner(QObject):
+    # Shared by all background work in the editor: a bounded pool of threads
+    # that are reused instead of started per job, at most one live task per
+    # key, and results checked against the caller's version stamp on arrival.
+    # Submitting a task under a key that already has one cancels the older
+    # task; whatever it still produces is dropped.
+    MAX_THREADS = 4
+    # Tasks submitted with long_running=True, which last as long as a stream
+    # or a walk of the whole project does, run on a pool of their own, so that
+    # short ones such as saves and style jobs never queue behind them.
+    MAX_LONG_THREADS = 4
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(
+            max(2, min(self.MAX_THREADS, QThread.idealThreadCount()))
+        )
+        self._long_pool = QThreadPool(self)
+        self._long_pool.setMaxThreadCount(self.MAX_LONG_THREADS)
+        self._current = {}
+        # Python references to queued and running tasks, the pool only keeps
+        # the C++ side alive.
+        self._running = set()
+
+    def submit(
+        self,
+        key,
+        fn,
+        *args,
+        on_progress=None,
+        on_result=None,
+        on_error=None,
+        stamp=None,
+        long_running=False,
+    ):
+        # stamp, when given, is called now and again when a result arrives;
+        # results are dropped if the two values differ, e.g. when the
+        # document was edited in between.
+        self.cancel(key)
+        task = Task(key, fn, args, stamp)
+        task.signals.progress.connect(
+            lambda value: self._deliver(task, on_progress, value, False)
+        )
+        task.signals.finished.connect(
+            lambda value: self._deliver(task, on_result, value, True)
+        )
+        task.signals.failed.connect(
+            lambda message: self._deliver(task, on_error, message, True)
+        )
+        task.signals.done.connect(lambda: self._on_done(task))
+        self._current[key] = task
+        self._running.add(task)
+        (self._long_pool if long_running else self._pool).start(task)
+        return task
+
+    def cancel(self, key):
+        task = self._current.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def cancel_all(self):
+        for key in list(self._current):
+            self.cancel(key)
+
+    def is_running(self, key):
+        return key in self._current
+
+    def _is_current(self, task):
+        if task.cancelled or self._current.get(task.key) is not task:
+            return False
+        try:
+            return task.stamp is None or task.stamp() == task.version
+        except RuntimeError:
+            return False
+
+    def _deliver(self, task, callback, value, last):
+        if not self._is_current(task):
+            return
+        if last:
+            del self._current[task.key]
+        if callback is None:
+            return
+        try:
+            callback(value)
+        except RuntimeError:
+            # The widget waiting for the result was deleted meanwhile.
+            pass
+
+    def _on_done(self, task):
+        self._running.discard(task)
+        if self._current.get(task.key) is task:
+            # Finished without a result being delivered, e.g. it went stale.
+            del self._current[task.key]
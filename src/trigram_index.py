@@ -0,0 +1,149 @@
+import os
+import sqlite3
+from pathlib import Path
+
+from .project_files import has_binary_ext, looks_binary
+from .project_index import Indexer, ProjectIndex, connect
+
+INDEX_DIR = Path.home() / ".lumos_editor" / "trigrams"
+# Bumped whenever the tables or what goes into them change; older indexes
+# are then rebuilt from scratch.
+SCHEMA_VERSION = 1
+
+# Larger files are searched without the index.
+MAX_FILE_SIZE = 1024 * 1024
+# A query intersects the postings of at most this many of the term's
+# trigrams, evenly picked; more rarely narrow it any further.
+MAX_QUERY_TRIGRAMS = 8
+
+
+def trigrams(data):
+    # The distinct three byte sequences of data, which the caller has already
+    # lowercased. Repeated lines are only looked at once, and no sequence
+    # spans a line break, since a search term never holds one.
+    grams = set()
+    for line in set(data.split(b"\n")):
+        grams.update(line[i : i + 3] for i in range(len(line) - 2))
+    return grams
+
+
+def _create_schema(connection):
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version == SCHEMA_VERSION:
+        return
+    connection.executescript(f"""
+        DROP TABLE IF EXISTS files;
+        DROP TABLE IF EXISTS trigrams;
+        CREATE TABLE files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            grams BLOB NOT NULL
+        );
+        CREATE TABLE trigrams (
+            gram BLOB NOT NULL,
+            file INTEGER NOT NULL,
+            PRIMARY KEY (gram, file)
+        ) WITHOUT ROWID;
+        PRAGMA user_version = {SCHEMA_VERSION};
+    """)
+    connection.commit()
+
+
+class _Indexer(Indexer):
+    def wants(self, path, stat):
+        if has_binary_ext(path):
+            return False
+        return 0 < stat.st_size <= MAX_FILE_SIZE
+
+    def index_file(self, connection, path, mtime, size):
+        try:
+            with open(os.path.join(self.root, path), "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+        # A binary file is recorded without trigrams, which rules it out of
+        # every search, as search_files would.
+        grams = [] if looks_binary(data) else sorted(trigrams(data.lower()))
+        # The file's own trigrams are kept with it, so that forgetting it
+        # only deletes its postings.
+        cursor = connection.execute(
+            "INSERT INTO files (path, mtime, size, grams) VALUES (?, ?, ?, ?)",
+            (path, mtime, size, b"".join(grams)),
+        )
+        file_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO trigrams VALUES (?, ?)", [(gram, file_id) for gram in grams]
+        )
+        return True
+
+    def forget(self, connection, path):
+        row = connection.execute(
+            "SELECT id, grams FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return
+        file_id, grams = row
+        connection.executemany(
+            "DELETE FROM trigrams WHERE gram = ? AND file = ?",
+            [(grams[i : i + 3], file_id) for i in range(0, len(grams), 3)],
+        )
+        super().forget(connection, path)
+
+
+def candidate_files(db_path, needle):
+    # (indexed, candidates) for a search of needle, lowercased bytes: the
+    # stat of every indexed file by relative path, and the paths of those
+    # holding all of needle's trigrams. Files missing from indexed, or whose
+    # stat changed since, must still be searched. None when the index cannot
+    # narrow the search. Called on the search thread with its own connection.
+    grams = sorted(trigrams(needle))
+    if not grams:
+        return None
+    if len(grams) > MAX_QUERY_TRIGRAMS:
+        step = len(grams) / MAX_QUERY_TRIGRAMS
+        grams = [grams[int(i * step)] for i in range(MAX_QUERY_TRIGRAMS)]
+    query = " INTERSECT ".join(
+        ["SELECT file FROM trigrams WHERE gram = ?"] * len(grams)
+    )
+    try:
+        connection = connect(db_path)
+    except sqlite3.Error:
+        return None
+    try:
+        indexed = {}
+        paths = {}
+        for file_id, path, mtime, size in connection.execute(
+            "SELECT id, path, mtime, size FROM files"
+        ):
+            indexed[path] = (mtime, size)
+            paths[file_id] = path
+        candidates = {
+            paths[file_id]
+            for (file_id,) in connection.execute(query, grams)
+            if file_id in paths
+        }
+    except sqlite3.Error:
+        return None
+    finally:
+        connection.close()
+    return indexed, candidates
+
+
+class TrigramIndex(ProjectIndex):
+    # Which files of the open project hold which three byte sequences, ASCII
+    # letters folded to lowercase, in an SQLite file under
+    # ~/.lumos_editor/trigrams. Project search asks it for the files holding
+    # every trigram of the term and skips the others, unless they changed
+    # since they were indexed.
+    def __init__(self, parent=None):
+        super().__init__(INDEX_DIR, _create_schema, _Indexer, parent)
+
+    def narrower(self):
+        # candidate_files bound to this index, for search_files; None while
+        # no project is indexed.
+        if self._connection is None:
+            return None
+        db_path = self.db_path
+        return lambda needle: candidate_files(db_path, needle)
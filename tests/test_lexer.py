@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest  # noqa: E402
+from PyQt5.Qsci import QsciScintilla  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from src.lexer import MarkdownLexer  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication(sys.argv)
+
+
+def markdown_document(sections):
+    return "".join(
+        f"## Section {i}\n\nSome *emphasis* and `code {i}`.\n\n```\nfenced {i}\n```\n"
+        for i in range(sections)
+    )
+
+
+def styles(editor, start, end):
+    return bytes(
+        editor.SendScintilla(QsciScintilla.SCI_GETSTYLEAT, pos)
+        for pos in range(start, end)
+    )
+
+
+def wait_until(app, condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        app.processEvents()
+        time.sleep(0.001)
+    return True
+
+
+def test_scrolling_far_past_the_lexed_lines_settles(app):
+    # A viewport more than MAX_RESUME_DISTANCE lines past the lexed frontier
+    # is styled provisionally first. The exact pass has to catch up with it
+    # from idle time, rather than the viewport being restyled forever.
+    text = markdown_document(1500)
+    editor = QsciScintilla()
+    editor.resize(800, 600)
+    lexer = MarkdownLexer(editor)
+    editor.setLexer(lexer)
+    editor.setText(text)
+    editor.show()
+
+    jobs = []
+    start_style_job = lexer._start_style_job
+
+    def counted(*args, **kwargs):
+        jobs.append(args)
+        return start_style_job(*args, **kwargs)
+
+    lexer._start_style_job = counted
+    assert wait_until(app, lambda: lexer._style_task is None)
+
+    first_line = 8000
+    assert first_line > MarkdownLexer.MAX_RESUME_DISTANCE
+    editor.setFirstVisibleLine(first_line)
+    assert wait_until(
+        app, lambda: not lexer._pending_ranges and lexer._style_task is None
+    )
+    assert len(jobs) < 100
+
+    expected_editor = QsciScintilla()
+    expected_lexer = MarkdownLexer(expected_editor)
+    expected_editor.setLexer(expected_lexer)
+    expected_editor.setText(text)
+    expected_lexer._do_style_text(0, expected_editor.length())
+
+    start, end = lexer._visible_range()
+    assert styles(editor, start, end) == styles(expected_editor, start, end)